@@ -18,17 +18,25 @@ setup(
     url="http://github.com/ilovetux/slither",
     packages=['slither'],
     install_requires=["croniter"],
+    extras_require={
+        "arrow": ["pyarrow"],
+    },
     entry_points={
         "console_scripts": [
             "sl-syslog=slither.syslog_server:main",
             "ginsu=slither.ginsu:cli",
+            "ginsu-bench=slither.bench:cli",
             "slither=slither:main",
         ],
         "ginsu.plugin": [
             "python=slither.ginsu:python_plugin",
             "lambda=slither.ginsu:lambda_plugin",
+            "reducer=slither.reducers:reducer_plugin",
             # "syslog=slither:syslog_server",
         ],
+        "slyce.plugin": [
+            "regex=slither.slyce:regex_plugin",
+        ],
     },
     test_suite="nose.collector",
     tests_require=tests_require,
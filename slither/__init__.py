@@ -1,4 +1,7 @@
-from .slither import (
-    main,
-    __version__,
-)
+def __getattr__(name):
+    # slither.slither pulls in lxml, croniter, pandas and cherrypy so
+    # only import it when asked, keeping ginsu and slyce startup fast.
+    if name in ("main", "__version__"):
+        from . import slither
+        return getattr(slither, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
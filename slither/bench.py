@@ -0,0 +1,258 @@
+"""Benchmarks for ginsu.
+
+ginsu-bench generates deterministic synthetic logs and times a set
+of representative ginsu pipelines over them. Each scenario is run in
+a fresh process so that its wall time includes startup and its peak
+RSS is its own. Results are written as JSON lines so that runs of
+different versions can be compared:
+
+    $ ginsu-bench generate apache -s 100MB -o access.log
+    $ ginsu-bench run --size 200MB --output before.jsonl
+    $ # upgrade slither
+    $ ginsu-bench run --size 200MB --output after.jsonl
+    $ ginsu-bench compare before.jsonl after.jsonl
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import platform
+import subprocess
+from datetime import datetime, timedelta
+import click
+
+FORMATS = ("syslog", "apache", "json", "xml")
+EPOCH = datetime(2018, 1, 1)
+HOSTS = ["web-{:02d}".format(i) for i in range(12)]
+PROGRAMS = ["sshd", "cron", "nginx", "kernel", "app"]
+LEVELS = ["DEBUG"] * 20 + ["INFO"] * 65 + ["WARNING"] * 10 + ["ERROR"] * 5
+PATHS = ["/", "/login", "/api/items", "/api/items/{}", "/static/app.js", "/search?q={}"]
+STATUSES = [200] * 85 + [301, 304] * 3 + [404] * 6 + [500] * 3
+MESSAGES = [
+    "request served",
+    "cache miss for key {}",
+    "user {} logged in",
+    "connection timeout after {}s",
+    "retrying job {}",
+    "disk usage at {}%",
+]
+
+
+def _syslog(rng, ts, i):
+    return "{} {} {}[{}]: {} {}".format(
+        ts.strftime("%b %d %H:%M:%S"),
+        rng.choice(HOSTS),
+        rng.choice(PROGRAMS),
+        rng.randint(100, 65535),
+        rng.choice(LEVELS),
+        rng.choice(MESSAGES).format(rng.randint(1, 5000)),
+    )
+
+def _apache(rng, ts, i):
+    return '10.{}.{}.{} - - [{} +0000] "{} {} HTTP/1.1" {} {} "-" "Mozilla/5.0"'.format(
+        rng.randint(0, 3), rng.randint(0, 255), rng.randint(1, 254),
+        ts.strftime("%d/%b/%Y:%H:%M:%S"),
+        rng.choice(["GET"] * 8 + ["POST", "PUT"]),
+        rng.choice(PATHS).format(rng.randint(1, 10000)),
+        rng.choice(STATUSES),
+        rng.randint(0, 100000),
+    )
+
+def _json(rng, ts, i):
+    return json.dumps({
+        "ts": ts.isoformat(),
+        "level": rng.choice(LEVELS),
+        "host": rng.choice(HOSTS),
+        "msg": rng.choice(MESSAGES).format(rng.randint(1, 5000)),
+        "req": {"id": i, "ms": rng.randint(1, 3000), "status": rng.choice(STATUSES)},
+    })
+
+def _xml(rng, ts, i):
+    return (
+        '<event ts="{}" level="{}"><host>{}</host><msg>{}</msg>'
+        '<req id="{}"><ms>{}</ms><status>{}</status></req></event>'
+    ).format(
+        ts.isoformat(),
+        rng.choice(LEVELS),
+        rng.choice(HOSTS),
+        rng.choice(MESSAGES).format(rng.randint(1, 5000)),
+        i,
+        rng.randint(1, 3000),
+        rng.choice(STATUSES),
+    )
+
+GENERATORS = {
+    "syslog": _syslog,
+    "apache": _apache,
+    "json": _json,
+    "xml": _xml,
+}
+
+def generate(fmt: str, size: int, fout, seed: int=0):
+    """Write at least size bytes of fmt log lines to the binary file
+    fout. The same fmt, size and seed always produce the same bytes.
+    Returns the number of lines written.
+    """
+    rng = random.Random(seed)
+    line_func = GENERATORS[fmt]
+    written = lines = 0
+    block = []
+    while written < size:
+        ts = EPOCH + timedelta(seconds=lines)
+        line = (line_func(rng, ts, lines) + "\n").encode()
+        block.append(line)
+        written += len(line)
+        lines += 1
+        if len(block) >= 10000:
+            fout.write(b"".join(block))
+            block = []
+    fout.write(b"".join(block))
+    return lines
+
+def parse_size(size):
+    """Parse sizes such as 512, 64KB, 100MB or 2GB into bytes."""
+    size = str(size).strip().upper()
+    for suffix, factor in (("GB", 1 << 30), ("MB", 1 << 20), ("KB", 1 << 10), ("B", 1)):
+        if size.endswith(suffix):
+            return int(float(size[:-len(suffix)]) * factor)
+    return int(size)
+
+
+# (name, format, ginsu arguments) where {src} is replaced with the
+# generated file.
+SCENARIOS = [
+    ("map-lambda", "syslog", ["map", "{src}", "-m", "lambda://x.upper()"]),
+    ("filter-lambda", "syslog", ["filter", "{src}", "-f", "lambda://'ERROR' in x"]),
+    ("filter-regex", "syslog", ["filter", "{src}", "-f", "regex://ERROR", "-f", r"regex://timeout after \d+s", "--or"]),
+    ("filter-regex-jobs", "syslog", ["filter", "{src}", "-f", "regex://ERROR", "-j", "{jobs}", "--chunk-size", "{chunk}"]),
+    ("filter-apache-5xx", "apache", ["filter", "{src}", "-f", r'regex://" 5\d\d ']),
+    ("filter-json", "json", ["filter", "{src}", "-f", 'regex://"level": "ERROR"']),
+    ("filter-xml", "xml", ["filter", "{src}", "-f", 'regex://level="ERROR"']),
+    ("reduce-count", "syslog", ["reduce", "{src}", "-r", "reducer://count"]),
+    ("reduce-top-ip", "apache", ["reduce", "{src}", "-r", "reducer://top?field=0&k=10"]),
+    ("reduce-distinct-ip", "apache", ["reduce", "{src}", "-r", "reducer://distinct?field=0"]),
+    ("reduce-top-ip-jobs", "apache", ["reduce", "{src}", "-r", "reducer://top?field=0&k=10", "-j", "{jobs}", "--chunk-size", "{chunk}"]),
+    ("aina-fields", "apache", ["slither", "FIELDS[8] == '500' { OUT(FIELDS[0]) }", "{src}"]),
+    ("aina-line", "syslog", ["slither", "'ERROR' in LINE { OUT(LINE) }", "{src}"]),
+]
+
+def _version():
+    try:
+        from importlib.metadata import version
+        return version("slither")
+    except Exception:
+        return "unknown"
+
+def run_scenario(name, fmt, args, src, jobs=4):
+    """Run one ginsu scenario over src in a fresh process and return
+    a dict of its measurements.
+    """
+    size = os.path.getsize(src)
+    with open(src, "rb") as fin:
+        lines = sum(block.count(b"\n") for block in iter(lambda: fin.read(1 << 20), b""))
+    chunk = max(size // (jobs * 4), 1 << 20)
+    values = {"{src}": src, "{jobs}": str(jobs), "{chunk}": str(chunk)}
+    argv = [values.get(arg, arg) for arg in args]
+    argv = [sys.executable, "-m", "slither.ginsu"] + argv + ["--output", os.devnull]
+    start = time.perf_counter()
+    proc = subprocess.Popen(argv, stdout=subprocess.DEVNULL)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    seconds = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise RuntimeError("{} exited with {}: {}".format(name, proc.returncode, argv))
+    return {
+        "scenario": name,
+        "format": fmt,
+        "argv": argv[3:],
+        "version": _version(),
+        "python": platform.python_version(),
+        "bytes": size,
+        "lines": lines,
+        "seconds": round(seconds, 4),
+        "lines_per_sec": round(lines / seconds, 1),
+        "mb_per_sec": round(size / seconds / (1 << 20), 3),
+        # kilobytes on Linux, includes waited-for worker processes
+        "peak_rss_kb": rusage.ru_maxrss,
+    }
+
+
+cli = click.Group(help=__doc__.split("\n\n")[0])
+
+@cli.command("generate")
+@click.argument("fmt", type=click.Choice(FORMATS))
+@click.option("--size", "-s", default="10MB", help="Approximate size, ie 512KB, 100MB.")
+@click.option("--seed", default=0, type=int)
+@click.option("--output", "-o", default="-")
+def _generate(fmt, size, seed, output):
+    """Generate a synthetic log in the given format."""
+    with click.open_file(output, "wb") as fout:
+        generate(fmt, parse_size(size), fout, seed)
+
+@cli.command("run")
+@click.option("--size", "-s", default="50MB", help="Size of each generated log.")
+@click.option("--seed", default=0, type=int)
+@click.option("--jobs", "-j", default=4, type=int, help="--jobs for the parallel scenarios.")
+@click.option("--scenario", "-k", "scenarios", multiple=True, help="Only run these scenarios.")
+@click.option("--repeat", "-n", default=1, type=int, help="Runs per scenario, the fastest is kept.")
+@click.option("--workdir", default=None, help="Where to generate logs, defaults to a temporary directory.")
+@click.option("--output", "-o", default="-", help="Where to write JSON lines results.")
+def _run(size, seed, jobs, scenarios, repeat, workdir, output):
+    """Run the benchmark scenarios and report the results."""
+    size = parse_size(size)
+    selected = [s for s in SCENARIOS if not scenarios or s[0] in scenarios]
+    tmpdir = workdir or tempfile.mkdtemp(prefix="ginsu-bench-")
+    try:
+        sources = {}
+        for fmt in sorted(set(fmt for _, fmt, _ in selected)):
+            src = os.path.join(tmpdir, "{}-{}-{}.log".format(fmt, size, seed))
+            if not os.path.exists(src):
+                click.echo("generating {}".format(src), err=True)
+                with open(src, "wb") as fout:
+                    generate(fmt, size, fout, seed)
+            sources[fmt] = src
+        with click.open_file(output, "w") as fout:
+            for name, fmt, args in selected:
+                result = min(
+                    (run_scenario(name, fmt, args, sources[fmt], jobs) for _ in range(repeat)),
+                    key=lambda r: r["seconds"],
+                )
+                fout.write(json.dumps(result) + "\n")
+                fout.flush()
+                click.echo(
+                    "{scenario:<22} {lines_per_sec:>14,.0f} lines/s {mb_per_sec:>9.2f} MB/s "
+                    "{peak_rss_kb:>9,} KB".format(**result),
+                    err=True,
+                )
+    finally:
+        if workdir is None:
+            shutil.rmtree(tmpdir)
+
+@cli.command("compare")
+@click.argument("before", type=click.File("r"))
+@click.argument("after", type=click.File("r"))
+@click.option("--threshold", default=0.05, type=float, help="Relative slowdown reported as a regression.")
+def _compare(before, after, threshold):
+    """Compare two result files, exiting 1 on any regression."""
+    before = {r["scenario"]: r for r in map(json.loads, before)}
+    after = {r["scenario"]: r for r in map(json.loads, after)}
+    regressions = 0
+    for name in (n for n in before if n in after):
+        change = after[name]["lines_per_sec"] / before[name]["lines_per_sec"] - 1
+        flag = ""
+        if change < -threshold:
+            flag = "REGRESSION"
+            regressions += 1
+        click.echo("{:<22} {:>+8.1%} lines/s {:>+8.1%} peak RSS {}".format(
+            name,
+            change,
+            after[name]["peak_rss_kb"] / before[name]["peak_rss_kb"] - 1,
+            flag,
+        ))
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    cli()
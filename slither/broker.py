@@ -29,7 +29,17 @@ parameters with which the Dispatcher was created.
 """
 import io
 import re
+import time
+import struct
+import json
+import queue
+import asyncio
 import logging
+import tempfile
+import threading
+import traceback
+import multiprocessing
+from multiprocessing import shared_memory
 from inspect import (
     Signature,
     Parameter,
@@ -37,18 +47,66 @@ from inspect import (
     getfullargspec,
 )
 from collections import (
+    deque,
     defaultdict,
     namedtuple,
+    OrderedDict,
 )
 from functools import partial
+from itertools import islice
+from urllib.parse import parse_qsl, urlencode
 from concurrent.futures import ThreadPoolExecutor
 import flask
+from slither.plugins import load
+from slither.matchers import fuse, fusable, required_literal
+from slither.journal import Journal, encode, decode
+from slither.metrics import Metrics, SubscriberMetrics, _timed, _timed_each
 
 log = logging.getLogger(__name__)
+# Bytes of shared memory for messages to subscriber processes
+RING_SIZE = 64 * 1024 * 1024
+# Seconds between checks for subscriber processes which have died
+REAP_INTERVAL = 1.0
+# The number of distinct topics whose subscribers are cached by a
+# Broker before the cache is cleared.
+MAX_CACHED_ROUTES = 10000
+# Messages per pub_many call when publishing NDJSON to pubsub_app
+BULK_BATCH_SIZE = 1000
+# Messages buffered for each /stream client of a Broker without a
+# journal, messages beyond that are dropped for that client.
+STREAM_QUEUE_SIZE = 10000
+# Seconds between keepalive comments on an idle /stream
+KEEPALIVE_INTERVAL = 15.0
 signature_result = namedtuple("SignatureResult", "args varargs varkw defaults kwonlyargs kwonlydefaults annotations")
 
-def _log_result(f, log_name):
-    logging.getLogger(log_name).info(f.result())
+def _log_result(f, log_name, stats, count=1):
+    """Log the result of a _timed call to a handler of count
+    messages and record it in stats.
+    """
+    try:
+        result, duration = f.result()
+    except Exception:
+        stats.fail(count)
+        raise
+    stats.complete(duration, count=count)
+    logging.getLogger(log_name).info(result)
+
+def _log_results(f, log_name, stats, count):
+    """Log the results of a _timed_each call to a handler of count
+    messages and record them in stats.
+    """
+    try:
+        results, failed, duration = f.result()
+    except Exception:
+        stats.fail(count)
+        raise
+    # only the total is measured, each call is counted as the mean
+    stats.complete(duration, count=count - failed, calls=count)
+    if failed:
+        stats.fail(failed)
+    logger = logging.getLogger(log_name)
+    for result in results:
+        logger.info(result)
 
 
 class Topic(object):
@@ -66,14 +124,11 @@ class Topic(object):
         return self.name
 
     def split_name(self):
-        names = []
+        names = [self.name]
         _name = self.name
-        while True:
+        while "." in _name:
+            _name = _name.rpartition(".")[0]
             names.append(_name)
-            if "." in _name:
-                _name = ".".join(_name.split(".")[:-1])
-            else:
-                break
         return names
 
 class Subscription(object):
@@ -103,17 +158,440 @@ class Subscription(object):
             try:
                 self.__name__ = self.handler.name
             except:
-                self.__name__ = "unknown"
+                self.__name__ = type(self.handler).__name__
         if filters is None:
             filters = list()
         if triggers is None:
             triggers = [".*"]
         self.filters = [re.compile(f) for f in filters]
         self.triggers = [re.compile(t) for t in triggers]
+        # replaced with registered ones by Router._add
+        self.stats = SubscriberMetrics()
 
     def __call__(self, message: str):
         return self.handler(message)
 
+class BatchSubscription(Subscription):
+    """A Subscription whose handler is called with lists of
+    messages. Matching messages are collected until there are
+    batch_size of them or the oldest has waited max_delay seconds,
+    whichever comes first, and then handed over in one call.
+    """
+    def __init__(
+            self,
+            topic: Topic,
+            handler: callable,
+            filters: list=None,
+            triggers: list=None,
+            batch_size: int=1000,
+            max_delay: float=1.0
+        ):
+        super().__init__(topic, handler, filters=filters, triggers=triggers)
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._pending = []
+        self._since = None
+        self._lock = threading.Lock()
+
+    def add(self, messages: list):
+        """Queue messages and return the list of full batches which
+        are ready to be handled.
+        """
+        size = self.batch_size
+        with self._lock:
+            if not self._pending:
+                self._since = time.monotonic()
+            self._pending.extend(messages)
+            if len(self._pending) < size:
+                return []
+            # the remainder keeps collecting
+            full = len(self._pending) // size * size
+            ready, self._pending = self._pending[:full], self._pending[full:]
+            self._since = time.monotonic()
+        return [ready[i:i + size] for i in range(0, full, size)]
+
+    def take(self, now: float=None):
+        """Return the pending messages if the oldest has waited
+        max_delay seconds (or now is None) and an empty list
+        otherwise.
+        """
+        with self._lock:
+            if not self._pending:
+                return []
+            if now is not None and now - self._since < self.max_delay:
+                return []
+            pending, self._pending = self._pending, []
+            return pending
+
+class _SpillFile(object):
+    """A first in, first out queue of messages kept in a temporary
+    file. str and bytes are stored as they are, anything else is
+    pickled. The file is emptied whenever every message in it has
+    been read.
+    """
+    def __init__(self, directory: str=None):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.read_offset = 0
+        self.write_offset = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, message):
+        kind, data = encode(message)
+        self.file.seek(self.write_offset)
+        self.file.write(struct.pack("<Ic", len(data), kind))
+        self.file.write(data)
+        self.write_offset += 5 + len(data)
+        self.count += 1
+
+    def popleft(self):
+        self.file.seek(self.read_offset)
+        size, kind = struct.unpack("<Ic", self.file.read(5))
+        data = self.file.read(size)
+        self.read_offset += 5 + size
+        self.count -= 1
+        if not self.count:
+            self.file.seek(0)
+            self.file.truncate()
+            self.read_offset = self.write_offset = 0
+        return decode(kind, data)
+
+    def close(self):
+        self.file.close()
+
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest", "spill")
+
+
+class QueuedSubscription(Subscription):
+    """A Subscription with its own queue of at most queue_size
+    messages and its own workers threads which call the handler, so a
+    slow handler only holds up its own messages.
+
+    overflow decides what happens to a message published while the
+    queue is full:
+
+        block        pub waits until there is room
+        drop_oldest  the oldest queued message is discarded
+        drop_newest  the new message is discarded
+        spill        the message is written to a temporary file (in
+                     spill_dir) and read back once the queue drains,
+                     so memory use is capped but nothing is lost
+
+    The number of discarded messages is kept in dropped.
+    """
+    def __init__(
+            self,
+            topic: Topic,
+            handler: callable,
+            filters: list=None,
+            triggers: list=None,
+            queue_size: int=1000,
+            workers: int=1,
+            overflow: str="block",
+            spill_dir: str=None
+        ):
+        super().__init__(topic, handler, filters=filters, triggers=triggers)
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of {}".format(", ".join(OVERFLOW_POLICIES)))
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.spill_dir = spill_dir
+        self.dropped = 0
+        self.queue = deque()
+        self.spill = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self.result_log = logging.getLogger("{}.{}".format(topic, self.__name__))
+        self.workers = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def __len__(self):
+        return len(self.queue) + (len(self.spill) if self.spill is not None else 0)
+
+    def put(self, message):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Subscription has been closed")
+            queue = self.queue
+            spilling = self.spill is not None and len(self.spill)
+            if len(queue) >= self.queue_size or spilling:
+                overflow = self.overflow
+                if overflow == "block":
+                    while len(queue) >= self.queue_size:
+                        self._not_full.wait()
+                elif overflow == "drop_newest":
+                    self.dropped += 1
+                    self.stats.drop()
+                    return
+                elif overflow == "drop_oldest":
+                    queue.popleft()
+                    self.dropped += 1
+                    self.stats.drop()
+                else:
+                    # Once spilling, new messages go behind the spilled
+                    # ones until the file is drained to keep them in order
+                    if self.spill is None:
+                        self.spill = _SpillFile(self.spill_dir)
+                    self.spill.append(message)
+                    self._not_empty.notify()
+                    return
+            queue.append(message)
+            self._not_empty.notify()
+
+    def _get(self):
+        """Return the next message or None once closed and drained."""
+        with self._lock:
+            while True:
+                if self.queue:
+                    message = self.queue.popleft()
+                    self._not_full.notify()
+                    return message
+                if self.spill is not None and len(self.spill):
+                    return self.spill.popleft()
+                if self._closed:
+                    return None
+                self._not_empty.wait()
+
+    def _work(self):
+        result_log = self.result_log
+        while True:
+            message = self._get()
+            if message is None:
+                return
+            start = time.perf_counter()
+            try:
+                result = self.handler(message)
+            except Exception:
+                self.stats.fail(duration=time.perf_counter() - start)
+                result_log.exception("Handler failed for message: {}".format(message))
+                continue
+            self.stats.complete(time.perf_counter() - start)
+            if result_log.isEnabledFor(logging.INFO):
+                result_log.info(result)
+
+    def close(self, wait: bool=True):
+        """Stop accepting messages and, if wait is True, wait for
+        the workers to handle the ones already queued.
+        """
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+        if wait:
+            for worker in self.workers:
+                worker.join()
+            if self.spill is not None:
+                self.spill.close()
+
+class SharedRing(object):
+    """A ring buffer of messages in shared memory.
+
+    Each message is written once, however many subscriber processes
+    it is for, along with the number of them. Its space is reused
+    once every one of them has released it. Positions are virtual,
+    they only ever increase and position % size is the offset into
+    the shared memory. write blocks while the ring is full.
+    """
+    def __init__(self, size: int=RING_SIZE):
+        self.size = size
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.name = self.shm.name
+        self.head = 0
+        self.tail = 0
+        # start -> [end, number of subscribers yet to release it]
+        self.records = OrderedDict()
+        self._cond = threading.Condition()
+
+    def write(self, data: bytes, refcount: int):
+        """Copy data into the ring and return its (start, offset)."""
+        length = len(data)
+        if length > self.size:
+            raise ValueError("Message of {} bytes is larger than the ring".format(length))
+        with self._cond:
+            while True:
+                if not self.records and self.head % self.size:
+                    # nothing is left to wrap around, so start the
+                    # next message at offset 0 with the whole ring
+                    self.head = self.tail = self.head + self.size - self.head % self.size
+                start = self.head
+                offset = start % self.size
+                if offset + max(length, 1) > self.size:
+                    # doesn't fit before the end, start again at 0
+                    start += self.size - offset
+                    offset = 0
+                if start + max(length, 1) - self.tail <= self.size:
+                    break
+                self._cond.wait()
+            self.shm.buf[offset:offset + length] = data
+            # an empty message still takes a byte so starts are unique
+            end = start + max(length, 1)
+            self.records[start] = [end, refcount]
+            self.head = end
+        return start, offset
+
+    def release(self, start: int):
+        """Release the message at start for one subscriber."""
+        with self._cond:
+            self.records[start][1] -= 1
+            records = self.records
+            while records:
+                first = next(iter(records))
+                if records[first][1] > 0:
+                    break
+                del records[first]
+            self.tail = next(iter(records)) if records else self.head
+            self._cond.notify_all()
+
+    def __len__(self):
+        return len(self.records)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _process_worker(ring_name, handler, tasks, results, key, worker):
+    """Run in each subscriber process. Messages are read from the
+    shared ring as (start, offset, length, kind) arrive on tasks and
+    the outcome of each is put on results.
+    """
+    shm = shared_memory.SharedMemory(name=ring_name)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            start, offset, length, kind = task
+            message = decode(kind, bytes(shm.buf[offset:offset + length]))
+            began = time.perf_counter()
+            try:
+                result = str(handler(message))
+            except Exception:
+                results.put((key, worker, start, False, traceback.format_exc(), time.perf_counter() - began))
+            else:
+                results.put((key, worker, start, True, result, time.perf_counter() - began))
+    finally:
+        shm.close()
+
+
+class ProcessSubscription(Subscription):
+    """A Subscription whose handler runs in processes of its own,
+    which are started once and receive the handler once. Messages
+    reach them through a SharedRing, so only a small reference to
+    each is sent to the processes.
+
+    Each process has its own task queue and a message goes to the
+    one with the fewest outstanding, so if a process dies the
+    messages it was given are known and their space in the ring can
+    be released, see reap.
+    """
+    def __init__(
+            self,
+            topic: Topic,
+            handler: callable,
+            filters: list=None,
+            triggers: list=None,
+            processes: int=1,
+            ring: SharedRing=None,
+            results=None,
+            context=None
+        ):
+        super().__init__(topic, handler, filters=filters, triggers=triggers)
+        self.context = context or multiprocessing.get_context()
+        self.key = id(self)
+        self.ring = ring
+        self.results = results
+        self.result_log = logging.getLogger("{}.{}".format(topic, self.__name__))
+        self._lock = threading.Lock()
+        self.closed = False
+        self.processes = []
+        self.tasks = []
+        # the ring starts of the messages given to each process which
+        # it hasn't returned a result for
+        self.outstanding = []
+        for worker in range(processes):
+            self.processes.append(None)
+            self.tasks.append(None)
+            self.outstanding.append(set())
+            self._start(worker)
+
+    def _start(self, worker: int):
+        tasks = self.context.Queue()
+        process = self.context.Process(
+            target=_process_worker,
+            args=(self.ring.name, self.handler, tasks, self.results, self.key, worker),
+            daemon=True,
+        )
+        process.start()
+        self.tasks[worker] = tasks
+        self.processes[worker] = process
+
+    def put(self, start: int, offset: int, length: int, kind: bytes):
+        with self._lock:
+            worker = min(range(len(self.outstanding)), key=lambda w: len(self.outstanding[w]))
+            self.outstanding[worker].add(start)
+            self.tasks[worker].put((start, offset, length, kind))
+
+    def done(self, worker: int, start: int):
+        """Return True if start was outstanding for worker, False if
+        it has already been given up on by reap.
+        """
+        with self._lock:
+            try:
+                self.outstanding[worker].remove(start)
+            except KeyError:
+                return False
+            return True
+
+    def reap(self):
+        """Replace any process which has died and return the ring
+        starts of the messages it never returned a result for.
+        """
+        lost = []
+        with self._lock:
+            for worker, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                if self.closed and process.exitcode == 0:
+                    # it stopped when asked to, after queueing a
+                    # result for every message it was given
+                    continue
+                self.result_log.error("Subscriber process {} exited with {}, {} messages were lost".format(
+                    process.pid, process.exitcode, len(self.outstanding[worker])
+                ))
+                lost.extend(self.outstanding[worker])
+                self.outstanding[worker] = set()
+                self.tasks[worker].close()
+                if not self.closed:
+                    self._start(worker)
+        return lost
+
+    @property
+    def finished(self):
+        """True once closed with no message left outstanding, so no
+        more results can arrive for it.
+        """
+        with self._lock:
+            return self.closed and not any(self.outstanding)
+
+    def close(self, wait: bool=True):
+        with self._lock:
+            self.closed = True
+            for tasks in self.tasks:
+                tasks.put(None)
+        if wait:
+            for process in self.processes:
+                process.join()
+
+
 def name_of(func):
     try:
         return func.__name__
@@ -123,43 +601,549 @@ def name_of(func):
         except:
             return "unknown-callable"
 
-class Broker(object):
-    def __init__(self, executor_cls=ThreadPoolExecutor, **kwargs):
+def _text(message):
+    """Return the text of message for matching against triggers and
+    filters, messages are only converted when there are patterns to
+    match.
+    """
+    if isinstance(message, str):
+        return message
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return bytes(message).decode("utf-8", "replace")
+    return str(message)
+
+
+class RoutingIndex(object):
+    """Decide which of subscribers (a sequence of (subscription,
+    result logger) pairs) a message should be delivered to.
+
+    Every distinct trigger and filter pattern is tested at most once
+    per message, however many subscribers share it, and only when
+    the literal text it requires is in the message. All the patterns
+    are also fused into one regular expression which is tried first,
+    so a message which matches none of them costs a single scan, save
+    for patterns with backreferences which are only tested on their
+    own.
+    Subscribers with the same patterns are decided together and
+    subscribers with the default ".*" trigger and no filters always
+    match, without the message being converted to text at all.
+    """
+    def __init__(self, subscribers):
+        self.subscribers = tuple(subscribers)
+        self.regexes = []
+        indices = {}
+        # (trigger pattern indices or None if every message is
+        # wanted, filter pattern indices) -> subscriber positions, so
+        # subscribers with the same patterns are decided together
+        groups = defaultdict(list)
+        for position, (subscriber, _) in enumerate(self.subscribers):
+            triggers = [t for t in subscriber.triggers if t.pattern not in (".*", "")]
+            if len(triggers) < len(subscriber.triggers):
+                triggers = None
+            else:
+                triggers = tuple(self._index(t, indices) for t in triggers)
+            filters = tuple(self._index(f, indices) for f in subscriber.filters)
+            groups[triggers, filters].append(position)
+        self.groups = [(t, f, tuple(p)) for (t, f), p in groups.items()]
+        self.tests = [
+            (required_literal(regex.pattern) if isinstance(regex.pattern, str) else None, regex.search)
+            for regex in self.regexes
+        ]
+        # the subscribers which get a message matching no pattern
+        self.unconditional = tuple(sorted(
+            position
+            for triggers, _, positions in self.groups if triggers is None
+            for position in positions
+        ))
+        # patterns which can't be part of the fused expression are
+        # always tested on their own
+        together = [
+            i for i, r in enumerate(self.regexes)
+            if isinstance(r.pattern, str) and r.flags == re.UNICODE and fusable(r.pattern)
+        ]
+        self.unfused = [i for i in range(len(self.regexes)) if i not in set(together)]
+        self.fused = None
+        if together:
+            try:
+                self.fused = fuse([self.regexes[i].pattern for i in together], any).search
+            except re.error:
+                self.unfused = list(range(len(self.regexes)))
+
+    def _index(self, regex, indices):
+        key = (regex.pattern, regex.flags)
+        if key not in indices:
+            indices[key] = len(self.regexes)
+            self.regexes.append(regex)
+        return indices[key]
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def _select(self, message):
+        """Return the positions in subscribers of those which should
+        receive message.
+        """
+        if not self.regexes:
+            return self.unconditional
+        text = _text(message)
+        tests = self.tests
+        if self.fused is not None and self.fused(text) is None:
+            # none of the fused patterns match
+            if not self.unfused:
+                return self.unconditional
+            results = [False] * len(tests)
+            for i in self.unfused:
+                literal, search = tests[i]
+                results[i] = (literal is None or literal in text) and search(text) is not None
+        else:
+            results = [
+                (literal is None or literal in text) and search(text) is not None
+                for literal, search in tests
+            ]
+        selected = []
+        for triggers, filters, positions in self.groups:
+            if triggers is not None and not any(results[i] for i in triggers):
+                continue
+            if filters and any(results[i] for i in filters):
+                continue
+            selected.extend(positions)
+        if len(self.groups) > 1:
+            selected.sort()
+        return selected
+
+    def select(self, message):
+        """Return the (subscription, result logger) pairs which
+        should receive message.
+        """
+        subscribers = self.subscribers
+        return [subscribers[i] for i in self._select(message)]
+
+    def select_many(self, messages):
+        """Return a list of ((subscription, result logger), matched
+        messages) for each subscriber which matches any of messages.
+        """
+        matched = defaultdict(list)
+        for message in messages:
+            for i in self._select(message):
+                matched[i].append(message)
+        subscribers = self.subscribers
+        return [(subscribers[i], matched[i]) for i in sorted(matched)]
+
+
+class Router(object):
+    """Keeps track of the subscriptions to each topic and resolves a
+    published topic to the subscribers of it and its parent topics.
+    """
+    def __init__(self):
+        self.subscriptions = defaultdict(list)
+        # topic name (or tuple of subtopics) -> (topic logger,
+        # RoutingIndex), cleared by _add()
+        self._routes = {}
+        self.metrics = Metrics()
+
+    def _add(self, subscription: Subscription, name: str=None):
+        """Add subscription, with metrics named name or after its
+        result logger.
+        """
+        if name is None:
+            name = "{}.{}".format(subscription.topic, name_of(subscription))
+        subscription.stats = self.metrics.register(name)
+        self.subscriptions[str(subscription.topic)].append(subscription)
+        self._routes = {}
+
+    def unsub(self, subscription: Subscription):
+        """Remove subscription, which was returned by sub(), and its
+        metrics.
+        """
+        subscriptions = self.subscriptions[str(subscription.topic)]
+        subscriptions.remove(subscription)
+        if not subscriptions:
+            del self.subscriptions[str(subscription.topic)]
+        self._routes = {}
+        self.metrics.unregister(subscription.stats)
+
+    def _resolve(self, topic):
+        """Return the logger for topic and a RoutingIndex of the
+        subscribers to it and each of its parent topics along with
+        their result loggers.
+        """
+        if not isinstance(topic, Topic):
+            topic = Topic(topic)
+        subscribers = tuple(
+            (subscriber, logging.getLogger("{}.{}".format(name, name_of(subscriber))))
+            for name in topic.subtopics
+            for subscriber in self.subscriptions.get(name, ())
+        )
+        return logging.getLogger(str(topic)), RoutingIndex(subscribers)
+
+    def route(self, topic: Topic):
+        """Return what _resolve does for topic, from a cache which is
+        cleared whenever a subscription is added.
+        """
+        key = topic if isinstance(topic, str) else tuple(topic.subtopics)
+        # _add() replaces the cache, holding on to this one means a
+        # route resolved before a sub() is never stored after it
+        routes = self._routes
+        try:
+            return routes[key]
+        except KeyError:
+            if len(routes) >= MAX_CACHED_ROUTES:
+                routes.clear()
+            route = routes[key] = self._resolve(topic)
+            return route
+
+
+class Broker(Router):
+    """Deliver published messages to subscribers in executor_cls,
+    which is created with kwargs.
+
+    If journal (a slither.journal.Journal or a directory for one) is
+    given, every published message is also appended to the log of
+    its topic so it can be replayed later, see replay.
+
+    ring_size is the size of the shared memory used to pass messages
+    to subscriptions with processes, see ProcessSubscription.
+
+    Counts of the messages published to each topic and handled by
+    each subscriber, and how long the handlers took, are kept in
+    metrics, see slither.metrics.
+    """
+    def __init__(self, executor_cls=ThreadPoolExecutor, journal=None, ring_size: int=RING_SIZE, **kwargs):
         log.debug("Dispatcher is being initialized")
+        super().__init__()
         self.executor = executor_cls(**kwargs)
-        self.subscriptions = defaultdict(list)
+        self.ring_size = ring_size
+        self._ring = None
+        self._results = None
+        self._collector = None
+        self._process_subscriptions = {}
+        if isinstance(journal, str):
+            journal = Journal(journal)
+        self.journal = journal
         self.publishers = list()
         self.topics = list()
+        self._batched = []
+        self._flusher = None
+        self._closed = threading.Event()
 
-    def pub(self, topic: Topic, message: str):
-         """publish a message to a topic. Topic should be a str
-         while args and kwargs are treated as the payload.
+    def pub(self, topic: Topic, message):
+         """publish a message to a topic. The message is handed to
+         subscribers as it is, str, bytes or any other object.
          """
-         _message = str(message)
-         logging.getLogger(topic).info(_message)
-         if not isinstance(topic, Topic):
-             topic = Topic(topic)
-         for _topic in topic.split_name():
-             log.info("Publishing to topic: {}".format(_topic))
-             for subscriber in self.subscriptions[_topic]:
-                 log.debug("Found subscriber: {} for topic: {}".format(subscriber, _topic))
-                 if any(t.search(_message) for t in subscriber.triggers):
-                     if any(f.search(_message) for f in subscriber.filters):
-                         # message is filtered out
-                         continue
-                     future = self.executor.submit(subscriber, _message)
-                     future.add_done_callback(partial(_log_result, log_name="{}.{}".format(_topic, name_of(subscriber))))
+         topic_log, index = self.route(topic)
+         if self.journal is not None:
+             self.journal.append(str(topic), message)
+         if topic_log.isEnabledFor(logging.INFO):
+             topic_log.info(message)
+         if log.isEnabledFor(logging.DEBUG):
+             log.debug("Publishing to topic: {} with {} subscribers".format(topic, len(index)))
+         selected = index.select(message)
+         self.metrics.topic(str(topic)).add(1, len(index), len(selected))
+         processes = []
+         for subscriber, result_log in selected:
+             stats = subscriber.stats
+             if isinstance(subscriber, BatchSubscription):
+                 stats.match()
+                 for batch in subscriber.add([message]):
+                     self._submit_batch(subscriber, batch, result_log)
+                 continue
+             stats.dispatch()
+             if isinstance(subscriber, QueuedSubscription):
+                 subscriber.put(message)
+                 continue
+             if isinstance(subscriber, ProcessSubscription):
+                 processes.append(subscriber)
+                 continue
+             future = self.executor.submit(_timed, subscriber.handler, message)
+             future.add_done_callback(partial(_log_result, log_name=result_log.name, stats=stats))
+         if processes:
+             self._send_to_processes(message, processes)
+
+    def pub_many(self, topic: Topic, messages):
+        """publish each of messages to topic. Each subscriber gets
+        all of the messages it matches in a single task rather than
+        one task per message.
+        """
+        messages = list(messages)
+        topic_log, index = self.route(topic)
+        if self.journal is not None:
+            journal_log = self.journal.log(str(topic))
+            for message in messages:
+                journal_log.append(message)
+        if topic_log.isEnabledFor(logging.INFO):
+            for message in messages:
+                topic_log.info(message)
+        deliveries = index.select_many(messages)
+        self.metrics.topic(str(topic)).add(
+            len(messages), len(index), sum(len(matched) for _, matched in deliveries)
+        )
+        for (subscriber, result_log), matched in deliveries:
+            stats = subscriber.stats
+            if isinstance(subscriber, BatchSubscription):
+                stats.match(len(matched))
+                for batch in subscriber.add(matched):
+                    self._submit_batch(subscriber, batch, result_log)
+                continue
+            stats.dispatch(len(matched))
+            if isinstance(subscriber, QueuedSubscription):
+                for message in matched:
+                    subscriber.put(message)
+                continue
+            if isinstance(subscriber, ProcessSubscription):
+                continue
+            future = self.executor.submit(_timed_each, subscriber.handler, matched)
+            future.add_done_callback(
+                partial(_log_results, log_name=result_log.name, stats=stats, count=len(matched))
+            )
+        if any(isinstance(subscriber, ProcessSubscription) for subscriber, _ in index.subscribers):
+            # each message is written to the ring once for all of them
+            for message in messages:
+                processes = [
+                    subscriber for subscriber, _ in index.select(message)
+                    if isinstance(subscriber, ProcessSubscription)
+                ]
+                if processes:
+                    self._send_to_processes(message, processes)
+
+    def _send_to_processes(self, message, subscribers):
+        kind, data = encode(message)
+        start, offset = self._ring.write(data, len(subscribers))
+        for subscriber in subscribers:
+            subscriber.put(start, offset, len(data), kind)
+
+    def _collect_results(self):
+        """Log the outcome of each message handled by a subscriber
+        process and release its space in the ring.
+        """
+        checked = time.monotonic()
+        while True:
+            try:
+                result = self._results.get(timeout=REAP_INTERVAL)
+            except queue.Empty:
+                result = ()
+            if time.monotonic() - checked >= REAP_INTERVAL and not self._closed.is_set():
+                self._reap()
+                checked = time.monotonic()
+            if result is None:
+                return
+            if not result:
+                continue
+            key, worker, start, ok, text, duration = result
+            subscriber = self._process_subscriptions.get(key)
+            if subscriber is None or not subscriber.done(worker, start):
+                # its process was found dead and start released
+                continue
+            if subscriber.finished:
+                # unsubscribed and this was its last result
+                self._process_subscriptions.pop(key, None)
+            if ok:
+                subscriber.stats.complete(duration)
+                if subscriber.result_log.isEnabledFor(logging.INFO):
+                    subscriber.result_log.info(text)
+            else:
+                subscriber.stats.fail(duration=duration)
+                subscriber.result_log.error("Handler failed:\n{}".format(text))
+            self._ring.release(start)
+
+    def _reap(self):
+        """Release the ring space of the messages held by subscriber
+        processes which have died, so pub doesn't wait for it forever.
+        """
+        for subscriber in list(self._process_subscriptions.values()):
+            lost = subscriber.reap()
+            if lost:
+                subscriber.stats.fail(len(lost))
+                for start in lost:
+                    self._ring.release(start)
+            if subscriber.finished:
+                self._process_subscriptions.pop(subscriber.key, None)
+
+    def _submit_batch(self, subscriber, batch, result_log=None):
+        if result_log is None:
+            result_log = logging.getLogger("{}.{}".format(subscriber.topic, name_of(subscriber)))
+        subscriber.stats.start(len(batch))
+        future = self.executor.submit(_timed, subscriber.handler, batch)
+        future.add_done_callback(
+            partial(_log_result, log_name=result_log.name, stats=subscriber.stats, count=len(batch))
+        )
+
+    def flush(self):
+        """Hand every pending batch over to its handler now."""
+        for subscriber in list(self._batched):
+            batch = subscriber.take()
+            if batch:
+                self._submit_batch(subscriber, batch)
+
+    def _flush_expired(self):
+        # unsub may leave no batched subscriptions for a while
+        interval = min((subscriber.max_delay for subscriber in self._batched), default=1.0) / 2
+        while not self._closed.wait(interval):
+            now = time.monotonic()
+            for subscriber in list(self._batched):
+                batch = subscriber.take(now)
+                if batch:
+                    self._submit_batch(subscriber, batch)
+            interval = min((subscriber.max_delay for subscriber in self._batched), default=1.0) / 2
+
+    def unsub(self, subscription: Subscription, wait: bool=True):
+        """Remove subscription, which was returned by sub(), and its
+        metrics. Its pending batch is handed over, and its queue or
+        processes are closed, waiting for the messages already given
+        to them if wait is True.
+        """
+        super().unsub(subscription)
+        if isinstance(subscription, BatchSubscription):
+            self._batched.remove(subscription)
+            batch = subscription.take()
+            if batch:
+                self._submit_batch(subscription, batch)
+        elif isinstance(subscription, QueuedSubscription):
+            subscription.close(wait=wait)
+        elif isinstance(subscription, ProcessSubscription):
+            subscription.close(wait=wait)
+            # otherwise the collector forgets it after its last result
+            if subscription.finished:
+                self._process_subscriptions.pop(subscription.key, None)
+
+    def replay(self, topic: Topic, handler: callable, since=None, cursor: str=None, save_every: int=1000):
+        """Call handler, in this thread, with each message in the
+        journal published to topic or any topic beneath it, in the
+        order they were published. Returns the number of messages.
+
+        since is the offset (an int) or time (a float timestamp or a
+        datetime) to start from. If cursor is given, it names a
+        consumer whose position in each topic is saved every
+        save_every messages and at the end, and replay starts from
+        there when it is next called with that cursor. A message is
+        only counted as handled once handler returns, so it may be
+        delivered again after a crash but is never skipped.
+
+        To catch up without a gap, sub() the handler first and then
+        replay, at the cost of seeing some messages twice.
+        """
+        if self.journal is None:
+            raise RuntimeError("replay requires a Broker created with a journal")
+        self.journal.commit()
+        _cursor = self.journal.cursor(cursor) if cursor is not None else None
+        count = 0
+        try:
+            for name, offset, _, message in self.journal.replay(str(topic), since, _cursor):
+                handler(message)
+                count += 1
+                if _cursor is not None:
+                    _cursor.advance(name, offset + 1)
+                    if count % save_every == 0:
+                        _cursor.save()
+        finally:
+            if _cursor is not None:
+                _cursor.save()
+        return count
+
+    def follow(
+            self,
+            topic: Topic,
+            positions: dict=None,
+            since=None,
+            interval: float=0.1,
+            idle: float=None,
+            batch_size: int=BULK_BATCH_SIZE
+        ):
+        """Like replay, but yield lists of (topic, offset, message) as
+        messages are published to topic or any topic beneath it,
+        forever. positions maps topics to the next offset to read in
+        them and is updated as each list is yielded, so it can be
+        saved and passed back in to resume. Topics without a position
+        start from since (see replay) or from the end of the journal
+        when since is None.
+
+        Lists hold at most batch_size messages. The journal is polled
+        every interval seconds and if idle is given an empty list is
+        yielded after that many seconds without a message.
+        """
+        if self.journal is None:
+            raise RuntimeError("follow requires a Broker created with a journal")
+        positions = {} if positions is None else positions
+        topic = str(topic)
+        if since is None:
+            self.journal.commit()
+            for name in self.journal.topics():
+                if name == topic or name.startswith(topic + "."):
+                    positions.setdefault(name, self.journal.log(name).committed)
+            since = 0
+        quiet = 0.0
+        while True:
+            # replay yields a prefix of each topic, so stopping early
+            # leaves positions consistent
+            records = islice(self.journal.replay(topic, since, positions), batch_size)
+            batch = [(name, offset, message) for name, offset, _, message in records]
+            if batch:
+                for name, offset, _ in batch:
+                    positions[name] = offset + 1
+                quiet = 0.0
+                yield batch
+                continue
+            if idle is not None and quiet >= idle:
+                quiet = 0.0
+                yield batch
+            time.sleep(interval)
+            quiet += interval
+
+    def shutdown(self, wait: bool=True):
+        """Flush pending batches, close the subscriptions' queues and
+        shut down the executor.
+        """
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        for subscriptions in list(self.subscriptions.values()):
+            for subscription in subscriptions:
+                if isinstance(subscription, (QueuedSubscription, ProcessSubscription)):
+                    subscription.close(wait=wait)
+        self.executor.shutdown(wait=wait)
+        if self._collector is not None:
+            # every result is queued once the processes have exited
+            self._results.put(None)
+            if wait:
+                self._collector.join()
+            # the name is removed now, the memory itself is freed once
+            # the processes still running have exited
+            self._ring.close()
+        if self.journal is not None:
+            self.journal.close()
 
     def sub(
             self,
             topic: Topic,
             handler: callable,
             filters: list=None,
-            triggers: list=None
+            triggers: list=None,
+            batch_size: int=None,
+            max_delay: float=1.0,
+            queue_size: int=None,
+            workers: int=1,
+            overflow: str="block",
+            spill_dir: str=None,
+            processes: int=None,
+            name: str=None
         ):
         """subscribe a handler to a topic. A handler can be any
         Python callable.
 
+        If batch_size is given, the handler is called with lists
+        of up to batch_size messages instead, see BatchSubscription.
+
+        If queue_size is given, the subscription gets its own queue
+        of queue_size messages and its own workers threads instead
+        of sharing the broker's executor, see QueuedSubscription.
+
+        If processes is given, the handler is run in that many
+        processes of its own, which receive messages through shared
+        memory, see ProcessSubscription.
+
+        The subscription's metrics are kept under name, which
+        defaults to that of its result logger, see slither.metrics.
+
         The args and kwargs will be compared to the signature of
         the callable and irrelevant arguments will be removed and
         the callable will be invoked with the remaining arguments.
@@ -171,15 +1155,238 @@ class Broker(object):
             filters = None
         if not triggers:
             triggers = None
-        sub = Subscription(
+        if sum(option is not None for option in (batch_size, queue_size, processes)) > 1:
+            raise ValueError("Only one of batch_size, queue_size and processes can be used")
+        if processes is not None:
+            if self._ring is None:
+                context = multiprocessing.get_context()
+                self._ring = SharedRing(self.ring_size)
+                self._results = context.Queue()
+                self._collector = threading.Thread(target=self._collect_results, daemon=True)
+                self._collector.start()
+            sub = ProcessSubscription(
+                topic=topic,
+                handler=handler,
+                filters=filters,
+                triggers=triggers,
+                processes=processes,
+                ring=self._ring,
+                results=self._results,
+            )
+            self._process_subscriptions[sub.key] = sub
+        elif queue_size is not None:
+            sub = QueuedSubscription(
+                topic=topic,
+                handler=handler,
+                filters=filters,
+                triggers=triggers,
+                queue_size=queue_size,
+                workers=workers,
+                overflow=overflow,
+                spill_dir=spill_dir,
+            )
+        elif batch_size is None:
+            sub = Subscription(
+                topic=topic,
+                handler=handler,
+                filters=filters,
+                triggers=triggers,
+            )
+        else:
+            sub = BatchSubscription(
+                topic=topic,
+                handler=handler,
+                filters=filters,
+                triggers=triggers,
+                batch_size=batch_size,
+                max_delay=max_delay,
+            )
+            self._batched.append(sub)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_expired, daemon=True)
+                self._flusher.start()
+        self._add(sub, name)
+        return sub
+
+class AsyncSubscription(Subscription):
+    """A Subscription for an AsyncBroker. At most concurrency
+    deliveries to the handler are in progress at once, the rest wait
+    their turn on the event loop.
+    """
+    def __init__(
+            self,
+            topic: Topic,
+            handler: callable,
+            filters: list=None,
+            triggers: list=None,
+            concurrency: int=100
+        ):
+        super().__init__(topic, handler, filters=filters, triggers=triggers)
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.is_coroutine = (
+            asyncio.iscoroutinefunction(handler)
+            or asyncio.iscoroutinefunction(getattr(handler, "__call__", None))
+        )
+
+
+class AsyncBroker(Router):
+    """A Broker which delivers messages on an asyncio event loop.
+
+    Coroutine function handlers are awaited on the loop itself, so
+    thousands of deliveries can be in flight without a thread for
+    each. Other handlers are run in the loop's default executor so
+    they can't block it.
+
+    pub and pub_many must be called from the thread running the
+    event loop, join waits for the deliveries in progress:
+
+        >>> broker = AsyncBroker()
+        >>> broker.sub("app", handler, concurrency=500)
+        >>> broker.pub("app.web", "hello")
+        >>> await broker.join()
+    """
+    def __init__(self, concurrency: int=100):
+        super().__init__()
+        self.concurrency = concurrency
+        self._tasks = set()
+
+    def pub(self, topic: Topic, message):
+        """publish a message to a topic."""
+        self.pub_many(topic, [message])
+
+    def pub_many(self, topic: Topic, messages):
+        """publish each of messages to topic."""
+        loop = asyncio.get_running_loop()
+        topic_log, index = self.route(topic)
+        topic_stats = self.metrics.topic(str(topic))
+        for message in messages:
+            if topic_log.isEnabledFor(logging.INFO):
+                topic_log.info(message)
+            selected = index.select(message)
+            topic_stats.add(1, len(index), len(selected))
+            for subscriber, result_log in selected:
+                subscriber.stats.dispatch()
+                task = loop.create_task(self._deliver(subscriber, message, result_log))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, subscriber, message, result_log):
+        async with subscriber.semaphore:
+            start = time.perf_counter()
+            try:
+                if subscriber.is_coroutine:
+                    result = await subscriber.handler(message)
+                else:
+                    loop = asyncio.get_running_loop()
+                    result = await loop.run_in_executor(None, subscriber.handler, message)
+            except Exception:
+                subscriber.stats.fail(duration=time.perf_counter() - start)
+                result_log.exception("Handler failed for message: {}".format(message))
+                return
+            subscriber.stats.complete(time.perf_counter() - start)
+        if result_log.isEnabledFor(logging.INFO):
+            result_log.info(result)
+
+    def sub(
+            self,
+            topic: Topic,
+            handler: callable,
+            filters: list=None,
+            triggers: list=None,
+            concurrency: int=None,
+            name: str=None
+        ):
+        """subscribe a handler, a coroutine function or any other
+        callable, to a topic. At most concurrency (which defaults to
+        the broker's) deliveries to it are in progress at once. Its
+        metrics are kept under name, see Broker.sub.
+        """
+        sub = AsyncSubscription(
             topic=topic,
             handler=handler,
-            filters=filters,
-            triggers=triggers,
+            filters=filters or None,
+            triggers=triggers or None,
+            concurrency=self.concurrency if concurrency is None else concurrency,
         )
-        self.subscriptions[topic].append(sub)
+        self._add(sub, name)
         return sub
 
+    async def join(self):
+        """Wait until every delivery in progress has finished."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+
+def _jsonable(message):
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return bytes(message).decode("utf-8", "replace")
+    return message
+
+def _event(data, cursor=None):
+    """Return a server-sent event of data as JSON."""
+    event = "data: {}\n".format(json.dumps(data, default=str))
+    if cursor is not None:
+        event = "id: {}\n{}".format(cursor, event)
+    return event + "\n"
+
+def _since(value):
+    if value is None:
+        return None
+    return float(value) if "." in value else int(value)
+
+def _journal_events(broker, topic, positions, since):
+    """Server-sent events for the messages in broker's journal. The
+    id of the last event in each chunk is a cursor of the position
+    reached in every topic.
+    """
+    yield ": connected\n\n"
+    for batch in broker.follow(topic, positions, since, idle=KEEPALIVE_INTERVAL):
+        if not batch:
+            yield ": keepalive\n\n"
+            continue
+        events = [
+            _event({"topic": name, "offset": offset, "message": _jsonable(message)})
+            for name, offset, message in batch[:-1]
+        ]
+        name, offset, message = batch[-1]
+        cursor = urlencode(sorted(positions.items()))
+        events.append(_event({"topic": name, "offset": offset, "message": _jsonable(message)}, cursor))
+        yield "".join(events)
+
+def _live_events(broker, topic):
+    """Server-sent events for the messages published to topic while
+    the client is connected, for brokers without a journal.
+    """
+    messages = queue.Queue(STREAM_QUEUE_SIZE)
+    def stream(message):
+        try:
+            messages.put_nowait(message)
+        except queue.Full:
+            # a slow client must not hold up the broker
+            pass
+    # subscribe now rather than when the response starts
+    subscription = broker.sub(topic, stream)
+    def events():
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    message = messages.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                chunk = [_event({"message": _jsonable(message)})]
+                while len(chunk) < BULK_BATCH_SIZE:
+                    try:
+                        chunk.append(_event({"message": _jsonable(messages.get_nowait())}))
+                    except queue.Empty:
+                        break
+                yield "".join(chunk)
+        finally:
+            broker.unsub(subscription)
+    return events()
+
+
 pubsub_app = flask.Flask(__name__)
 pubsub_app.broker = Broker()
 
@@ -189,10 +1396,79 @@ def pub(topic):
     pubsub_app.broker.pub(topic, message)
     return message
 
+@pubsub_app.route("/pub", methods=["POST"])
+def pub_ndjson():
+    """Publish newline delimited JSON objects, each with a topic and
+    a message. The body is read as it arrives and consecutive
+    messages to the same topic are published with pub_many.
+    """
+    broker = pubsub_app.broker
+    published = 0
+    topic, batch = None, []
+    for number, line in enumerate(flask.request.stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            name, message = record["topic"], record["message"]
+        except (ValueError, KeyError, TypeError) as e:
+            if batch:
+                broker.pub_many(topic, batch)
+                published += len(batch)
+            return flask.jsonify(
+                published=published,
+                error="Invalid record on line {}: {!r}".format(number, e),
+            ), 400
+        if name != topic or len(batch) >= BULK_BATCH_SIZE:
+            if batch:
+                broker.pub_many(topic, batch)
+                published += len(batch)
+            topic, batch = name, []
+        batch.append(message)
+    if batch:
+        broker.pub_many(topic, batch)
+        published += len(batch)
+    return flask.jsonify(published=published)
+
+@pubsub_app.route("/stream/<topic>", methods=["GET"])
+def stream(topic):
+    """Stream the messages published to topic and the topics beneath
+    it as server-sent events.
+
+    If the broker has a journal each event has the topic and offset
+    of the message and a client can resume where it left off with
+    the Last-Event-ID header (or a cursor parameter), otherwise it
+    starts from since (an offset or timestamp) or from now. Without
+    a journal only messages published while connected are sent.
+    """
+    broker = pubsub_app.broker
+    if broker.journal is not None:
+        cursor = flask.request.headers.get("Last-Event-ID") or flask.request.args.get("cursor")
+        positions = {name: int(offset) for name, offset in parse_qsl(cursor or "")}
+        since = _since(flask.request.args.get("since"))
+        events = _journal_events(broker, topic, positions, since)
+    else:
+        events = _live_events(broker, topic)
+    return flask.Response(
+        events,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@pubsub_app.route("/metrics", methods=["GET"])
+def metrics():
+    """The broker's metrics in the Prometheus text format, or as
+    JSON with ?format=json.
+    """
+    broker_metrics = pubsub_app.broker.metrics
+    if flask.request.args.get("format") == "json":
+        return flask.jsonify(broker_metrics.snapshot())
+    return flask.Response(broker_metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @pubsub_app.route("/sub/<topic>", methods=["POST"])
 def sub(topic):
     # TODO: Add in filters triggers
     handler = flask.request.args.get("handler")
-    handler = _import(handler.split(":"))
+    handler = load(handler)
     pubsub_app.broker.sub(topic, handler)
     return "Thank you"
@@ -0,0 +1,158 @@
+"""Follow a glob of growing log files, like tail -F.
+
+A Follower polls the files matching a glob pattern and yields the
+complete lines appended to them since the last poll. Files are
+tracked by inode rather than by name, so when a log is rotated the
+remainder of the old file is still read (while it is open or still
+matches the pattern) and the newly created file is read from the
+start.
+
+The byte offset reached in each file can be persisted to a
+checkpoint file so that a restarted Follower resumes from the last
+committed offsets instead of re-reading whole files:
+
+    >>> follower = Follower("/var/log/app/*.log", checkpoint="app.ckpt")
+    >>> for lines in follower:
+    ...     process(lines)
+    ...     follower.commit()
+
+Offsets are only written by commit(), so calling it after each batch
+has been fully processed gives at-least-once processing of every
+line across restarts.
+"""
+import io
+import os
+import stat
+import json
+import time
+import logging
+import tempfile
+from glob import glob
+
+READ_BUFFER = 1024 * 1024
+
+log = logging.getLogger(__name__)
+
+
+def _key(st):
+    return "{}:{}".format(st.st_dev, st.st_ino)
+
+
+class Follower(object):
+    def __init__(
+            self,
+            pattern: str,
+            checkpoint: str=None,
+            interval: float=1.0,
+            binary: bool=False,
+            encoding: str="utf-8",
+            block_size: int=READ_BUFFER
+        ):
+        self.pattern = pattern
+        self.checkpoint = checkpoint
+        self.interval = interval
+        self.binary = binary
+        self.encoding = encoding
+        self.block_size = block_size
+        # "device:inode" -> [path, offset]
+        self.offsets = {}
+        self._files = {}
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with open(checkpoint, "r") as fin:
+                self.offsets = json.load(fin)
+        self._committed = json.dumps(self.offsets, sort_keys=True)
+
+    def _scan(self):
+        """Return {key: (path, size)} for the regular files matching
+        pattern, oldest first.
+        """
+        found = []
+        for path in glob(self.pattern):
+            try:
+                st = os.stat(path)
+            except OSError:
+                # removed since glob saw it
+                continue
+            if stat.S_ISREG(st.st_mode):
+                found.append((st.st_mtime, _key(st), path, st.st_size))
+        found.sort()
+        return {key: (path, size) for _, key, path, size in found}
+
+    def poll(self):
+        """Yield lists of the new, complete lines in every file."""
+        found = self._scan()
+        for key in list(self._files):
+            if key not in found:
+                # Deleted or rotated away from pattern, but we can
+                # still read what was written before that happened.
+                for lines in self._read(key):
+                    yield lines
+                self._files.pop(key).close()
+        for key in list(self.offsets):
+            if key not in found and key not in self._files:
+                del self.offsets[key]
+        newest = next(reversed(found), None)
+        for key, (path, size) in found.items():
+            offset = self.offsets.get(key, [path, 0])[1]
+            if size < offset:
+                log.warning("{} was truncated, reading from the start".format(path))
+                offset = 0
+            self.offsets[key] = [path, offset]
+            if size > offset:
+                if key not in self._files:
+                    self._files[key] = open(path, "rb")
+                for lines in self._read(key):
+                    yield lines
+            if key != newest and key in self._files and self.offsets[key][1] >= size:
+                # An older file, ie one rotated away, which has been
+                # read to the end. It is opened again if it grows.
+                self._files.pop(key).close()
+
+    def _read(self, key):
+        fin = self._files[key]
+        fin.seek(self.offsets[key][1])
+        pending = b""
+        while True:
+            data = fin.read(self.block_size)
+            if not data:
+                break
+            pending += data
+            end = pending.rfind(b"\n") + 1
+            if end:
+                lines = io.BytesIO(pending[:end]).readlines()
+                pending = pending[end:]
+                self.offsets[key][1] += end
+                if not self.binary:
+                    lines = [line.decode(self.encoding) for line in lines]
+                yield lines
+            if len(data) < self.block_size:
+                # a partial last line waits for the next poll
+                break
+
+    def commit(self):
+        """Persist the current offsets to the checkpoint file."""
+        if self.checkpoint is None:
+            return
+        state = json.dumps(self.offsets, sort_keys=True)
+        if state == self._committed:
+            return
+        directory = os.path.dirname(os.path.abspath(self.checkpoint))
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "w") as fout:
+            fout.write(state)
+        os.replace(tmp, self.checkpoint)
+        self._committed = state
+
+    def close(self):
+        for fin in self._files.values():
+            fin.close()
+        self._files = {}
+
+    def __iter__(self):
+        while True:
+            idle = True
+            for lines in self.poll():
+                idle = False
+                yield lines
+            if idle:
+                time.sleep(self.interval)
@@ -1,26 +1,43 @@
 from time import time
 import os
+import ast
 import re
-import pkg_resources
 from multiprocessing import Manager, Pool
-from concurrent.futures import ProcessPoolExecutor
 from collections import defaultdict
 from urllib.parse import urlparse, parse_qsl
 from functools import partial, reduce
 import atexit
+from types import CodeType
 from textwrap import dedent
 import sys
 import logging
-from lxml import etree
 from pathlib import Path
 from glob import glob
+from slither.plugins import get_registry
 import click
+from slither.sinks import open_sink
+from slither.sources import iter_lines
+from slither.reducers import is_combinable
+from slither.matchers import RegexFilter
+from slither.follow import Follower
+from slither.parallel import (
+    CHUNK_SIZE,
+    iter_unit,
+    work_units,
+    run_parallel,
+    worker_pipeline,
+)
 
 logging.basicConfig(
     stream=sys.stdout,
     level=20,
     format="%(message)s"
 )
+# stdout carries the output, so what --follow has to say about the
+# files it reads goes to stderr
+_follow_log = logging.getLogger("slither.follow")
+_follow_log.addHandler(logging.StreamHandler(sys.stderr))
+_follow_log.propagate = False
 
 def python_plugin(obj):
     module = obj.netloc
@@ -53,9 +70,8 @@ def map_handle_file(path, maps):
         for line in _map_handle_file(path, maps):
             yield line
     else:
-        with path.open("r") as fin:
-            for line in _map_handle_file(fin, maps):
-                yield line
+        for line in _map_handle_file(iter_lines(path), maps):
+            yield line
 
 def _filter_handle_file(path, logical_operator, filters):
     for line in path:
@@ -67,9 +83,8 @@ def filter_handle_file(path, logical_operator, filters):
         for line in _filter_handle_file(path, logical_operator, filters):
             yield line
     else:
-        with path.open("r") as fin:
-            for line in _filter_handle_file(fin, logical_operator, filters):
-                yield line
+        for line in _filter_handle_file(iter_lines(path), logical_operator, filters):
+            yield line
 
 def _reduce_handle_file(path, reducer):
     return reduce(reducer, path)
@@ -78,20 +93,47 @@ def reduce_handle_file(path, reducer):
     if path is sys.stdin:
         return _reduce_handle_file(path, reducer)
     else:
-        with path.open("r") as fin:
-            return _reduce_handle_file(fin, reducer)
+        return _reduce_handle_file(iter_lines(path), reducer)
+
+def _map_task(maps, unit):
+    _maps = worker_pipeline(maps, _resolve)
+    return [str(line) for line in _map_handle_file(iter_unit(unit), _maps)]
+
+def _strip_filtered(lines, logical_operator, filters):
+    return [
+        line.strip()
+        for line in _filter_handle_file(lines, logical_operator, filters)
+    ]
+
+def _filter_task(filters, logical_operator, unit):
+    _filters = worker_pipeline(filters, _build_filters, logical_operator)
+    return _strip_filtered(iter_unit(unit), logical_operator, _filters)
+
+def _reduce_task(reducer, unit):
+    reducer, = worker_pipeline(reducer, _resolve)
+    return reducer.accumulate(reducer.initial(), iter_unit(unit))
+
+def _iter_inputs(src):
+    """Yield an iterator over the lines of each file matched by src."""
+    if src == "-":
+        yield sys.stdin
+    else:
+        for path in glob(src):
+            path = Path(path)
+            if path.is_file():
+                yield iter_lines(path)
+            elif path.is_dir():
+                raise ValueError("Only filenames and glob patterns are allowed, not directories.")
 
 def _get_plugins(group: str="ginsu.plugin"):
     """Retrieve the items registered with setuptools
     entry_points for the given group (defaults to
-    slither.plugin group).
+    ginsu.plugin group). Plugins are only imported when
+    they are first looked up, see slither.plugins.
 
     TODO: Whitelist/blacklist for plugins
     """
-    plugins = {}
-    for ep in pkg_resources.iter_entry_points(group=group):
-        plugins.update({ep.name: ep.load()})
-    return plugins
+    return get_registry(group)
 
 def _import(module, func):
     """Perform the equivalent of from $module import $func
@@ -101,87 +143,165 @@ def _import(module, func):
     )
     return getattr(module, func)
 
+def _resolve(urls, plugins=None):
+    """Turn each plugin url (ie python://module/func) into a
+    callable using the plugin registered for its scheme.
+    """
+    if plugins is None:
+        plugins = _get_plugins()
+    ret = []
+    for url in urls:
+        obj = urlparse(url)
+        getter = obj.scheme
+        if getter in plugins:
+            getter = plugins[getter]
+        else:
+            raise ValueError("Cannot find plugin {}".format(getter))
+        ret.append(getter(obj))
+    return ret
+
+
+def _output_options(func):
+    """Add the options which control where output is written."""
+    func = click.option("--output", "-o", default="-", help="File to write output to, '-' is stdout.")(func)
+    func = click.option("--gzip", "compress", is_flag=True, help="gzip compress the output.")(func)
+    func = click.option("--log", "use_log", is_flag=True, help="Write output through the logging system.")(func)
+    return func
+
+def _sink(output, compress, use_log):
+    return open_sink(output, compress=compress, logger="ginsu.map" if use_log else None)
+
+def _follow_options(func):
+    """Add the options which control --follow mode."""
+    func = click.option("--follow", is_flag=True, help="Keep reading lines appended to src, like tail -F.")(func)
+    func = click.option("--checkpoint", default=None, help="File in which to persist offsets with --follow.")(func)
+    func = click.option("--interval", default=1.0, type=float, help="Seconds between polls with --follow.")(func)
+    return func
+
+def _follow(src, checkpoint, interval, sink, process):
+    """Pass each batch of new lines in the files matching src to
+    process and write the output to sink. Offsets are committed to
+    checkpoint only once the output of a batch has been flushed.
+    """
+    if src == "-":
+        raise click.UsageError("--follow requires a filename or glob pattern, not '-'")
+    follower = Follower(src, checkpoint=checkpoint, interval=interval)
+    try:
+        for lines in follower:
+            sink.writelines(process(lines))
+            sink.flush()
+            follower.commit()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        follower.close()
+
+def _build_filters(urls, logical_operator):
+    """Resolve filter urls. All regex://pattern filters are fused
+    into a single RegexFilter which scans each line once, the other
+    schemes are resolved as plugins.
+    """
+    patterns = [url.partition("://")[2] for url in urls if url.startswith("regex://")]
+    filters = _resolve([url for url in urls if not url.startswith("regex://")])
+    if patterns:
+        filters.insert(0, RegexFilter(patterns, logical_operator))
+    return filters
+
 
 cli = click.Group()
 
 @cli.command("map")
 @click.argument("src", type=click.Path())
 @click.option("--maps", "-m", multiple=True)
-def _map(src, maps):
-    log = logging.getLogger("ginsu.map")
-    plugins = _get_plugins()
-    _maps = []
-    for map in maps:
-        obj = urlparse(map)
-        getter = obj.scheme
-        if getter in plugins:
-            getter = plugins[getter]
+@click.option("--jobs", "-j", default=1, type=int, help="Number of worker processes.")
+@click.option("--chunk-size", default=CHUNK_SIZE, type=int, help="Bytes per unit of work with --jobs.")
+@click.option("--ordered/--unordered", default=True, help="Keep the input order of output with --jobs.")
+@_output_options
+@_follow_options
+def _map(src, maps, jobs, chunk_size, ordered, output, compress, use_log, follow, checkpoint, interval):
+    _maps = _resolve(maps)
+    with _sink(output, compress, use_log) as sink:
+        if follow:
+            _follow(src, checkpoint, interval, sink, partial(_map_handle_file, maps=_maps))
+        elif jobs > 1:
+            task = partial(_map_task, tuple(maps))
+            for lines in run_parallel(task, work_units(src, chunk_size), jobs, ordered):
+                sink.writelines(lines)
+        elif src == "-":
+            sink.writelines(map_handle_file(sys.stdin, _maps))
         else:
-            raise ValueError("Cannot find plugin {}".format(getter))
-        _maps.append(getter(obj))
-    if src == "-":
-        for line in map_handle_file(sys.stdin, _maps):
-            log.info(str(line))
-    else:
-        for path in glob(src):
-            path = Path(path)
-            if path.is_file():
-                for line in map_handle_file(path, _maps):
-                    log.info(str(line))
-            elif path.is_dir():
-                raise ValueError("Only filenames and glob patterns are allowed, not directories.")
+            for path in glob(src):
+                path = Path(path)
+                if path.is_file():
+                    sink.writelines(map_handle_file(path, _maps))
+                elif path.is_dir():
+                    raise ValueError("Only filenames and glob patterns are allowed, not directories.")
 
 @cli.command("filter")
 @click.argument("src", type=click.Path())
 @click.option("--filters", "-f", multiple=True)
 @click.option("--and", "logical_operator", flag_value=all, default=True)
 @click.option("--or", "logical_operator", flag_value=any)
-def _filter(src, filters, logical_operator):
-    log = logging.getLogger("ginsu.map")
-    plugins = _get_plugins()
-    _filters = []
-    for f in filters:
-        obj = urlparse(f)
-        getter = obj.scheme
-        if getter in plugins:
-            getter = plugins[getter]
+@click.option("--jobs", "-j", default=1, type=int, help="Number of worker processes.")
+@click.option("--chunk-size", default=CHUNK_SIZE, type=int, help="Bytes per unit of work with --jobs.")
+@click.option("--ordered/--unordered", default=True, help="Keep the input order of output with --jobs.")
+@_output_options
+@_follow_options
+def _filter(src, filters, logical_operator, jobs, chunk_size, ordered, output, compress, use_log, follow, checkpoint, interval):
+    _filters = _build_filters(filters, logical_operator)
+    with _sink(output, compress, use_log) as sink:
+        if follow:
+            process = partial(_strip_filtered, logical_operator=logical_operator, filters=_filters)
+            _follow(src, checkpoint, interval, sink, process)
+        elif jobs > 1:
+            task = partial(_filter_task, tuple(filters), logical_operator)
+            for lines in run_parallel(task, work_units(src, chunk_size), jobs, ordered):
+                sink.writelines(lines)
+        elif src == "-":
+            for line in filter_handle_file(sys.stdin, logical_operator, _filters):
+                sink.write(line.strip())
         else:
-            raise ValueError("Cannot find plugin {}".format(getter))
-        _filters.append(getter(obj))
-    if src == "-":
-        for line in filter_handle_file(sys.stdin, logical_operator, _filters):
-            log.info(line.strip())
-    else:
-        for path in glob(src):
-            path = Path(path)
-            if path.is_file():
-                for line in filter_handle_file(path, logical_operator, _filters):
-                    log.info(line.strip())
-            elif path.is_dir():
-                raise ValueError("Only filenames and glob patterns are allowed, not directories.")
+            for path in glob(src):
+                path = Path(path)
+                if path.is_file():
+                    for line in filter_handle_file(path, logical_operator, _filters):
+                        sink.write(line.strip())
+                elif path.is_dir():
+                    raise ValueError("Only filenames and glob patterns are allowed, not directories.")
 
 @cli.command("reduce")
 @click.argument("src", type=click.Path())
 @click.option("--reducer", "-r")
-def _reduce(src, reducer):
-    log = logging.getLogger("ginsu.map")
-    plugins = _get_plugins()
-    obj = urlparse(reducer)
-    getter = obj.scheme
-    if getter in plugins:
-        getter = plugins[getter]
-    else:
-        raise ValueError("Cannot find plugin {}".format(getter))
-    reducer = getter(obj)
-    if src == "-":
-        log.info(str(reduce_handle_file(sys.stdin, reducer)))
-    else:
-        for path in glob(src):
-            path = Path(path)
-            if path.is_file():
-                log.info(str(reduce_handle_file(path, reducer)))
-            elif path.is_dir():
-                raise ValueError("Only filenames and glob patterns are allowed, not directories.")
+@click.option("--jobs", "-j", default=1, type=int, help="Number of worker processes.")
+@click.option("--chunk-size", default=CHUNK_SIZE, type=int, help="Bytes per unit of work with --jobs.")
+@_output_options
+def _reduce(src, reducer, jobs, chunk_size, output, compress, use_log):
+    """Reduce the lines of src. Reducers which follow the protocol
+    in slither.reducers (ie reducer://count) are merged into a single
+    result for all files and can be run in parallel with --jobs.
+    Plain functions are applied with functools.reduce once per file.
+    """
+    url, (reducer,) = reducer, _resolve([reducer])
+    with _sink(output, compress, use_log) as sink:
+        if is_combinable(reducer):
+            if jobs > 1:
+                task = partial(_reduce_task, (url,))
+                partials = run_parallel(task, work_units(src, chunk_size), jobs)
+            else:
+                partials = (
+                    reducer.accumulate(reducer.initial(), lines)
+                    for lines in _iter_inputs(src)
+                )
+            sink.writelines(reducer.lines(reduce(reducer.merge, partials, reducer.initial())))
+        elif src == "-":
+            sink.write(reduce_handle_file(sys.stdin, reducer))
+        else:
+            for path in glob(src):
+                path = Path(path)
+                if path.is_file():
+                    sink.write(reduce_handle_file(path, reducer))
+                elif path.is_dir():
+                    raise ValueError("Only filenames and glob patterns are allowed, not directories.")
 
 pattern_action = re.compile(r"(.*?)\{(.+?)\s\}", re.UNICODE|re.DOTALL|re.MULTILINE)
 def parse_script(script):
@@ -193,65 +313,168 @@ def parse_script(script):
     for test, action in pattern_action.findall(script):
         if not test:
             test = "True"
-        ret[test.strip()].append(dedent(action))
+        # a one line action keeps the space after "{" when a string
+        # in it spans lines, which dedent won't touch
+        ret[test.strip()].append(dedent(action).lstrip(" \t"))
     if not ret:
         print("script '{}' yielded no actionable items".format(script))
         sys.exit(-1)
     return ret
 
 
+def compile_script(actions, filename="<aina>"):
+    """Compile the result of parse_script into three code objects
+    which are run once at startup, once per line and once at the
+    end respectively.
+
+    The per-line code object consists of the BEGINLINE actions,
+    one "if" block per test and finally the ENDLINE actions so that
+    each line is handled by a single exec without re-compiling
+    anything. The blocks are put together from the parsed actions
+    rather than their source, which would have to be re-indented
+    (along with the contents of any multi-line strings in it).
+    """
+    actions = dict(actions)
+    begin = actions.pop("BEGIN", [])
+    end = actions.pop("END", [])
+    per_line = _parse(actions.pop("BEGINLINE", []), filename)
+    end_line = actions.pop("ENDLINE", [])
+    for test, _actions in actions.items():
+        test = ast.parse("({})".format(test or "True"), filename, "eval").body
+        per_line.append(ast.If(test=test, body=_parse(_actions, filename) or [ast.Pass()], orelse=[]))
+    per_line.extend(_parse(end_line, filename))
+    module = ast.fix_missing_locations(ast.Module(body=per_line, type_ignores=[]))
+    return (
+        compile("\n".join(begin), filename, "exec"),
+        compile(module, filename, "exec"),
+        compile("\n".join(end), filename, "exec"),
+    )
+
+def _parse(actions, filename):
+    """Return the statements of actions, a list of source strings."""
+    return ast.parse("\n".join(actions), filename).body
+
+
+_REGEX_SPECIAL = set(".^$*+?{}[]|()")
+_ESCAPES = {"t": "\t", "n": "\n", "r": "\r", "f": "\f", "v": "\v"}
+
+def _literal_seperator(pattern):
+    """Return the plain string matched by pattern if pattern is a
+    literal (ie "," or "\\t"), otherwise return None.
+    """
+    out = []
+    chars = iter(pattern)
+    for c in chars:
+        if c == "\\":
+            c = next(chars, None)
+            if c is None:
+                return None
+            elif c in _ESCAPES:
+                c = _ESCAPES[c]
+            elif c.isalnum():
+                # \s, \d, \1 and friends
+                return None
+        elif c in _REGEX_SPECIAL:
+            return None
+        out.append(c)
+    return "".join(out) or None
+
+def _split_whitespace(line):
+    return line.split() or [line]
+
+def _splitter(field_seperator, binary=False):
+    """Return a function which splits a line into FIELDS.
+
+    Whitespace (the default) and literal separators use str.split
+    (or bytes.split) and only real regular expressions go through
+    the regex engine.
+    """
+    if field_seperator == r"\s+":
+        return _split_whitespace
+    literal = _literal_seperator(field_seperator)
+    if literal is not None:
+        if binary:
+            literal = literal.encode()
+        return partial(_split_literal, seperator=literal)
+    if binary:
+        field_seperator = field_seperator.encode()
+    return re.compile(field_seperator).split
+
+def _split_literal(line, seperator):
+    return line.split(seperator)
+
+def _nested_names(code):
+    """Return the names used by any function, lambda or comprehension
+    defined within code.
+    """
+    names = set()
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names.update(const.co_names)
+            names.update(_nested_names(const))
+    return names
+
+class _Namespace(dict):
+    """The namespace aina scripts are executed in. FIELDS is split
+    out of LINE the first time it is looked up on each line so that
+    scripts which never touch FIELDS never pay for splitting.
+    """
+    def __init__(self, split):
+        super().__init__()
+        self.split = split
+
+    def __missing__(self, key):
+        if key == "FIELDS":
+            fields = self["FIELDS"] = self.split(self["LINE"])
+            return fields
+        raise KeyError(key)
+
+
 @cli.command("slither")
 @click.option("--field-seperator", "-F", default=r"\s+")
+@click.option("--bytes", "binary", is_flag=True, help="Work on raw bytes without decoding.")
+@_output_options
 @click.argument("script")
 @click.argument("files", nargs=-1)
-def aina(field_seperator, script, files):
+def aina(field_seperator, binary, output, compress, use_log, script, files):
     """aina is not awk. A Python based alternative to awk which
     provides an ad-hoc command-line based ETL system for modern
     workloads.
+
+    Besides print(), scripts can call OUT(value) to write a line
+    to the buffered output selected with --output.
     """
-    field_seperator = re.compile(field_seperator)
+    split = _splitter(field_seperator, binary)
     if not files:
         files = ["-"]
-    actions = parse_script(script)
-    if "BEGIN" in actions:
-        for action in actions.pop("BEGIN"):
-            exec(dedent(action), locals())
-    end_actions = []
-    if "END" in actions:
-        for action in actions.pop("END"):
-            end_actions.append(dedent(action))
-    if "BEGINLINE" in actions:
-        begin_line = actions.pop("BEGINLINE")
-    else:
-        begin_line = []
-    if "ENDLINE" in actions:
-        end_line = actions.pop("ENDLINE")
-    else:
-        end_line = []
-    for item in files:
-        if item == '-':
-            item = ["-"]
-        else:
-            item = glob(item)
-        for filename in item:
-            FNR = 0
-            with click.open_file(filename, "r") as fin:
+    begin, per_line, end = compile_script(parse_script(script))
+    # Module level lookups of FIELDS go through _Namespace.__missing__
+    # but lookups from functions and comprehensions do not, so those
+    # scripts get FIELDS split up front.
+    eager = "FIELDS" in _nested_names(per_line)
+    with _sink(output, compress, use_log) as sink:
+        namespace = _Namespace(split)
+        namespace["OUT"] = sink.write
+        exec(begin, namespace)
+        for item in files:
+            if item == '-':
+                item = ["-"]
+            else:
+                item = glob(item)
+            for filename in item:
+                namespace["filename"] = filename
+                FNR = 0
                 NR = 0
-                for LINE in (line.strip() for line in fin):
+                for LINE in (line.strip() for line in iter_lines(filename, binary=binary)):
                     FNR, NR = FNR + 1, NR + 1
-                    FIELDS = field_seperator.split(LINE)
-                    for test in actions:
-                        if begin_line:
-                            for action in begin_line:
-                                exec(action, locals())
-                        if eval(test, locals()):
-                            for action in actions[test]:
-                                exec(action, locals())
-                        if end_line:
-                            for action in end_line:
-                                exec(action, locals())
-    for action in end_actions:
-        exec(action, locals())
+                    namespace["FNR"], namespace["NR"] = FNR, NR
+                    namespace["LINE"] = LINE
+                    if eager:
+                        namespace["FIELDS"] = split(LINE)
+                    else:
+                        namespace.pop("FIELDS", None)
+                    exec(per_line, namespace)
+        exec(end, namespace)
 
 if __name__ == "__main__":
     cli()
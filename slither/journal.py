@@ -0,0 +1,480 @@
+"""A durable, append-only log of the messages published to each topic.
+
+A Journal keeps one TopicLog per topic in a directory of its own.
+Each TopicLog is a sequence of segment files named after the offset
+of their first message, with a sparse index beside each one:
+
+    journal/
+        app.web/
+            00000000000000000000.log
+            00000000000000000000.idx
+            00000000000001048576.log
+            00000000000001048576.idx
+        .cursors/
+            audit.json
+
+Appended messages are assigned consecutive offsets straight away but
+are only written out when the log is committed, so many appends share
+one write and one fsync (group commit). A Journal commits its logs
+every commit_interval seconds from a background thread.
+
+Committed messages are read back through mmap, starting from an
+offset or from the first message published at or after a timestamp:
+
+    >>> journal = Journal("journal")
+    >>> journal.append("app.web", "hello")
+    0
+    >>> journal.commit()
+    >>> for topic, offset, timestamp, message in journal.replay("app"):
+    ...     print(topic, offset, message)
+    app.web 0 hello
+
+A Cursor remembers the next offset a named consumer should read in
+each topic. Advancing it only after a message has been handled gives
+at-least-once delivery across restarts.
+"""
+import os
+import re
+import sys
+import json
+import mmap
+import time
+import heapq
+import pickle
+import struct
+import logging
+import tempfile
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+# offset, timestamp, payload size, payload kind
+HEADER = struct.Struct("<QdIc")
+# offset, position in the segment, timestamp
+INDEX_ENTRY = struct.Struct("<QQd")
+SEGMENT_BYTES = 64 * 1024 * 1024
+INDEX_INTERVAL = 4096
+GROUP_BYTES = 1024 * 1024
+COMMIT_INTERVAL = 0.05
+
+_segment_name = re.compile(r"^(\d{20})\.log$")
+
+
+def encode(message):
+    """Return the kind (a single byte) and bytes of message. str and
+    bytes are stored as they are, anything else is pickled. The
+    broker uses the same encoding to pass messages to subscriber
+    processes and to spill queues to disk.
+    """
+    if isinstance(message, str):
+        return b"s", message.encode("utf-8")
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return b"b", bytes(message)
+    return b"p", pickle.dumps(message)
+
+def decode(kind, data):
+    """Return the message encode returned kind and data for."""
+    if kind == b"s":
+        return data.decode("utf-8")
+    if kind == b"b":
+        return data
+    return pickle.loads(data)
+
+def _tagged(topic, records):
+    for offset, timestamp, message in records:
+        yield timestamp, topic, offset, message
+
+def _timestamp(since):
+    if isinstance(since, datetime):
+        return since.timestamp()
+    return float(since)
+
+
+class Segment(object):
+    """One segment file of a TopicLog and its sparse index."""
+    def __init__(self, directory: str, base_offset: int):
+        self.base_offset = base_offset
+        name = os.path.join(directory, "{:020d}".format(base_offset))
+        self.log_path = name + ".log"
+        self.index_path = name + ".idx"
+        self.size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        # [(offset, position, timestamp)]
+        self.index = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as fin:
+                data = fin.read()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            self.index = [
+                entry for entry in INDEX_ENTRY.iter_unpack(data[:usable])
+                # the index may be ahead of a log that was cut short
+                if entry[1] < self.size
+            ]
+        self._map = None
+
+    def view(self, size: int):
+        """Return an mmap of the first size bytes or more of the
+        segment, mapping it again if it has grown.
+        """
+        if self._map is None or len(self._map) < size:
+            with open(self.log_path, "rb") as fin:
+                # Readers still iterating the old map keep it alive
+                self._map = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def records(self, start: int, end: int, size: int):
+        """Yield (offset, timestamp, message) for the records with
+        offsets from start up to end in the first size bytes.
+        """
+        if not size:
+            return
+        position = 0
+        i = bisect_right(self.index, (start, sys.maxsize)) - 1
+        if i >= 0:
+            position = self.index[i][1]
+        view = self.view(size)
+        unpack_from = HEADER.unpack_from
+        header_size = HEADER.size
+        while position < size:
+            offset, timestamp, length, kind = unpack_from(view, position)
+            if offset >= end:
+                return
+            position += header_size
+            if offset >= start:
+                yield offset, timestamp, decode(kind, view[position:position + length])
+            position += length
+
+    def first_at(self, timestamp: float, size: int):
+        """Return the offset of the first record at or after
+        timestamp in the first size bytes, or None.
+        """
+        position = 0
+        for entry in self.index:
+            if entry[2] >= timestamp:
+                break
+            position = entry[1]
+        if not size:
+            return None
+        view = self.view(size)
+        while position < size:
+            offset, _timestamp, length, _ = HEADER.unpack_from(view, position)
+            if _timestamp >= timestamp:
+                return offset
+            position += HEADER.size + length
+        return None
+
+    def recover(self):
+        """Scan the records after the last index entry, cutting off a
+        record which was only partly written along with the index
+        entries past it. Returns the offset and timestamp of the last
+        complete record or None.
+        """
+        # the last entry may point at the partly written record, so
+        # step back until some complete record follows one
+        i = len(self.index)
+        with open(self.log_path, "rb") as fin:
+            while True:
+                i -= 1
+                position = self.index[i][1] if i >= 0 else 0
+                fin.seek(position)
+                last, end = self._scan(fin.read())
+                end += position
+                if last is not None or i < 0:
+                    break
+        if end < self.size:
+            log.warning("Truncating {} partly written bytes from {}".format(
+                self.size - end, self.log_path
+            ))
+            with open(self.log_path, "r+b") as fout:
+                fout.truncate(end)
+            self.size = end
+        index = [entry for entry in self.index if entry[1] < self.size]
+        index_size = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+        if index_size != len(index) * INDEX_ENTRY.size:
+            with open(self.index_path, "wb") as fout:
+                fout.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in index))
+        self.index = index
+        return last
+
+    @staticmethod
+    def _scan(data):
+        """Return the (offset, timestamp) of the last complete record
+        in data, or None, and where it ends.
+        """
+        last, position = None, 0
+        while position + HEADER.size <= len(data):
+            offset, timestamp, length, _ = HEADER.unpack_from(data, position)
+            if position + HEADER.size + length > len(data):
+                break
+            last = (offset, timestamp)
+            position += HEADER.size + length
+        return last, position
+
+
+class TopicLog(object):
+    """The segments holding the messages of one topic."""
+    def __init__(
+            self,
+            directory: str,
+            segment_bytes: int=SEGMENT_BYTES,
+            index_interval: int=INDEX_INTERVAL,
+            group_bytes: int=GROUP_BYTES,
+            fsync: bool=True
+        ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.group_bytes = group_bytes
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        bases = sorted(
+            int(match.group(1))
+            for match in map(_segment_name.match, os.listdir(directory)) if match
+        )
+        self.segments = [Segment(directory, base) for base in bases or [0]]
+        self.next_offset = self.segments[-1].base_offset
+        self.last_timestamp = 0.0
+        last = self.segments[-1].recover() if bases else None
+        if last is not None:
+            self.next_offset = last[0] + 1
+            self.last_timestamp = last[1]
+        # offsets below committed have been written out
+        self.committed = self.next_offset
+        self._lock = threading.RLock()
+        self._pending = []
+        self._pending_bytes = 0
+        self._pending_index = []
+        self._since_index = self.index_interval
+        self._open_active()
+
+    def _open_active(self):
+        active = self.segments[-1]
+        self._log_file = open(active.log_path, "ab")
+        self._index_file = open(active.index_path, "ab")
+        self._size = active.size
+
+    def append(self, message, timestamp: float=None):
+        """Append message and return its offset. The message can
+        only be read once the log has been committed.
+        """
+        kind, data = encode(message)
+        with self._lock:
+            if timestamp is None:
+                timestamp = time.time()
+            # Timestamps never go backwards so they can be searched
+            timestamp = max(timestamp, self.last_timestamp)
+            record_size = HEADER.size + len(data)
+            if self._size > 0 and self._size + record_size > self.segment_bytes:
+                self._commit()
+                self._roll()
+            offset = self.next_offset
+            if self._since_index >= self.index_interval:
+                self._pending_index.append(INDEX_ENTRY.pack(offset, self._size, timestamp))
+                self._since_index = 0
+            self._pending.append(HEADER.pack(offset, timestamp, len(data), kind))
+            self._pending.append(data)
+            self._size += record_size
+            self._since_index += record_size
+            self._pending_bytes += record_size
+            self.next_offset += 1
+            self.last_timestamp = timestamp
+            if self._pending_bytes >= self.group_bytes:
+                self._commit()
+            return offset
+
+    def _roll(self):
+        self._log_file.close()
+        self._index_file.close()
+        self.segments.append(Segment(self.directory, self.next_offset))
+        self._since_index = self.index_interval
+        self._open_active()
+
+    def commit(self):
+        """Write out every appended message with a single write (and
+        fsync if the log was created with fsync=True).
+        """
+        with self._lock:
+            self._commit()
+
+    def _commit(self):
+        if not self._pending:
+            return
+        self._log_file.write(b"".join(self._pending))
+        self._log_file.flush()
+        if self.fsync:
+            os.fsync(self._log_file.fileno())
+        # The index is only a hint, a missing entry costs a longer
+        # scan so it isn't fsynced
+        self._index_file.write(b"".join(self._pending_index))
+        self._index_file.flush()
+        active = self.segments[-1]
+        active.size = self._size
+        for entry in self._pending_index:
+            active.index.append(INDEX_ENTRY.unpack(entry))
+        self._pending = []
+        self._pending_index = []
+        self._pending_bytes = 0
+        self.committed = self.next_offset
+
+    @property
+    def dirty(self):
+        return bool(self._pending)
+
+    def read(self, start: int=0, end: int=None):
+        """Yield (offset, timestamp, message) for the committed
+        messages from offset start up to, but not including, end.
+        """
+        with self._lock:
+            if end is None or end > self.committed:
+                end = self.committed
+            segments = [(segment, segment.size) for segment in self.segments]
+        bases = [segment.base_offset for segment, _ in segments]
+        i = max(bisect_right(bases, start) - 1, 0)
+        for segment, size in segments[i:]:
+            if segment.base_offset >= end:
+                return
+            for record in segment.records(start, end, size):
+                yield record
+
+    def offset_at(self, timestamp: float):
+        """Return the offset of the first committed message published
+        at or after timestamp.
+        """
+        with self._lock:
+            segments = [(segment, segment.size) for segment in self.segments]
+            committed = self.committed
+        firsts = [segment.index[0][2] if segment.index else 0.0 for segment, _ in segments]
+        # the previous segment may end with records at timestamp too
+        i = max(bisect_left(firsts, timestamp) - 1, 0)
+        for segment, size in segments[i:]:
+            offset = segment.first_at(timestamp, size)
+            if offset is not None:
+                return offset
+        return committed
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self._log_file.close()
+            self._index_file.close()
+
+
+class Cursor(object):
+    """The next offset to read in each topic for one consumer,
+    persisted to a JSON file.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets = {}
+        if os.path.exists(path):
+            with open(path, "r") as fin:
+                self.offsets = json.load(fin)
+
+    def get(self, topic: str, default: int=None):
+        return self.offsets.get(topic, default)
+
+    def advance(self, topic: str, offset: int):
+        """Record that every message in topic before offset has been
+        handled. Call save() to persist it.
+        """
+        self.offsets[topic] = offset
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "w") as fout:
+            json.dump(self.offsets, fout, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+class Journal(object):
+    """A TopicLog for each topic in directories beneath root. options
+    are passed on to each TopicLog. If commit_interval isn't None,
+    a background thread commits every log that often.
+    """
+    def __init__(self, root: str, commit_interval: float=COMMIT_INTERVAL, **options):
+        self.root = root
+        self.options = options
+        self.logs = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        os.makedirs(root, exist_ok=True)
+        self._committer = None
+        if commit_interval is not None:
+            self._committer = threading.Thread(
+                target=self._commit_every, args=(commit_interval,), daemon=True
+            )
+            self._committer.start()
+
+    def log(self, topic: str):
+        """Return the TopicLog for topic, creating it if needed."""
+        try:
+            return self.logs[topic]
+        except KeyError:
+            if not topic or topic.startswith(".") or os.sep in topic or (os.altsep and os.altsep in topic):
+                raise ValueError("{} can't be used as a journal topic".format(topic))
+            with self._lock:
+                if topic not in self.logs:
+                    self.logs[topic] = TopicLog(os.path.join(self.root, topic), **self.options)
+                return self.logs[topic]
+
+    def topics(self):
+        """Return the names of every topic with a log."""
+        return sorted(
+            name for name in os.listdir(self.root)
+            if not name.startswith(".") and os.path.isdir(os.path.join(self.root, name))
+        )
+
+    def append(self, topic: str, message, timestamp: float=None):
+        return self.log(topic).append(message, timestamp)
+
+    def commit(self):
+        for topic_log in list(self.logs.values()):
+            topic_log.commit()
+
+    def _commit_every(self, interval):
+        while not self._closed.wait(interval):
+            for topic_log in list(self.logs.values()):
+                if topic_log.dirty:
+                    try:
+                        topic_log.commit()
+                    except Exception:
+                        log.exception("Could not commit {}".format(topic_log.directory))
+
+    def cursor(self, name: str):
+        return Cursor(os.path.join(self.root, ".cursors", "{}.json".format(name)))
+
+    def replay(self, topic: str, since=None, cursor: Cursor=None):
+        """Yield (topic, offset, timestamp, message) for the committed
+        messages of topic and every topic beneath it, in timestamp
+        order.
+
+        Each topic is read from the offset saved in cursor if it has
+        one, otherwise from since which is either an offset (an int)
+        or a timestamp (a float or datetime), otherwise from the start.
+        """
+        streams = []
+        for name in self.topics():
+            if name != topic and not name.startswith(topic + "."):
+                continue
+            topic_log = self.log(name)
+            start = cursor.get(name) if cursor is not None else None
+            if start is None:
+                if since is None:
+                    start = 0
+                elif isinstance(since, int):
+                    start = since
+                else:
+                    start = topic_log.offset_at(_timestamp(since))
+            streams.append(_tagged(name, topic_log.read(start)))
+        for timestamp, name, offset, message in heapq.merge(*streams, key=lambda r: (r[0], r[1], r[2])):
+            yield name, offset, timestamp, message
+
+    def close(self):
+        self._closed.set()
+        if self._committer is not None:
+            self._committer.join()
+        for topic_log in list(self.logs.values()):
+            topic_log.close()
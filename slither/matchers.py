@@ -0,0 +1,140 @@
+"""Match text against many regular expressions at once.
+
+RegexFilter fuses a list of patterns into a single compiled regular
+expression so that each line is handed to the regex engine once,
+rather than once per pattern:
+
+    >>> f = RegexFilter(["error", r"timeout after \\d+s"], any)
+    >>> f("connection timeout after 30s\\n")
+    True
+
+With any the patterns are joined as one alternation. With all they
+become a chain of lookaheads which must all succeed.
+
+Before the regex runs, lines are checked for the literal substrings
+which the patterns require (ie "timeout after " above) using the
+"in" operator, which is much cheaper than the regex engine and lets
+most non-matching lines be rejected without running it at all.
+"""
+import re
+try:
+    from re import _parser as sre_parse
+    from re._constants import LITERAL
+except ImportError:  # Python < 3.11
+    import sre_parse
+    from sre_constants import LITERAL
+
+_global_flags = re.compile(r"^\(\?([aiLmsux]+)\)")
+_backreference = re.compile(r"\\[1-9]|\(\?P=")
+
+
+def required_literal(pattern):
+    """Return the longest literal substring which every match of
+    pattern must contain or None if there isn't one (or the pattern
+    is case-insensitive).
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return None
+    if parsed.state.flags & (re.IGNORECASE | re.VERBOSE):
+        return None
+    best, run = "", []
+    # Only the top level of the pattern is considered, literals
+    # inside groups, repeats or alternations may not be required.
+    for op, av in list(parsed) + [(None, None)]:
+        if op is LITERAL:
+            run.append(chr(av))
+            continue
+        if len(run) > len(best):
+            best = "".join(run)
+        run = []
+    return best or None
+
+def _scoped(pattern):
+    """Turn leading global flags such as (?i) into a scoped group so
+    the pattern can be embedded in a larger expression.
+    """
+    match = _global_flags.match(pattern)
+    if match is None:
+        return "(?:{})".format(pattern)
+    return "(?{}:{})".format(match.group(1), pattern[match.end():])
+
+def fusable(pattern):
+    """Return True if pattern can be embedded in a larger expression
+    by fuse. Patterns with backreferences can't be, since the group
+    numbers they refer to would change.
+    """
+    return not _backreference.search(pattern)
+
+def fuse(patterns, logical_operator=any):
+    """Return one compiled regular expression which finds any of
+    patterns with search or, if logical_operator is all, which
+    matches at the start of a string only if re.search would find
+    all of patterns. Raises ValueError if any of patterns isn't
+    fusable.
+    """
+    patterns = list(patterns)
+    for pattern in patterns:
+        if not fusable(pattern):
+            raise ValueError("Patterns with backreferences can't be fused: {!r}".format(pattern))
+    if logical_operator is any:
+        return re.compile("|".join(_scoped(p) for p in patterns))
+    return re.compile("".join("(?=(?s:.*?){})".format(_scoped(p)) for p in patterns))
+
+
+class RegexFilter(object):
+    """A callable which returns True when logical_operator (any or
+    all) of patterns are found in a line.
+    """
+    def __init__(self, patterns, logical_operator=all):
+        self.patterns = list(patterns)
+        self.logical_operator = logical_operator
+        self.literals = [required_literal(p) for p in self.patterns]
+        together = [p for p in self.patterns if fusable(p)]
+        self.separate = [re.compile(p) for p in self.patterns if not fusable(p)]
+        self.fused = None
+        if together:
+            try:
+                fused = fuse(together, logical_operator)
+                self.fused = fused.match if logical_operator is all else fused.search
+            except re.error:
+                # ie the same group name used in two patterns
+                self.separate = [re.compile(p) for p in self.patterns]
+        if logical_operator is all:
+            self.prefilter = [literal for literal in self.literals if literal]
+        elif all(self.literals):
+            self.prefilter = self.literals
+        else:
+            # one of the patterns could match without any literal
+            self.prefilter = None
+
+    def __call__(self, line):
+        if self.logical_operator is all:
+            return self._all(line)
+        return self._any(line)
+
+    def _all(self, line):
+        for literal in self.prefilter:
+            if literal not in line:
+                return False
+        if self.fused is not None and self.fused(line) is None:
+            return False
+        for regex in self.separate:
+            if regex.search(line) is None:
+                return False
+        return True
+
+    def _any(self, line):
+        if self.prefilter is not None:
+            for literal in self.prefilter:
+                if literal in line:
+                    break
+            else:
+                return False
+        if self.fused is not None and self.fused(line) is not None:
+            return True
+        for regex in self.separate:
+            if regex.search(line) is not None:
+                return True
+        return False
@@ -0,0 +1,413 @@
+"""Counters and latency histograms for a Broker.
+
+Every Broker keeps a Metrics object which counts, for each topic,
+the messages published to it and how many deliveries to subscribers
+they matched or were filtered out of, and for each subscriber, the
+messages matched, in flight, completed, failed and dropped along
+with a histogram of how long its handler took:
+
+    >>> broker = Broker()
+    >>> broker.sub("app", print)
+    >>> broker.pub("app.web", "hello")
+    >>> broker.metrics.snapshot()["topics"]["app.web"]["published"]
+    1
+
+Each subscription is counted on its own, under the name given to
+sub() or else that of its result logger, ie "app.print", with "#2",
+"#3"... appended when another subscription already has the name.
+Its metrics are removed by unsub.
+Only the first MAX_TOPICS topics are counted by name, those beyond
+them, like topics carrying ids, are counted together under
+OTHER_TOPICS.
+render() returns the same numbers in the Prometheus text format,
+which is what pubsub_app serves at /metrics.
+
+Each thread adds to counters of its own, which are only summed by
+snapshot() and render(), so updating a metric takes no lock and costs
+much less than handing the message to an executor.
+"""
+import logging
+import threading
+import weakref
+from bisect import bisect_left
+from time import perf_counter
+
+log = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the handler duration buckets, from
+# 100us doubling up to about 13s
+DURATION_BUCKETS = tuple(round(0.0001 * 2 ** i, 4) for i in range(18))
+# Topics counted by name, messages published to any other topic are
+# counted under OTHER_TOPICS so the metrics can't grow without bound
+MAX_TOPICS = 1000
+OTHER_TOPICS = "(other)"
+# The SubscriberMetrics fields rendered for Prometheus and their types
+SUBSCRIBER_FIELDS = (
+    ("matched", "counter"),
+    ("completed", "counter"),
+    ("failed", "counter"),
+    ("dropped", "counter"),
+    ("in_flight", "gauge"),
+)
+
+
+def _timed(handler, message):
+    """Call handler with message and return (result, seconds). Run
+    in the executor, so it must be importable.
+    """
+    start = perf_counter()
+    result = handler(message)
+    return result, perf_counter() - start
+
+def _timed_each(handler, messages):
+    """Call handler with each of messages and return (results of the
+    calls which succeeded, number of calls which raised, seconds for
+    all of them). A message the handler raises on is logged and does
+    not keep it from the rest.
+    """
+    results, failed = [], 0
+    start = perf_counter()
+    for message in messages:
+        try:
+            results.append(handler(message))
+        except Exception:
+            log.exception("Handler {!r} failed on {!r}".format(handler, message))
+            failed += 1
+    return results, failed, perf_counter() - start
+
+
+class Histogram(object):
+    """Counts of observations in buckets with fixed upper bounds."""
+    def __init__(self, bounds=DURATION_BUCKETS):
+        self.bounds = tuple(bounds)
+        # the last bucket is for everything above the last bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float, count: int=1):
+        """Record count observations of value."""
+        self.counts[bisect_left(self.bounds, value)] += count
+        self.count += count
+        self.sum += value * count
+
+    def quantile(self, q: float):
+        """Return the upper bound of the bucket holding the q'th
+        quantile, None without observations or if it's above the
+        last bound.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def cumulative(self):
+        """Yield (upper bound, observations at or below it)."""
+        seen = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            seen += count
+            yield bound, seen
+
+    def merge(self, other):
+        """Add the observations of other, which has the same bounds."""
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+
+class _ThreadEnd(object):
+    """Kept only in a thread's slot of a threading.local, so it is
+    collected, and its finalizer run, when the thread ends.
+    """
+    __slots__ = ("__weakref__",)
+
+
+def _retire(ref, shard):
+    """Fold the shard of an ended thread into the retired total of
+    the _PerThread ref points to, if that is still around.
+    """
+    metrics = ref()
+    if metrics is not None:
+        with metrics._lock:
+            metrics._merge(metrics._retired, shard)
+            del metrics._shards[id(shard)]
+
+
+class _PerThread(object):
+    """Metrics kept by each thread in a shard of its own. A shard is
+    only ever changed by its thread, so updating it needs no lock.
+    When the thread ends its shard is added to a shared total, so
+    short-lived threads don't leave shards behind.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._retired = self._new_shard()
+        # id(shard) -> shard of each live thread
+        self._shards = {}
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            return self._add_shard()
+
+    def _add_shard(self):
+        shard = self._new_shard()
+        with self._lock:
+            self._shards[id(shard)] = shard
+        self._local.shard = shard
+        self._local.end = _ThreadEnd()
+        # only a weak reference to self, so metrics which are no
+        # longer used aren't kept alive by long-lived threads
+        weakref.finalize(self._local.end, _retire, weakref.ref(self), shard)
+        return shard
+
+    def _all(self):
+        with self._lock:
+            return [self._retired] + list(self._shards.values())
+
+
+class TopicMetrics(_PerThread):
+    """Messages published to a topic and the deliveries to the
+    subscribers of it and its parents which they matched or were
+    filtered out of.
+    """
+    def _new_shard(self):
+        # published, matched, filtered
+        return [0, 0, 0]
+
+    @staticmethod
+    def _merge(total, shard):
+        total[:] = [mine + theirs for mine, theirs in zip(total, shard)]
+
+    def add(self, published: int, subscribers: int, matched: int):
+        """Record published messages routed to subscribers, matching
+        matched (message, subscriber) pairs in all.
+        """
+        shard = self._shard()
+        shard[0] += published
+        shard[1] += matched
+        shard[2] += published * subscribers - matched
+
+    @property
+    def published(self):
+        return sum(shard[0] for shard in self._all())
+
+    @property
+    def matched(self):
+        return sum(shard[1] for shard in self._all())
+
+    @property
+    def filtered(self):
+        return sum(shard[2] for shard in self._all())
+
+    def snapshot(self):
+        totals = [sum(counts) for counts in zip([0, 0, 0], *self._all())]
+        return dict(zip(("published", "matched", "filtered"), totals))
+
+
+class _SubscriberShard(object):
+    __slots__ = ("matched", "started", "completed", "failed", "dropped", "duration")
+
+    def __init__(self):
+        self.matched = 0
+        # messages handed over, in flight until completed, failed or
+        # dropped, which may well happen in another thread
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.duration = Histogram()
+
+
+class SubscriberMetrics(_PerThread):
+    """Messages handled by one subscriber and how long its handler
+    took for them.
+    """
+    def __init__(self, name: str=None):
+        super().__init__()
+        self.name = name
+
+    def _new_shard(self):
+        return _SubscriberShard()
+
+    @staticmethod
+    def _merge(total, shard):
+        for field in _SubscriberShard.__slots__[:-1]:
+            setattr(total, field, getattr(total, field) + getattr(shard, field))
+        total.duration.merge(shard.duration)
+
+    def match(self, count: int=1):
+        """count messages matched the subscriber."""
+        self._shard().matched += count
+
+    def start(self, count: int=1):
+        """count messages were handed to the handler's executor,
+        queue or processes.
+        """
+        self._shard().started += count
+
+    def dispatch(self, count: int=1):
+        """match and start count messages at once."""
+        shard = self._shard()
+        shard.matched += count
+        shard.started += count
+
+    def complete(self, duration: float, count: int=1, calls: int=1):
+        """count messages were handled by calls to the handler which
+        took duration seconds in all. A batch handler is called once
+        for many messages, otherwise there is a call per message.
+        """
+        shard = self._shard()
+        shard.completed += count
+        shard.duration.observe(duration / calls, calls)
+
+    def fail(self, count: int=1, duration: float=None):
+        shard = self._shard()
+        shard.failed += count
+        if duration is not None:
+            shard.duration.observe(duration)
+
+    def drop(self, count: int=1):
+        """count messages were discarded by an overflowing queue."""
+        self._shard().dropped += count
+
+    def _total(self, field):
+        return sum(getattr(shard, field) for shard in self._all())
+
+    @property
+    def matched(self):
+        return self._total("matched")
+
+    @property
+    def completed(self):
+        return self._total("completed")
+
+    @property
+    def failed(self):
+        return self._total("failed")
+
+    @property
+    def dropped(self):
+        return self._total("dropped")
+
+    @property
+    def in_flight(self):
+        # a message is started before it finishes, so counting the
+        # finished ones first never gives less than nothing in flight
+        finished = self.completed + self.failed + self.dropped
+        return self._total("started") - finished
+
+    @property
+    def duration(self):
+        """A Histogram of the durations observed by all threads."""
+        duration = Histogram()
+        for shard in self._all():
+            duration.merge(shard.duration)
+        return duration
+
+    def snapshot(self):
+        completed, failed, dropped = (self._total(field) for field in ("completed", "failed", "dropped"))
+        duration = self.duration
+        return {
+            "matched": self.matched,
+            "in_flight": self._total("started") - completed - failed - dropped,
+            "completed": completed,
+            "failed": failed,
+            "dropped": dropped,
+            "duration": {
+                "count": duration.count,
+                "sum": duration.sum,
+                "p50": duration.quantile(0.5),
+                "p99": duration.quantile(0.99),
+            },
+        }
+
+
+class Metrics(object):
+    """The TopicMetrics and SubscriberMetrics of a Broker, created
+    as they are first needed.
+    """
+    def __init__(self):
+        self.topics = {}
+        self.subscribers = {}
+        self._lock = threading.Lock()
+
+    def topic(self, name: str):
+        """Return the TopicMetrics of name, or of OTHER_TOPICS once
+        MAX_TOPICS others are counted.
+        """
+        try:
+            return self.topics[name]
+        except KeyError:
+            with self._lock:
+                if name not in self.topics and len(self.topics) >= MAX_TOPICS:
+                    name = OTHER_TOPICS
+                return self.topics.setdefault(name, TopicMetrics())
+
+    def register(self, name: str):
+        """Return new SubscriberMetrics for a subscription, named name
+        or, if that is taken, name with the first free "#2", "#3"...
+        appended.
+        """
+        with self._lock:
+            unique, number = name, 1
+            while unique in self.subscribers:
+                number += 1
+                unique = "{}#{}".format(name, number)
+            metrics = self.subscribers[unique] = SubscriberMetrics(unique)
+            return metrics
+
+    def unregister(self, metrics: SubscriberMetrics):
+        """Forget metrics, which were returned by register()."""
+        with self._lock:
+            if self.subscribers.get(metrics.name) is metrics:
+                del self.subscribers[metrics.name]
+
+    def snapshot(self):
+        """Return the current values as a dict of plain types."""
+        return {
+            "topics": {
+                name: metrics.snapshot() for name, metrics in sorted(self.topics.items())
+            },
+            "subscribers": {
+                name: metrics.snapshot() for name, metrics in sorted(self.subscribers.items())
+            },
+        }
+
+    def render(self):
+        """Return the current values in the Prometheus text format."""
+        lines = []
+        topics = sorted(self.topics.items())
+        for field in ("published", "matched", "filtered"):
+            lines.append("# TYPE slither_topic_{}_total counter".format(field))
+            for name, metrics in topics:
+                lines.append('slither_topic_{}_total{{topic="{}"}} {}'.format(
+                    field, _escape(name), getattr(metrics, field)))
+        subscribers = [(name, metrics.snapshot(), metrics) for name, metrics in sorted(self.subscribers.items())]
+        for field, kind in SUBSCRIBER_FIELDS:
+            suffix = "_total" if kind == "counter" else ""
+            lines.append("# TYPE slither_subscriber_{}{} {}".format(field, suffix, kind))
+            for name, snapshot, _ in subscribers:
+                lines.append('slither_subscriber_{}{}{{subscriber="{}"}} {}'.format(
+                    field, suffix, _escape(name), snapshot[field]))
+        lines.append("# TYPE slither_handler_duration_seconds histogram")
+        for name, _, metrics in subscribers:
+            label = _escape(name)
+            duration = metrics.duration
+            for bound, seen in duration.cumulative():
+                lines.append('slither_handler_duration_seconds_bucket{{subscriber="{}",le="{}"}} {}'.format(
+                    label, "+Inf" if bound == float("inf") else repr(bound), seen))
+            lines.append('slither_handler_duration_seconds_count{{subscriber="{}"}} {}'.format(label, duration.count))
+            lines.append('slither_handler_duration_seconds_sum{{subscriber="{}"}} {}'.format(label, duration.sum))
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
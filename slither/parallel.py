@@ -0,0 +1,121 @@
+"""Run the command line tools over many files, or one huge file, in
+a pool of processes.
+
+Input is split into units of work which can be processed
+independently: byte ranges of files, split on line boundaries, or
+batches of lines from stdin. run_parallel hands them to a
+ProcessPoolExecutor and yields the results, in input order or as
+they finish:
+
+    >>> units = work_units("access.log*", chunk_size=CHUNK_SIZE)
+    >>> for lines in run_parallel(task, units, jobs=8):
+    ...     sink.writelines(lines)
+
+task must be importable since it's pickled to the workers.
+"""
+import sys
+from glob import glob
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from slither.sources import iter_lines, detect_compression
+
+# Files larger than this are split into several byte ranges
+# (on line boundaries) when running with --jobs.
+CHUNK_SIZE = 64 * 1024 * 1024
+# Number of lines from stdin handed to a worker at a time.
+LINES_PER_BATCH = 10000
+
+def chunk_file(path, chunk_size=CHUNK_SIZE):
+    """Split path into a list of (start, end) byte offsets of
+    roughly chunk_size bytes each. Every range ends on a line
+    boundary so no line is ever split between two ranges.
+
+    Compressed files cannot be split so they are returned as a
+    single (0, None) range.
+    """
+    if detect_compression(path) is not None:
+        return [(0, None)]
+    size = path.stat().st_size
+    chunks = []
+    with path.open("rb") as fin:
+        start = 0
+        while start < size:
+            end = start + chunk_size
+            if end >= size:
+                end = size
+            else:
+                fin.seek(end)
+                fin.readline()
+                end = fin.tell()
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+def iter_unit(unit):
+    """A unit of work is either a list of lines (read from stdin)
+    or a (filename, start, end) byte range.
+    """
+    if isinstance(unit, list):
+        return iter(unit)
+    return iter_lines(*unit)
+
+def work_units(src, chunk_size=CHUNK_SIZE):
+    """Yield the units of work for src which can be processed
+    independently of each other, in input order.
+    """
+    if src == "-":
+        batch = []
+        for line in sys.stdin:
+            batch.append(line)
+            if len(batch) >= LINES_PER_BATCH:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    else:
+        for path in glob(src):
+            path = Path(path)
+            if path.is_file():
+                for start, end in chunk_file(path, chunk_size):
+                    yield (str(path), start, end)
+            elif path.is_dir():
+                raise ValueError("Only filenames and glob patterns are allowed, not directories.")
+
+_WORKER_PIPELINES = {}
+
+def worker_pipeline(urls, build, *args):
+    """Build the callables for urls (with build(urls, *args)) once
+    per worker process. Plugins are free to return lambdas and
+    closures which cannot be pickled, so each worker builds its own
+    from the urls.
+    """
+    key = (urls, build, args)
+    if key not in _WORKER_PIPELINES:
+        _WORKER_PIPELINES[key] = build(urls, *args)
+    return _WORKER_PIPELINES[key]
+
+def _next_result(pending, ordered):
+    if ordered:
+        return pending.popleft().result()
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    future = done.pop()
+    pending.remove(future)
+    return future.result()
+
+def run_parallel(task, units, jobs, ordered=True):
+    """Run task over each of units in a pool of jobs processes and
+    yield the results. If ordered is True, results are yielded in
+    the order of units, otherwise as soon as they are ready.
+
+    At most 2 * jobs units are in flight at once so that reading
+    stdin or a huge glob never runs far ahead of the workers.
+    """
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for unit in units:
+            pending.append(executor.submit(task, unit))
+            if len(pending) >= 2 * jobs:
+                yield _next_result(pending, ordered)
+        while pending:
+            yield _next_result(pending, ordered)
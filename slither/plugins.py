@@ -0,0 +1,175 @@
+"""A lazy registry of setuptools entry point plugins.
+
+Scanning every installed distribution for entry points and loading
+all of them up front costs far more than most invocations of ginsu
+or slyce need. A PluginRegistry only imports the plugins which are
+actually looked up:
+
+    >>> plugins = get_registry("ginsu.plugin")
+    >>> "python" in plugins
+    True
+    >>> plugins["python"]
+    <function python_plugin at 0x...>
+
+The names and targets of all entry points are kept in an index on
+disk (under $SLITHER_CACHE_DIR, $XDG_CACHE_HOME/slither or
+~/.cache/slither) which is rebuilt whenever a directory on sys.path
+or the entry points of a distribution in one change, ie when a
+distribution is installed, removed or re-developed.
+"""
+import os
+import sys
+import json
+import hashlib
+import logging
+import tempfile
+import importlib
+
+log = logging.getLogger(__name__)
+
+
+def _cache_dir():
+    if "SLITHER_CACHE_DIR" in os.environ:
+        return os.environ["SLITHER_CACHE_DIR"]
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "slither")
+
+def _fingerprint():
+    """Return the modification times of the directories on sys.path
+    and of the entry_points.txt of the *.dist-info and *.egg-info
+    entries in them. Installing, upgrading or removing a distribution
+    adds or removes such an entry, while re-running setup.py develop
+    only rewrites the entry_points.txt in place.
+
+    The working directory's own time is left out, writing a file
+    there (ie with -o) says nothing about the installed plugins.
+    """
+    cwd = os.getcwd()
+    ret = []
+    for path in sys.path:
+        directory = path or "."
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+            if os.path.abspath(directory) != cwd:
+                ret.append([path, os.stat(directory).st_mtime_ns])
+        except OSError:
+            continue
+        for entry in entries:
+            if not entry.name.endswith((".dist-info", ".egg-info")):
+                continue
+            try:
+                mtime = os.stat(os.path.join(entry.path, "entry_points.txt")).st_mtime_ns
+            except OSError:
+                # no entry points, or an egg-info file
+                continue
+            ret.append([entry.path, mtime])
+    return ret
+
+def _scan():
+    """Return {group: {name: value}} for every installed entry point."""
+    # Only needed when the index is rebuilt
+    from importlib.metadata import distributions
+    index = {}
+    for dist in distributions():
+        for ep in dist.entry_points:
+            # The first distribution on sys.path wins, as with imports
+            index.setdefault(ep.group, {}).setdefault(ep.name, ep.value)
+    return index
+
+def load(value):
+    """Import the object an entry point value such as
+    "package.module:attr.attr [extra]" refers to.
+    """
+    module, _, attrs = value.split("[")[0].partition(":")
+    obj = importlib.import_module(module.strip())
+    for attr in filter(None, attrs.strip().split(".")):
+        obj = getattr(obj, attr)
+    return obj
+
+
+class PluginIndex(object):
+    """The on-disk index of entry points for the running interpreter."""
+    def __init__(self, cache_dir: str=None):
+        if cache_dir is None:
+            cache_dir = _cache_dir()
+        key = hashlib.sha1(sys.executable.encode()).hexdigest()[:16]
+        self.filename = os.path.join(cache_dir, "plugins-{}.json".format(key))
+        self._groups = None
+
+    def load(self):
+        fingerprint = _fingerprint()
+        try:
+            with open(self.filename, "r") as fin:
+                cached = json.load(fin)
+            if cached["fingerprint"] == fingerprint:
+                return cached["groups"]
+        except (OSError, ValueError, KeyError):
+            pass
+        groups = _scan()
+        self.save(fingerprint, groups)
+        return groups
+
+    def save(self, fingerprint, groups):
+        directory = os.path.dirname(self.filename)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, "w") as fout:
+                json.dump({"fingerprint": fingerprint, "groups": groups}, fout)
+            os.replace(tmp, self.filename)
+        except OSError as e:
+            log.debug("Could not write plugin index {}: {}".format(self.filename, e))
+
+    def group(self, group: str):
+        if self._groups is None:
+            self._groups = self.load()
+        return self._groups.get(group, {})
+
+
+class PluginRegistry(object):
+    """A mapping of plugin name to plugin for one entry point group.
+    Plugins are only imported the first time they are looked up.
+    """
+    def __init__(self, group: str, index: PluginIndex=None):
+        self.group = group
+        self.index = PluginIndex() if index is None else index
+        self._loaded = {}
+
+    @property
+    def targets(self):
+        return self.index.group(self.group)
+
+    def __contains__(self, name):
+        return name in self._loaded or name in self.targets
+
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            self._loaded[name] = load(self.targets[name])
+        return self._loaded[name]
+
+    def __iter__(self):
+        return iter(self.targets)
+
+    def __len__(self):
+        return len(self.targets)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+
+_INDEX = None
+_REGISTRIES = {}
+
+def get_registry(group: str):
+    """Return the PluginRegistry for group. All registries returned
+    share one PluginIndex so the index is read at most once.
+    """
+    global _INDEX
+    if group not in _REGISTRIES:
+        if _INDEX is None:
+            _INDEX = PluginIndex()
+        _REGISTRIES[group] = PluginRegistry(group, _INDEX)
+    return _REGISTRIES[group]
@@ -0,0 +1,221 @@
+"""Combinable reductions for ginsu reduce.
+
+A Reducer splits a reduction into separate steps so that partial
+results (accumulators) can be built independently for each file or
+chunk of a file, in any number of processes, and then merged into
+one global answer:
+
+    initial()                -> a new, empty accumulator
+    accumulate(acc, lines)   -> acc updated with an iterable of lines
+    merge(acc, other)        -> the combination of two accumulators
+    lines(acc)               -> the lines of output for acc
+
+merge must be associative and accumulators must be picklable.
+
+The built-in reducers are available through the reducer:// plugin
+scheme, ie:
+
+    $ ginsu reduce "*.log" -r reducer://count
+    $ ginsu reduce "access.log*" -r "reducer://top?field=0&k=10" -j 8
+    $ ginsu reduce "access.log*" -r "reducer://distinct?field=0"
+
+Each takes the optional query parameters field (the index of the
+field to use instead of the whole line) and sep (the field separator,
+defaults to whitespace).
+"""
+import math
+import hashlib
+from collections import Counter
+from functools import partial
+from urllib.parse import parse_qsl
+
+
+def _whole_line(line):
+    return line.strip()
+
+def _get_field(line, index, sep):
+    # with an explicit sep the newline would stay on the last field
+    return line.rstrip("\r\n").split(sep)[index]
+
+def _key_func(field=None, sep=None):
+    if field is None:
+        return _whole_line
+    return partial(_get_field, index=int(field), sep=sep)
+
+
+class Reducer(object):
+    """Base class for reducers. key is applied to each line to get
+    the value which is reduced.
+    """
+    def __init__(self, field: str=None, sep: str=None):
+        self.key = _key_func(field, sep)
+
+    def initial(self):
+        raise NotImplementedError
+
+    def accumulate(self, acc, lines):
+        raise NotImplementedError
+
+    def merge(self, acc, other):
+        raise NotImplementedError
+
+    def result(self, acc):
+        return acc
+
+    def lines(self, acc):
+        return [self.result(acc)]
+
+
+class Count(Reducer):
+    def initial(self):
+        return 0
+
+    def accumulate(self, acc, lines):
+        return acc + sum(1 for _ in lines)
+
+    def merge(self, acc, other):
+        return acc + other
+
+
+class Sum(Reducer):
+    def initial(self):
+        return 0.0
+
+    def accumulate(self, acc, lines):
+        return acc + sum(map(float, map(self.key, lines)))
+
+    def merge(self, acc, other):
+        return acc + other
+
+
+class Min(Reducer):
+    def initial(self):
+        return None
+
+    def accumulate(self, acc, lines):
+        values = map(float, map(self.key, lines))
+        if acc is not None:
+            return min(acc, min(values, default=acc))
+        return min(values, default=None)
+
+    def merge(self, acc, other):
+        if acc is None or other is None:
+            return other if acc is None else acc
+        return min(acc, other)
+
+
+class Max(Reducer):
+    def initial(self):
+        return None
+
+    def accumulate(self, acc, lines):
+        values = map(float, map(self.key, lines))
+        if acc is not None:
+            return max(acc, max(values, default=acc))
+        return max(values, default=None)
+
+    def merge(self, acc, other):
+        if acc is None or other is None:
+            return other if acc is None else acc
+        return max(acc, other)
+
+
+class GroupByCount(Reducer):
+    """Count the occurrences of each distinct value."""
+    def initial(self):
+        return Counter()
+
+    def accumulate(self, acc, lines):
+        acc.update(map(self.key, lines))
+        return acc
+
+    def merge(self, acc, other):
+        acc.update(other)
+        return acc
+
+    def lines(self, acc):
+        return ["{}\t{}".format(count, key) for key, count in acc.items()]
+
+
+class TopK(GroupByCount):
+    """The k most common values along with their counts."""
+    def __init__(self, k: str="10", **kwargs):
+        super().__init__(**kwargs)
+        self.k = int(k)
+
+    def lines(self, acc):
+        return ["{}\t{}".format(count, key) for key, count in acc.most_common(self.k)]
+
+
+class HyperLogLog(Reducer):
+    """Estimate the number of distinct values with HyperLogLog.
+
+    The accumulator is a bytearray of 2**p registers, so memory use
+    is fixed no matter how many values are seen. The standard error
+    is about 1.04 / sqrt(2**p), roughly 0.8% for the default p=14.
+    """
+    def __init__(self, p: str="14", **kwargs):
+        super().__init__(**kwargs)
+        self.p = int(p)
+        if not 4 <= self.p <= 18:
+            raise ValueError("p must be between 4 and 18")
+        self.m = 1 << self.p
+
+    def initial(self):
+        return bytearray(self.m)
+
+    def accumulate(self, acc, lines):
+        p, mask, width = self.p, self.m - 1, 64 - self.p
+        blake2b = hashlib.blake2b
+        for value in map(self.key, lines):
+            if not isinstance(value, bytes):
+                value = value.encode()
+            x = int.from_bytes(blake2b(value, digest_size=8).digest(), "little")
+            index = x & mask
+            rank = width - (x >> p).bit_length() + 1
+            if rank > acc[index]:
+                acc[index] = rank
+        return acc
+
+    def merge(self, acc, other):
+        return bytearray(map(max, acc, other))
+
+    def result(self, acc):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in acc)
+        zeros = acc.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+REDUCERS = {
+    "count": Count,
+    "sum": Sum,
+    "min": Min,
+    "max": Max,
+    "groupby": GroupByCount,
+    "top": TopK,
+    "distinct": HyperLogLog,
+}
+
+def is_combinable(reducer):
+    """Return True if reducer follows the Reducer protocol rather
+    than being a plain two argument function for functools.reduce.
+    """
+    return all(
+        hasattr(reducer, name)
+        for name in ("initial", "accumulate", "merge", "lines")
+    )
+
+def reducer_plugin(obj):
+    """ginsu plugin for reducer://name?param=value urls."""
+    name = obj.netloc
+    if name not in REDUCERS:
+        raise ValueError(
+            "Unknown reducer {}, choose from {}".format(name, ", ".join(sorted(REDUCERS)))
+        )
+    kwargs = dict(parse_qsl(obj.query, keep_blank_values=True))
+    return REDUCERS[name](**kwargs)
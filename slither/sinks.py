@@ -0,0 +1,396 @@
+"""Output sinks for the command line tools.
+
+A Sink writes lines straight to a binary stream (stdout or a file,
+optionally gzip compressed) through a large buffer of its own rather
+than going through the logging system once per line:
+
+    >>> with open_sink("out.txt.gz") as sink:
+    ...     sink.write("a line")
+    ...     sink.writelines(["more", b"lines"])
+
+CSVSink writes rows (sequences of values) as CSV, quoting values as
+needed, through the same buffer. ParquetSink, FeatherSink and
+JSONLinesSink collect rows into batches of typed columns and write
+one batch at a time, Parquet and Feather require pyarrow.
+
+LogSink offers the same interface on top of a logger for those who
+want to keep routing output through logging.config.
+"""
+import io
+import sys
+import csv
+import gzip
+import json
+import logging
+
+BUFFER_SIZE = 1024 * 1024
+# Rows per batch written by the columnar sinks
+BATCH_SIZE = 65536
+
+log = logging.getLogger(__name__)
+
+
+class Sink(object):
+    """Buffer lines and write them to stream in blocks of at least
+    buffer_size bytes. Lines can be str, bytes or any other object
+    in which case str() is called on it. Each line is terminated
+    with a newline.
+    """
+    def __init__(self, stream, buffer_size: int=BUFFER_SIZE, encoding: str="utf-8", close_stream: bool=True):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.encoding = encoding
+        self.close_stream = close_stream
+        self._buffer = []
+        self._size = 0
+
+    def write(self, line):
+        if not isinstance(line, bytes):
+            line = str(line).encode(self.encoding)
+        self._buffer.append(line)
+        self._buffer.append(b"\n")
+        self._size += len(line) + 1
+        if self._size >= self.buffer_size:
+            self._write_buffer()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def _write_buffer(self):
+        if self._buffer:
+            self.stream.write(b"".join(self._buffer))
+            self._buffer = []
+            self._size = 0
+
+    def flush(self):
+        self._write_buffer()
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+        if self.close_stream:
+            self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CSVSink(Sink):
+    """A Sink which writes each row (a sequence of values) as a line
+    of CSV, quoting values which contain commas, quotes or newlines.
+    """
+    def __init__(self, stream, **kwargs):
+        super().__init__(stream, **kwargs)
+        self._text = io.StringIO()
+        self._writer = csv.writer(self._text, lineterminator="\n")
+
+    def write(self, row):
+        self._writer.writerow(row)
+        if self._text.tell() >= self.buffer_size:
+            self._write_buffer()
+
+    def writelines(self, rows):
+        # row by row so at most about buffer_size bytes are held
+        # however long rows is
+        writerow, text = self._writer.writerow, self._text
+        for row in rows:
+            writerow(row)
+            if text.tell() >= self.buffer_size:
+                self._write_buffer()
+
+    def _write_buffer(self):
+        if self._text.tell():
+            self.stream.write(self._text.getvalue().encode(self.encoding))
+            self._text.seek(0)
+            self._text.truncate()
+
+
+def _column_type(values):
+    """Return int, float or str, the narrowest of them which every
+    non-empty value in values can be converted to.
+    """
+    kind = int
+    for value in values:
+        if value == "" or value is None:
+            continue
+        if kind is int:
+            try:
+                int(value)
+                continue
+            except ValueError:
+                kind = float
+        try:
+            float(value)
+        except ValueError:
+            return str
+    return kind
+
+def _convert(values, kind, keep=False):
+    """Convert values to kind, empty values become None. Returns
+    the converted values and a list of those which couldn't be
+    converted (and are None, or left as they are if keep is True).
+    """
+    ret, failed = [], []
+    for value in values:
+        if value == "" or value is None:
+            ret.append(None)
+            continue
+        try:
+            ret.append(kind(value))
+        except ValueError:
+            ret.append(value if keep else None)
+            failed.append(value)
+    return ret, failed
+
+
+class SchemaError(ValueError):
+    """A value doesn't fit the type of its column, which was fixed
+    when the first batch was written.
+    """
+
+
+class ColumnSink(object):
+    """Collect rows (sequences of values, one for each of fieldnames)
+    into batches of batch_size rows and write each batch as typed
+    columns.
+
+    The type of each column (int, float or str) is given in types
+    (a dict of fieldname to type) or inferred from the first batch,
+    and kept for the rest of the output. A later value which can't
+    be converted to it raises SchemaError rather than being lost,
+    unless keep_unconverted is True in which case it's written as it
+    is. Subclasses implement _write_batch and _finish.
+    """
+    keep_unconverted = False
+
+    def __init__(
+            self,
+            stream,
+            fieldnames,
+            batch_size: int=BATCH_SIZE,
+            buffer_size: int=BUFFER_SIZE,
+            close_stream: bool=True,
+            types: dict=None
+        ):
+        self.stream = stream
+        self.fieldnames = list(fieldnames)
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.close_stream = close_stream
+        self.given_types = dict(types or {})
+        self.types = None
+        self._rows = []
+
+    def write(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self._write_buffer()
+
+    def writelines(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def _write_buffer(self):
+        if not self._rows:
+            return
+        columns = [list(column) for column in zip(*self._rows)]
+        self._rows = []
+        if self.types is None:
+            self.types = [
+                self.given_types.get(name) or _column_type(column)
+                for name, column in zip(self.fieldnames, columns)
+            ]
+        converted = []
+        for name, column, kind in zip(self.fieldnames, columns, self.types):
+            column, failed = _convert(column, kind, self.keep_unconverted)
+            if failed and not self.keep_unconverted:
+                raise SchemaError(
+                    "{} values of {}, ie {!r}, are not {} as inferred from the first batch, "
+                    "give its type explicitly or use a larger batch size".format(
+                        len(failed), name, failed[0], kind.__name__
+                    )
+                )
+            converted.append(column)
+        self._write_batch(converted)
+
+    def _write_batch(self, columns):
+        raise NotImplementedError
+
+    def _finish(self):
+        pass
+
+    def flush(self):
+        self._write_buffer()
+        self.stream.flush()
+
+    def close(self):
+        try:
+            self._write_buffer()
+        finally:
+            # even when the last batch raised SchemaError, so the
+            # batches before it are a complete file
+            if self.types is None:
+                # nothing was written, the schema is all strings
+                self.types = [self.given_types.get(name, str) for name in self.fieldnames]
+            try:
+                self._finish()
+            finally:
+                self.stream.flush()
+                if self.close_stream:
+                    self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class JSONLinesSink(ColumnSink):
+    """Write each row as a JSON object on a line of its own. JSON
+    values don't need a fixed type so values which don't match
+    their column's type are kept as strings.
+    """
+    keep_unconverted = True
+
+    def __init__(self, stream, fieldnames, **kwargs):
+        super().__init__(stream, fieldnames, **kwargs)
+        self._lines = Sink(stream, buffer_size=self.buffer_size, close_stream=False)
+
+    def _write_batch(self, columns):
+        fieldnames = self.fieldnames
+        dumps = json.dumps
+        self._lines.writelines(
+            dumps(dict(zip(fieldnames, values))) for values in zip(*columns)
+        )
+
+    def _finish(self):
+        self._lines.flush()
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("pyarrow is required for parquet and feather output, pip install slither[arrow]")
+    return pyarrow
+
+
+class ArrowSink(ColumnSink):
+    """A ColumnSink which converts each batch into a pyarrow
+    RecordBatch and passes it to a writer opened with the schema
+    once the column types are known.
+    """
+    def __init__(self, stream, fieldnames, **kwargs):
+        super().__init__(stream, fieldnames, **kwargs)
+        self.pa = _pyarrow()
+        self.schema = None
+        self.writer = None
+
+    def _schema(self):
+        arrow_types = {int: self.pa.int64(), float: self.pa.float64(), str: self.pa.string()}
+        return self.pa.schema([
+            (name, arrow_types[kind]) for name, kind in zip(self.fieldnames, self.types)
+        ])
+
+    def _open(self):
+        if self.writer is None:
+            self.schema = self._schema()
+            self.writer = self._open_writer(self.schema)
+        return self.writer
+
+    def _write_batch(self, columns):
+        self._open().write_batch(self.pa.record_batch(columns, schema=self.schema))
+
+    def _finish(self):
+        self._open().close()
+
+    def _open_writer(self, schema):
+        raise NotImplementedError
+
+
+class ParquetSink(ArrowSink):
+    """Write rows to a Parquet file, one row group per batch."""
+    def _open_writer(self, schema):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(self.stream, schema)
+
+
+class FeatherSink(ArrowSink):
+    """Write rows to a Feather (Arrow IPC) file, one record batch
+    per batch.
+    """
+    def _open_writer(self, schema):
+        return self.pa.ipc.new_file(self.stream, schema)
+
+
+SINKS = {
+    "lines": Sink,
+    "csv": CSVSink,
+    "jsonl": JSONLinesSink,
+    "parquet": ParquetSink,
+    "feather": FeatherSink,
+}
+
+
+class LogSink(object):
+    """Provide the Sink interface but log each line at INFO to
+    the logger called name.
+    """
+    def __init__(self, name: str):
+        self.log = logging.getLogger(name)
+
+    def write(self, line):
+        self.log.info(line)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.log.info(line)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_sink(
+        output: str="-",
+        compress: bool=False,
+        logger: str=None,
+        buffer_size: int=BUFFER_SIZE,
+        fmt: str="lines",
+        **options
+    ):
+    """Return a sink for output which is either "-" for stdout or
+    a filename. If compress is True or output ends with ".gz" the
+    output is gzip compressed. fmt is the name of the sink in SINKS
+    to use and options are passed on to it, ie the fieldnames of a
+    ColumnSink. If logger is given, a LogSink for that logger is
+    returned instead.
+    """
+    if logger is not None:
+        return LogSink(logger)
+    sink_class = SINKS[fmt]
+    compress = compress or output.endswith(".gz")
+    if output == "-":
+        sys.stdout.flush()
+        stream = getattr(sys.stdout, "buffer", sys.stdout)
+        if compress:
+            # Closing the GzipFile writes the trailer but leaves
+            # stdout itself open.
+            return sink_class(gzip.GzipFile(fileobj=stream, mode="wb"), buffer_size=buffer_size, **options)
+        return sink_class(stream, buffer_size=buffer_size, close_stream=False, **options)
+    if compress:
+        return sink_class(gzip.open(output, "wb"), buffer_size=buffer_size, **options)
+    return sink_class(open(output, "wb"), buffer_size=buffer_size, **options)
@@ -1,72 +1,463 @@
 import re
-import csv
 import sys
 import click
 import logging
-import pkg_resources
-import multiprocessing
 from pathlib import Path
 from glob import glob
+from slither.plugins import get_registry
+from slither.sinks import open_sink, BATCH_SIZE, SchemaError
+from slither.sources import iter_lines
+from slither.matchers import required_literal
+from slither.parallel import (
+    CHUNK_SIZE,
+    LINES_PER_BATCH,
+    iter_unit,
+    work_units,
+    run_parallel,
+    worker_pipeline,
+)
 from lxml import etree
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+from functools import partial
+from itertools import chain, islice
 from collections import defaultdict
 
 logging.basicConfig(stream=sys.stdout, level=20, format="%(message)s")
 
+OUTPUT_FORMATS = ("csv", "jsonl", "parquet", "feather")
+COLUMN_TYPES = {"int": int, "float": float, "str": str}
+
+# Keys are built once per (parent, tag) and (element, attribute)
+# and shared by every line with the same shape.
+_KEY_CACHE = {}
+MAX_CACHED_KEYS = 100000
+
+def _element_keys(parent, tag):
+    """Return the interned (element key, text key) for tag
+    beneath the element with key parent.
+    """
+    try:
+        return _KEY_CACHE[parent, tag]
+    except KeyError:
+        if len(_KEY_CACHE) > MAX_CACHED_KEYS:
+            _KEY_CACHE.clear()
+        element = parent + "." + tag if parent else tag
+        keys = _KEY_CACHE[parent, tag] = (sys.intern(element), sys.intern(parent + "." + tag))
+        return keys
+
+def _attrib_key(element, name):
+    try:
+        return _KEY_CACHE[element, "@", name]
+    except KeyError:
+        key = _KEY_CACHE[element, "@", name] = sys.intern(element + "@" + name)
+        return key
+
+def _flatten(events, record_tag=None, needed=None, wanted=None):
+    """Turn a stream of ("start"|"end", element) events into lists
+    of (key, value) pairs, one list per record_tag element or, if
+    record_tag is None, one for the whole document.
+
+    A stack of the keys of the open elements is kept so each key is
+    built once from its parent's rather than by walking ancestors.
+    Finished records are cleared to keep memory use flat while
+    streaming large documents.
+
+    If needed (a set of element keys) is given, subtrees whose key
+    is not in it are skipped and if wanted (a set of keys) is given
+    only those keys are kept, see _projection.
+    """
+    stack = [("", "")]
+    pairs = [] if record_tag is None else None
+    record_depth = None
+    skipping = 0
+    skip_subtree = getattr(events, "skip_subtree", None)
+    for event, node in events:
+        tag = node.tag
+        if not isinstance(tag, str):
+            # comments and processing instructions
+            continue
+        if event == "start":
+            if skipping:
+                skipping += 1
+                continue
+            element_key, text_key = _element_keys(stack[-1][0], tag)
+            if needed is not None and element_key not in needed:
+                skipping = 1
+                if skip_subtree is not None:
+                    skip_subtree()
+                continue
+            stack.append((element_key, text_key))
+            if pairs is None and tag == record_tag:
+                pairs, record_depth = [], len(stack)
+            if pairs is not None:
+                for k, v in node.attrib.items():
+                    key = _attrib_key(element_key, k)
+                    if wanted is None or key in wanted:
+                        pairs.append((key, v))
+        else:
+            if skipping:
+                skipping -= 1
+                continue
+            element_key, text_key = stack.pop()
+            if pairs is None:
+                continue
+            if node.text and (wanted is None or text_key in wanted):
+                pairs.append((text_key, node.text))
+            if record_depth == len(stack) + 1:
+                yield pairs
+                pairs, record_depth = None, None
+                node.clear()
+                while node.getprevious() is not None:
+                    del node.getparent()[0]
+    if record_tag is None:
+        yield pairs
+
+def _projection(fieldnames):
+    """Return (needed, wanted, leaves) for fieldnames where wanted
+    is the set of fieldnames, needed is the set of element keys
+    which may contain one of them and leaves are the final tag or
+    attribute names, at least one of which must appear in the raw
+    text of any document which contains a wanted key.
+    """
+    wanted = set(fieldnames)
+    needed = set()
+    leaves = set()
+    for fieldname in wanted:
+        element = fieldname.rsplit("@", 1)[0] if "@" in fieldname else fieldname.lstrip(".")
+        needed.update(element[:i] for i, c in enumerate(element) if c == ".")
+        needed.add(element)
+        leaves.add(re.split(r"[.@}]", fieldname)[-1])
+    return needed, wanted, leaves
+
 def xml(line):
     line = etree.fromstring(line)
-    out_dict = {}
-    for node in line.xpath("//*"):
-        if node.text:
-            key = ".".join(reversed([n.tag for n in node.iterancestors()])) + "." + node.tag
-            # print(key)
-            yield (key, node.text)
-        for k, v in node.attrib.items():
-            key = ".".join(reversed([n.tag for n in node.iterancestors()]))
-            key = key + "." + node.tag + "@" + k if key else node.tag + "@" + k
-            # print(key)
-            yield (key, v)
+    for pairs in _flatten(etree.iterwalk(line, events=("start", "end"))):
+        for pair in pairs:
+            yield pair
+
+def _project_xml(fieldnames):
+    """Return a version of xml which only produces fieldnames and
+    doesn't descend into elements which can't contain them. Lines
+    which don't mention any of the fieldnames aren't parsed at all.
+    """
+    needed, wanted, leaves = _projection(fieldnames)
+    def inner(line):
+        if not any(leaf in line for leaf in leaves):
+            return
+        walker = etree.iterwalk(etree.fromstring(line), events=("start", "end"))
+        for pairs in _flatten(walker, needed=needed, wanted=wanted):
+            for pair in pairs:
+                yield pair
+    return inner
+
+xml.project = _project_xml
+
+def xml_records(source, record_tag, fieldnames=None):
+    """Stream-parse the XML document in source (a filename or a
+    binary file) and yield the flattened (key, value) pairs of each
+    record_tag element, without loading the whole document. If
+    fieldnames are given only those keys are produced.
+    """
+    events = etree.iterparse(source, events=("start", "end"), huge_tree=True)
+    if not fieldnames:
+        return _flatten(events, record_tag)
+    needed, wanted, _ = _projection(fieldnames)
+    return _flatten(events, record_tag, needed=needed, wanted=wanted)
+
+# The dotted keys for each (prefix, object keys) shape seen so far,
+# in the order of the object's keys.
+_JSON_PLANS = {}
+
+def _json_plan(prefix, obj):
+    """Return the dotted keys of the dict obj found beneath prefix.
+    Records with the same layout share one plan, so the keys are
+    only built the first time a layout is seen.
+    """
+    shape = (prefix, tuple(obj))
+    try:
+        return _JSON_PLANS[shape]
+    except KeyError:
+        if len(_JSON_PLANS) > MAX_CACHED_KEYS:
+            _JSON_PLANS.clear()
+        plan = _JSON_PLANS[shape] = tuple(
+            sys.intern(prefix + "." + k if prefix else k) for k in shape[1]
+        )
+        return plan
+
+def _json_pairs(key, value, pairs, needed=None, wanted=None):
+    """Append the (dotted key, value) pairs for value, found at key,
+    to pairs. Objects are flattened into dotted keys, the items of
+    arrays share their array's key and nulls are left out. needed
+    and wanted work as in _flatten.
+    """
+    kind = type(value)
+    if kind is dict:
+        for k, v in zip(_json_plan(key, value), value.values()):
+            if needed is None or k in needed:
+                _json_pairs(k, v, pairs, needed, wanted)
+    elif kind is list:
+        for item in value:
+            _json_pairs(key, item, pairs, needed, wanted)
+    elif value is None or (wanted is not None and key not in wanted):
+        return
+    elif kind is str:
+        pairs.append((key, value))
+    elif kind is bool:
+        pairs.append((key, "true" if value else "false"))
+    else:
+        pairs.append((key, str(value)))
+
+def json(line):
+    """Flatten the JSON document in line into (key, value) pairs with
+    the same dotted keys as xml, ie {"req": {"id": 7}} gives
+    ("req.id", "7"). Uses orjson to parse when it is installed.
+    """
+    pairs = []
+    _json_pairs("", _json_loads(line), pairs)
+    return pairs
+
+def _project_json(fieldnames):
+    """Return a version of json which only produces fieldnames and
+    doesn't descend into objects which can't contain them. Lines
+    which don't mention the last part of any of the fieldnames
+    aren't parsed at all.
+    """
+    wanted = set(fieldnames)
+    needed = set(wanted)
+    for fieldname in wanted:
+        needed.update(fieldname[:i] for i, c in enumerate(fieldname) if c == ".")
+    leaves = set(fieldname.rsplit(".", 1)[-1] for fieldname in wanted)
+    def inner(line):
+        if not any(leaf in line for leaf in leaves):
+            return []
+        pairs = []
+        _json_pairs("", _json_loads(line), pairs, needed, wanted)
+        return pairs
+    return inner
+
+json.project = _project_json
 
 def regex(regexp):
     def inner(line):
         return regexp.findall(line)
+    inner.project = partial(_project_regex, regexp)
     return inner
 
-def handle_file(path, pipeline, fieldnames):
-    log = logging.getLogger(__name__)
-    if path is sys.stdin:
-        for line in path:
-            for step in pipeline["preprocess"]:
-                line = step(line)
-            out_dict = {}
-            for step in pipeline["pipeline"]:
-                out_dict.update(
-                    dict(list(step(line)))
-                )
-            if any(fieldname in out_dict for fieldname in fieldnames):
-                print(",".join(out_dict.get(fieldname) for fieldname in fieldnames))
-    else:
-        with path.open("r") as fin:
-            for line in fin:
-                for step in pipeline["preprocess"]:
-                    line = step(line)
-                out_dict = defaultdict(list)
-                for step in pipeline["pipeline"]:
-                    for k, v in step(line):
-                        out_dict[k].append(v)
-                if any(fieldname in out_dict for fieldname in fieldnames):
-                    print(",".join(" ".join(out_dict.get(fieldname)) for fieldname in fieldnames))
+def _project_regex(regexp, fieldnames):
+    """Return a version of regex(regexp) which only produces pairs
+    for fieldnames. The key of each pair is captured from the line
+    so lines which don't contain any fieldname are skipped without
+    running the regex.
+    """
+    wanted = set(fieldnames)
+    def inner(line):
+        if not any(fieldname in line for fieldname in wanted):
+            return []
+        return [pair for pair in regexp.findall(line) if pair[0] in wanted]
+    return inner
+
+class RegexExtractor(object):
+    """Extract the named groups of the first match of pattern in a
+    line as (group name, value) pairs, groups which didn't take part
+    in the match are left out:
+
+        >>> extract = RegexExtractor(r"(?P<status>\\d{3}) (?P<size>\\d+)$")
+        >>> extract('"GET / HTTP/1.1" 200 512')
+        [('status', '200'), ('size', '512')]
+
+    Lines which don't contain the literal text every match requires
+    are skipped without running the regex. batch extracts from a
+    whole block of lines at once.
+    """
+    def __init__(self, pattern, names=None):
+        self.pattern = pattern
+        self.regex = re.compile(pattern)
+        if not self.regex.groupindex:
+            raise ValueError("{} has no named groups".format(pattern))
+        groups = sorted((index, name) for name, index in self.regex.groupindex.items())
+        self.groups = [
+            (index - 1, name) for index, name in groups
+            if names is None or name in names
+        ]
+        self.literal = required_literal(pattern)
+
+    def __call__(self, line):
+        return self.batch([line])[0]
+
+    def batch(self, lines):
+        """Return a list of the (group name, value) pairs found in
+        each of lines.
+        """
+        search = self.regex.search
+        literal = self.literal
+        groups = self.groups
+        ret = []
+        for line in lines:
+            match = None
+            if literal is None or literal in line:
+                match = search(line)
+            if match is None:
+                ret.append(())
+                continue
+            values = match.groups()
+            ret.append([(name, values[i]) for i, name in groups if values[i] is not None])
+        return ret
+
+    def project(self, fieldnames):
+        return RegexExtractor(self.pattern, set(fieldnames))
+
+def regex_plugin(spec):
+    """slyce plugin for regex://pattern where pattern has named
+    groups, see RegexExtractor.
+    """
+    return RegexExtractor(spec)
+
+def project(step, fieldnames):
+    """Push fieldnames down into step if it supports it (by having
+    a project attribute), otherwise return step unchanged.
+    """
+    if fieldnames and hasattr(step, "project"):
+        return step.project(fieldnames)
+    return step
+
+def _first_matches(pairs, fieldnames):
+    """Yield the first of pairs for each of fieldnames, stopping as
+    soon as all of them have been found.
+    """
+    remaining = set(fieldnames)
+    for k, v in pairs:
+        if k in remaining:
+            remaining.discard(k)
+            yield k, v
+            if not remaining:
+                return
+
+def _pairs(line, steps, fieldnames, first_match=False):
+    """Return the (key, value) pairs which steps extract from line.
+
+    If first_match is True, only the first value of each of the
+    fieldnames is produced and extraction stops as soon as all of
+    them have been found.
+    """
+    pairs = chain.from_iterable(step(line) for step in steps)
+    if first_match:
+        return _first_matches(pairs, fieldnames)
+    return pairs
+
+def _row(pairs, fieldnames):
+    """Return the row for fieldnames from (key, value) pairs or None
+    if none of fieldnames were found. Repeated keys are joined with
+    a space and missing keys are left empty.
+    """
+    out_dict = defaultdict(list)
+    for k, v in pairs:
+        out_dict[k].append(v)
+    if any(fieldname in out_dict for fieldname in fieldnames):
+        return [" ".join(out_dict.get(fieldname, ())) for fieldname in fieldnames]
+    return None
+
+def _block_rows(block, pipeline, fieldnames, first_match=False):
+    """Like _rows for a list of lines, but extraction steps with a
+    batch method are given the whole block at once.
+    """
+    for step in pipeline["preprocess"]:
+        block = [step(line) for line in block]
+    extracted = []
+    for step in pipeline["pipeline"]:
+        if hasattr(step, "batch"):
+            extracted.append(step.batch(block))
+        else:
+            extracted.append([step(line) for line in block])
+    for found in zip(*extracted):
+        pairs = chain.from_iterable(found)
+        if first_match:
+            pairs = _first_matches(pairs, fieldnames)
+        row = _row(pairs, fieldnames)
+        if row is not None:
+            yield row
+
+def _blocks(lines, size=LINES_PER_BATCH):
+    lines = iter(lines)
+    while True:
+        block = list(islice(lines, size))
+        if not block:
+            return
+        yield block
+
+def _rows(lines, pipeline, fieldnames, first_match=False):
+    if any(hasattr(step, "batch") for step in pipeline["pipeline"]):
+        for block in _blocks(lines):
+            for row in _block_rows(block, pipeline, fieldnames, first_match):
+                yield row
+        return
+    for line in lines:
+        for step in pipeline["preprocess"]:
+            line = step(line)
+        row = _row(_pairs(line, pipeline["pipeline"], fieldnames, first_match), fieldnames)
+        if row is not None:
+            yield row
+
+def handle_file(path, pipeline, fieldnames, sink, first_match=False):
+    lines = path if path is sys.stdin else iter_lines(path)
+    sink.writelines(_rows(lines, pipeline, fieldnames, first_match))
+
+def handle_xml_records(path, record_tag, fieldnames, sink):
+    """Treat path as a single (possibly multi-line) XML document
+    with one row per record_tag element.
+    """
+    source = sys.stdin.buffer if path is sys.stdin else str(path)
+    rows = (_row(pairs, fieldnames) for pairs in xml_records(source, record_tag, fieldnames))
+    sink.writelines(row for row in rows if row is not None)
+
+def _resolve(name):
+    """Turn name into a function. name is either module:func or
+    scheme://spec, in which case the slyce.plugin registered for
+    scheme is called with spec (the text after ://) and returns it.
+    """
+    scheme, sep, spec = name.partition("://")
+    if not sep:
+        return _import(*name.split(":"))
+    plugins = _get_plugins()
+    if scheme not in plugins:
+        raise ValueError("Cannot find plugin {}".format(scheme))
+    return plugins[scheme](spec)
+
+def _build_pipeline(names, fieldnames):
+    """Resolve the preprocess and extraction functions named in
+    names, pushing fieldnames down into the latter.
+    """
+    preprocesses, extractions = names
+    return {
+        "preprocess": [_resolve(name) for name in preprocesses],
+        "pipeline": [project(_resolve(name), fieldnames) for name in extractions],
+    }
+
+def _slyce_task(names, fieldnames, first_match, unit):
+    pipeline = worker_pipeline(names, _build_pipeline, fieldnames)
+    return list(_rows(iter_unit(unit), pipeline, fieldnames, first_match))
+
+def _xml_records_task(record_tag, fieldnames, path):
+    rows = (_row(pairs, fieldnames) for pairs in xml_records(path, record_tag, fieldnames))
+    return [row for row in rows if row is not None]
+
+def _xml_units(src):
+    for path in glob(src):
+        if Path(path).is_dir():
+            raise ValueError("Only filenames and glob patterns are allowed, not directories.")
+        yield path
 
 def _get_plugins(group: str="slyce.plugin"):
     """Retrieve the items registered with setuptools
     entry_points for the given group (defaults to
-    slither.plugin group).
+    slyce.plugin group). Plugins are only imported when
+    they are first looked up, see slither.plugins.
 
     TODO: Whitelist/blacklist for plugins
     """
-    plugins = {}
-    for ep in pkg_resources.iter_entry_points(group=group):
-        plugins.update({ep.name: ep.load()})
-    return plugins
+    return get_registry(group)
 
 def _import(module, func):
     """Perform the equivalent of from $module import $func
@@ -81,26 +472,69 @@ def _import(module, func):
 @click.option("--preprocesses", "-p", multiple=True)
 @click.option("--extractions", "-x", multiple=True)
 @click.option("--fieldnames", "-f", multiple=True)
-def main(src, preprocesses, extractions, fieldnames):
-    plugins = _get_plugins()
-    pipeline = {
-        "preprocess": [],
-        "pipeline": [],
-    }
-    for preprocess in preprocesses:
-        func = _import(*preprocess.split(":"))
-        pipeline["preprocess"].append(func)
-    for extraction in extractions:
-        pipeline["pipeline"].append(
-            _import(*extraction.split(":"))
-        )
-    print(",".join(fieldnames))
-    if src == "-":
-        handle_file(sys.stdin, pipeline, fieldnames)
-    else:
-        for path in glob(src):
-            path = Path(path)
-            if path.is_file():
-                handle_file(path, pipeline, fieldnames)
-            elif path.is_dir():
-                raise ValueError("Only filenames and glob patterns are allowed, not directories.")
+@click.option("--xml-records", default=None, metavar="TAG",
+              help="Parse each file as one XML document with a row per TAG element.")
+@click.option("--first-match", is_flag=True,
+              help="Keep only the first value of each field and stop extracting once all are found.")
+@click.option("--jobs", "-j", default=1, type=int, help="Number of worker processes.")
+@click.option("--chunk-size", default=CHUNK_SIZE, type=int, help="Bytes per unit of work with --jobs.")
+@click.option("--ordered/--unordered", default=True, help="Keep the input order of rows with --jobs.")
+@click.option("--output", "-o", default="-", help="File to write output to, '-' is stdout.")
+@click.option("--format", "fmt", default="csv", type=click.Choice(OUTPUT_FORMATS),
+              help="Output format, parquet and feather require pyarrow.")
+@click.option("--batch-size", default=BATCH_SIZE, type=int,
+              help="Rows per batch written with the parquet, feather and jsonl formats.")
+@click.option("--column-type", "column_types", multiple=True, metavar="FIELD=TYPE",
+              help="Type (int, float or str) of a field with the parquet, feather and jsonl "
+                   "formats instead of inferring it from the first batch.")
+def main(src, preprocesses, extractions, fieldnames, xml_records, first_match, jobs, chunk_size, ordered, output, fmt, batch_size, column_types):
+    names = (tuple(preprocesses), tuple(extractions))
+    options = {}
+    if fmt != "csv":
+        options = {"fieldnames": fieldnames, "batch_size": batch_size, "types": _column_types(column_types)}
+    try:
+        _main(src, names, fieldnames, xml_records, first_match, jobs, chunk_size, ordered, output, fmt, options)
+    except SchemaError as e:
+        raise click.ClickException(str(e))
+
+def _column_types(specs):
+    types = {}
+    for spec in specs:
+        name, _, kind = spec.rpartition("=")
+        if kind not in COLUMN_TYPES or not name:
+            raise click.BadParameter(
+                "{!r} should be FIELD=TYPE where TYPE is one of {}".format(spec, ", ".join(COLUMN_TYPES)),
+                param_hint="--column-type",
+            )
+        types[name] = COLUMN_TYPES[kind]
+    return types
+
+def _main(src, names, fieldnames, xml_records, first_match, jobs, chunk_size, ordered, output, fmt, options):
+    with open_sink(output, fmt=fmt, **options) as sink:
+        if fmt == "csv":
+            sink.write(fieldnames)
+        if jobs > 1 and not (xml_records is not None and src == "-"):
+            if xml_records is not None:
+                # A document can't be split so each file is a unit
+                task = partial(_xml_records_task, xml_records, fieldnames)
+                units = _xml_units(src)
+            else:
+                task = partial(_slyce_task, names, fieldnames, first_match)
+                units = work_units(src, chunk_size)
+            for rows in run_parallel(task, units, jobs, ordered):
+                sink.writelines(rows)
+            return
+        if xml_records is not None:
+            handle = partial(handle_xml_records, record_tag=xml_records, fieldnames=fieldnames, sink=sink)
+        else:
+            pipeline = _build_pipeline(names, fieldnames)
+            handle = partial(handle_file, pipeline=pipeline, fieldnames=fieldnames, sink=sink, first_match=first_match)
+        if src == "-":
+            handle(sys.stdin)
+        else:
+            for path in glob(src):
+                path = Path(path)
+                if path.is_file():
+                    handle(path)
+                elif path.is_dir():
+                    raise ValueError("Only filenames and glob patterns are allowed, not directories.")
@@ -0,0 +1,94 @@
+"""Input sources for the command line tools.
+
+iter_lines yields the lines of a file regardless of how it is
+stored. Compression (gzip, bzip2 and xz) is detected by the magic
+bytes at the start of the file, not the extension, and decompressed
+as a stream through large read buffers. Uncompressed files are read
+through the same large buffer, seeking to a byte range if one is
+given:
+
+    >>> for line in iter_lines("/var/log/messages.1.gz"):
+    ...     print(line)
+"""
+import io
+import os
+import bz2
+import sys
+import gzip
+import lzma
+
+READ_BUFFER = 1024 * 1024
+
+MAGIC = (
+    (b"\x1f\x8b", gzip.open),
+    (b"BZh", bz2.open),
+    (b"\xfd7zXZ\x00", lzma.open),
+)
+
+
+def detect_compression(path):
+    """Return the function which opens path for decompression
+    or None if path is not compressed.
+    """
+    with open(path, "rb") as fin:
+        head = fin.read(6)
+    for magic, opener in MAGIC:
+        if head.startswith(magic):
+            return opener
+    return None
+
+def iter_lines(path, start: int=0, end: int=None, binary: bool=False, encoding: str="utf-8"):
+    """Yield the lines in path. If binary is False lines are decoded
+    with encoding.
+
+    For uncompressed files start and end may be given to only yield
+    the lines which begin between those byte offsets. Compressed
+    files are always read from start to finish.
+    """
+    if path == "-" or path is sys.stdin:
+        yield from (sys.stdin.buffer if binary else sys.stdin)
+        return
+    path = os.fspath(path)
+    opener = detect_compression(path)
+    if opener is not None:
+        yield from _iter_compressed(path, opener, binary, encoding)
+        return
+    with open(path, "rb", buffering=READ_BUFFER) as fin:
+        # pipes and special files can be read but not seeked
+        if start:
+            fin.seek(start)
+        if end is None:
+            if not binary:
+                # like open() in text mode, "\r\n" becomes "\n"
+                fin = io.TextIOWrapper(fin, encoding=encoding)
+            yield from fin
+        else:
+            for batch in _iter_range(fin, start, end):
+                if binary:
+                    yield from batch
+                else:
+                    yield from io.TextIOWrapper(io.BytesIO(b"".join(batch)), encoding=encoding)
+
+def _iter_compressed(path, opener, binary, encoding):
+    with open(path, "rb", buffering=READ_BUFFER) as raw:
+        stream = io.BufferedReader(opener(raw, "rb"), READ_BUFFER)
+        if not binary:
+            stream = io.TextIOWrapper(stream, encoding=encoding)
+        with stream:
+            yield from stream
+
+def _iter_range(fin, start, end):
+    """Yield lists of the lines (as bytes) in the binary file fin,
+    positioned at start, which begin before the byte offset end.
+    """
+    pos = start
+    while pos < end:
+        # readlines stops after the first line taking it past the
+        # hint, so every line it returns begins before end. A hint of
+        # 0 means no limit, so with one byte to go read one line.
+        hint = min(end - pos - 1, READ_BUFFER)
+        batch = fin.readlines(hint) if hint else [fin.readline()]
+        if not batch or not batch[0]:
+            return
+        pos += sum(map(len, batch))
+        yield batch
@@ -0,0 +1,43 @@
+import io
+import os
+import json
+import tempfile
+import unittest
+from slither import bench
+
+
+class TestGenerate(unittest.TestCase):
+    def test_deterministic_and_sized(self):
+        for fmt in bench.FORMATS:
+            first, second = io.BytesIO(), io.BytesIO()
+            lines = bench.generate(fmt, 10000, first, seed=1)
+            bench.generate(fmt, 10000, second, seed=1)
+            self.assertEqual(first.getvalue(), second.getvalue())
+            self.assertGreaterEqual(len(first.getvalue()), 10000)
+            self.assertEqual(first.getvalue().count(b"\n"), lines)
+
+    def test_json_lines_are_valid(self):
+        out = io.BytesIO()
+        bench.generate("json", 2000, out)
+        for line in out.getvalue().splitlines():
+            self.assertIn("level", json.loads(line))
+
+    def test_parse_size(self):
+        self.assertEqual(bench.parse_size("512"), 512)
+        self.assertEqual(bench.parse_size("64KB"), 64 * 1024)
+        self.assertEqual(bench.parse_size("1.5mb"), 1536 * 1024)
+
+
+class TestRunScenario(unittest.TestCase):
+    def test_run_scenario(self):
+        fd, src = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, "wb") as fout:
+                lines = bench.generate("syslog", 20000, fout)
+            name, fmt, args = bench.SCENARIOS[0]
+            result = bench.run_scenario(name, fmt, args, src)
+            self.assertEqual(result["lines"], lines)
+            self.assertGreater(result["lines_per_sec"], 0)
+            self.assertGreater(result["peak_rss_kb"], 0)
+        finally:
+            os.remove(src)
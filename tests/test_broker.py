@@ -0,0 +1,481 @@
+import os
+import unittest
+import threading
+import asyncio
+import json
+import shutil
+import logging
+import tempfile
+from unittest import mock
+from slither.broker import Broker, AsyncBroker, Topic, SharedRing, _SpillFile, pubsub_app
+
+
+class Collector(object):
+    """A handler which records the messages it receives."""
+    def __init__(self):
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def __call__(self, message):
+        with self.lock:
+            self.messages.append(message)
+
+
+def measure(message):
+    """Runs in subscriber processes so it must be importable."""
+    if message == "fail":
+        raise ValueError(message)
+    if message == "die":
+        os._exit(1)
+    return "{}:{}".format(message[:1], len(message))
+
+
+def failing(message):
+    raise ValueError(message)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestTopic(unittest.TestCase):
+    def test_split_name(self):
+        self.assertEqual(Topic("a.b.c").split_name(), ["a.b.c", "a.b", "a"])
+        self.assertEqual(Topic("a").split_name(), ["a"])
+
+
+class TestRouting(unittest.TestCase):
+    def setUp(self):
+        self.broker = Broker()
+
+    def tearDown(self):
+        self.broker.executor.shutdown()
+
+    def test_parent_topics(self):
+        child, parent, other = Collector(), Collector(), Collector()
+        self.broker.sub("app.web", child)
+        self.broker.sub("app", parent)
+        self.broker.sub("other", other)
+        self.broker.pub("app.web", "hello")
+        self.broker.pub(Topic("app"), "world")
+        self.broker.executor.shutdown()
+        self.assertEqual(child.messages, ["hello"])
+        self.assertEqual(sorted(parent.messages), ["hello", "world"])
+        self.assertEqual(other.messages, [])
+
+    def test_sub_invalidates_routes(self):
+        first, second = Collector(), Collector()
+        self.broker.sub("app", first)
+        self.broker.pub("app.web", "one")
+        self.broker.sub("app.web", second)
+        self.broker.pub("app.web", "two")
+        self.broker.executor.shutdown()
+        self.assertEqual(sorted(first.messages), ["one", "two"])
+        self.assertEqual(second.messages, ["two"])
+
+    def test_triggers_and_filters(self):
+        collector = Collector()
+        self.broker.sub("app", collector, triggers=["ERROR"], filters=["ignore"])
+        for message in ("ERROR boom", "INFO fine", "ERROR ignore me"):
+            self.broker.pub("app", message)
+        self.broker.executor.shutdown()
+        self.assertEqual(collector.messages, ["ERROR boom"])
+
+
+class TestBatching(unittest.TestCase):
+    def setUp(self):
+        # one worker runs tasks in the order they are submitted
+        self.broker = Broker(max_workers=1)
+
+    def test_pub_many(self):
+        collector = Collector()
+        self.broker.sub("app", collector, triggers=["ERROR"])
+        self.broker.pub_many("app.web", ["ERROR {}".format(i) if i % 2 else str(i) for i in range(10)])
+        self.broker.shutdown()
+        self.assertEqual(collector.messages, ["ERROR {}".format(i) for i in range(1, 10, 2)])
+
+    def test_pub_many_failure(self):
+        collector = Collector()
+
+        def handler(message):
+            if message == "bad":
+                raise ValueError(message)
+            collector(message)
+
+        subscription = self.broker.sub("app", handler)
+        with self.assertLogs("slither.metrics", "ERROR"):
+            self.broker.pub_many("app.web", ["a", "bad", "c", "d"])
+            self.broker.shutdown()
+        self.assertEqual(collector.messages, ["a", "c", "d"])
+        snapshot = subscription.stats.snapshot()
+        self.assertEqual((snapshot["completed"], snapshot["failed"], snapshot["in_flight"]), (3, 1, 0))
+
+    def test_unsub_batched(self):
+        collector = Collector()
+        subscription = self.broker.sub("app", collector, batch_size=4, max_delay=60)
+        self.broker.pub_many("app", ["1", "2"])
+        self.broker.unsub(subscription)
+        self.assertNotIn(subscription, self.broker._batched)
+        self.broker.pub("app", "3")
+        self.broker.shutdown()
+        # the pending batch was handed over by unsub
+        self.assertEqual(collector.messages, [["1", "2"]])
+
+    def test_batch_size(self):
+        collector = Collector()
+        self.broker.sub("app", collector, batch_size=4, max_delay=60)
+        self.broker.pub_many("app", range(10))
+        self.broker.pub("app", 10)
+        # two full batches were handed over straight away, the rest
+        # are only handed over by shutdown()
+        self.broker.executor.submit(lambda: None).result()
+        self.assertEqual(sorted(map(len, collector.messages)), [4, 4])
+        self.broker.shutdown()
+        self.assertEqual(sorted(map(len, collector.messages)), [3, 4, 4])
+        self.assertEqual(sorted(int(m) for batch in collector.messages for m in batch), list(range(11)))
+
+    def test_max_delay(self):
+        received = threading.Event()
+        self.broker.sub("app", lambda batch: received.set(), batch_size=1000, max_delay=0.05)
+        self.broker.pub("app", "one")
+        self.assertTrue(received.wait(5))
+        self.broker.shutdown()
+
+
+class TestAsyncBroker(unittest.TestCase):
+    def test_pub_sub(self):
+        received = []
+        in_flight = []
+
+        async def handler(message):
+            in_flight.append(message)
+            # every delivery is in flight at once, up to the limit
+            self.assertLessEqual(len(in_flight), 3)
+            await asyncio.sleep(0.01)
+            in_flight.remove(message)
+            received.append(message)
+
+        def sync_handler(message):
+            received.append("sync " + message)
+
+        async def main():
+            broker = AsyncBroker()
+            broker.sub("app", handler, filters=["skip"], concurrency=3)
+            broker.sub("app.web", sync_handler, triggers=["^1"])
+            broker.pub_many("app.web", ["{}".format(i) for i in range(20)] + ["skip"])
+            await broker.join()
+
+        asyncio.run(main())
+        self.assertEqual(sorted(m for m in received if not m.startswith("sync")), sorted(str(i) for i in range(20)))
+        self.assertEqual(sorted(m for m in received if m.startswith("sync")), ["sync 1"] + ["sync 1{}".format(i) for i in range(10)])
+
+
+class TestQueues(unittest.TestCase):
+    def test_unsub(self):
+        broker = Broker()
+        received = Collector()
+        subscription = broker.sub("app", received, queue_size=5)
+        broker.pub_many("app", ["1", "2"])
+        broker.unsub(subscription)
+        self.assertFalse(any(worker.is_alive() for worker in subscription.workers))
+        self.assertEqual(received.messages, ["1", "2"])
+        broker.shutdown()
+
+    def publish(self, overflow, count=20, **kwargs):
+        """Publish count messages while the handler is stuck on the
+        first one and return what it received once released.
+        """
+        broker = Broker()
+        started, release = threading.Event(), threading.Event()
+        received = []
+
+        def handler(message):
+            started.set()
+            release.wait(5)
+            received.append(message)
+
+        subscription = broker.sub("app", handler, queue_size=5, overflow=overflow, **kwargs)
+        broker.pub("app", "0")
+        started.wait(5)
+        broker.pub_many("app", [str(i) for i in range(1, count)])
+        release.set()
+        broker.shutdown()
+        return received, subscription
+
+    def test_drop_newest(self):
+        received, subscription = self.publish("drop_newest")
+        self.assertEqual(received, [str(i) for i in range(6)])
+        self.assertEqual(subscription.dropped, 14)
+
+    def test_drop_oldest(self):
+        received, subscription = self.publish("drop_oldest")
+        self.assertEqual(received, ["0"] + [str(i) for i in range(15, 20)])
+        self.assertEqual(subscription.dropped, 14)
+
+    def test_spill(self):
+        received, subscription = self.publish("spill", count=1000)
+        self.assertEqual(received, [str(i) for i in range(1000)])
+        self.assertEqual(subscription.dropped, 0)
+        self.assertEqual(len(subscription), 0)
+
+    def test_block(self):
+        broker = Broker()
+        received = []
+        broker.sub("app", received.append, queue_size=2, overflow="block")
+        broker.pub_many("app", [str(i) for i in range(100)])
+        broker.shutdown()
+        self.assertEqual(received, [str(i) for i in range(100)])
+
+    def test_invalid(self):
+        broker = Broker()
+        self.assertRaises(ValueError, broker.sub, "app", print, queue_size=1, overflow="nope")
+        self.assertRaises(ValueError, broker.sub, "app", print, queue_size=1, batch_size=1)
+        broker.shutdown()
+
+
+class TestRoutingIndex(unittest.TestCase):
+    def test_matches_naive_routing(self):
+        broker = Broker()
+        specs = [
+            (None, None), (["ERROR"], None), (None, ["DEBUG"]), (["ERROR", "WARN"], ["ignore"]),
+            ([r"user \d+"], None), (["(?i)error"], ["^x"]), ([r"(a)\1"], None), (["ERROR"], ["ignore"]),
+        ]
+        for triggers, filters in specs:
+            broker.sub("app", print, triggers=triggers, filters=filters)
+        _, index = broker.route("app.web")
+        for message in ["ERROR boom", "error ignore", "DEBUG user 12", "WARN aa", "x error", "nothing", ""]:
+            expected = [
+                pair for pair in index.subscribers
+                if any(t.search(message) for t in pair[0].triggers)
+                and not any(f.search(message) for f in pair[0].filters)
+            ]
+            self.assertEqual(index.select(message), expected, message)
+        broker.shutdown()
+
+    def test_backreference_after_group(self):
+        broker = Broker()
+        broker.sub("app", print, triggers=["(x)y"])
+        broker.sub("app", print, triggers=[r"(a)\1"])
+        _, index = broker.route("app")
+        self.assertEqual([s.triggers[0].pattern for s, _ in index.select("aa")], [r"(a)\1"])
+        self.assertEqual(len(index.select("xy")), 1)
+        self.assertEqual(index.select("ab"), [])
+        broker.shutdown()
+
+    def test_payloads_are_not_converted(self):
+        broker = Broker(max_workers=1)
+        received = []
+        broker.sub("app", received.append)
+        broker.sub("app", received.append, triggers=["ERROR"])
+        payload = {"level": "ERROR"}
+        broker.pub("app", payload)
+        broker.pub("app", b"ERROR bytes")
+        broker.pub("app", memoryview(b"INFO"))
+        broker.shutdown()
+        self.assertEqual(sum(1 for m in received if m is payload), 2)
+        self.assertEqual(received.count(b"ERROR bytes"), 2)
+        self.assertEqual(sum(1 for m in received if isinstance(m, memoryview)), 1)
+
+    def test_spill_keeps_types(self):
+        spill = _SpillFile()
+        messages = ["text", b"bytes", {"a": 1}]
+        for message in messages:
+            spill.append(message)
+        self.assertEqual([spill.popleft() for _ in messages], messages)
+        spill.close()
+
+
+class TestProcesses(unittest.TestCase):
+    def test_ring_wraps(self):
+        ring = SharedRing(16)
+        first, offset = ring.write(b"a" * 10, 1)
+        self.assertEqual(offset, 0)
+        ring.release(first)
+        second, offset = ring.write(b"b" * 10, 2)
+        # doesn't fit after the first message so starts over at 0
+        self.assertEqual((second, offset), (16, 0))
+        ring.release(second)
+        self.assertEqual(len(ring), 1)
+        ring.release(second)
+        self.assertEqual(len(ring), 0)
+        with self.assertRaises(ValueError):
+            ring.write(b"c" * 17, 1)
+        ring.close()
+
+    def test_ring_empty_takes_large_message(self):
+        ring = SharedRing(100)
+        start, _ = ring.write(b"x" * 60, 1)
+        ring.release(start)
+        # with nothing left in the ring, all of it is free again
+        self.assertEqual(ring.write(b"y" * 70, 1), (100, 0))
+        ring.close()
+
+    def test_process_subscribers(self):
+        broker = Broker(ring_size=1024 * 1024)
+        handler = ListHandler()
+        logger = logging.getLogger("big.measure")
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        try:
+            broker.sub("big", measure, processes=2)
+            broker.sub("big", measure, processes=1, triggers=["^y"])
+            payloads = ["x" * 300000, "y" * 300000, "fail"] * 4
+            for payload in payloads[:6]:
+                broker.pub("big", payload)
+            broker.pub_many("big", payloads[6:])
+            broker.shutdown()
+        finally:
+            logger.removeHandler(handler)
+        results = sorted(r.getMessage() for r in handler.records if r.levelno == logging.INFO)
+        self.assertEqual(results, ["x:300000"] * 4 + ["y:300000"] * 8)
+        errors = [r for r in handler.records if r.levelno == logging.ERROR]
+        self.assertEqual(len(errors), 4)
+        self.assertIn("ValueError", errors[0].getMessage())
+        self.assertEqual(len(broker._ring), 0)
+
+    @unittest.skipUnless(os.path.isdir("/dev/shm"), "shared memory isn't in /dev/shm")
+    @mock.patch("slither.broker.REAP_INTERVAL", 0.05)
+    def test_dead_process(self):
+        broker = Broker(ring_size=4096)
+        shm_name = None
+        try:
+            sub = broker.sub("big", measure, processes=1)
+            shm_name = broker._ring.name
+            broker.pub("big", "die")
+            # more than the ring holds, pub would wait forever if the
+            # slot of the message the process died on wasn't released
+            for _ in range(20):
+                broker.pub("big", "x" * 1000)
+        finally:
+            broker.shutdown()
+        self.assertEqual(len(broker._ring), 0)
+        self.assertGreaterEqual(sub.stats.failed, 1)
+        self.assertFalse(os.path.exists(os.path.join("/dev/shm", shm_name.lstrip("/"))))
+
+    @unittest.skipUnless(os.path.isdir("/dev/shm"), "shared memory isn't in /dev/shm")
+    def test_shutdown_without_wait_unlinks_ring(self):
+        broker = Broker()
+        broker.sub("big", measure, processes=1)
+        name = broker._ring.name
+        broker.shutdown(wait=False)
+        self.assertFalse(os.path.exists(os.path.join("/dev/shm", name.lstrip("/"))))
+
+    @unittest.skipUnless(os.path.isdir("/dev/shm"), "shared memory isn't in /dev/shm")
+    def test_unsub(self):
+        broker = Broker()
+        try:
+            sub = broker.sub("big", measure, processes=2)
+            broker.pub("big", "x" * 1000)
+            broker.unsub(sub)
+            self.assertFalse(any(process.is_alive() for process in sub.processes))
+        finally:
+            broker.shutdown()
+        # the collector forgets it once its last result is in
+        self.assertNotIn(sub.key, broker._process_subscriptions)
+        self.assertEqual(sub.stats.completed, 1)
+        self.assertEqual(len(broker._ring), 0)
+
+    def test_exclusive_options(self):
+        broker = Broker()
+        with self.assertRaises(ValueError):
+            broker.sub("a", measure, processes=1, queue_size=10)
+        broker.shutdown()
+
+
+class TestPubSubApp(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.original = pubsub_app.broker
+        pubsub_app.broker = Broker(journal=self.directory)
+        self.client = pubsub_app.test_client()
+
+    def tearDown(self):
+        pubsub_app.broker.shutdown()
+        pubsub_app.broker = self.original
+        shutil.rmtree(self.directory)
+
+    def events(self, response, count):
+        """Parse the first count events of a server-sent stream."""
+        events, buffered = [], ""
+        chunks = response.response
+        while len(events) < count:
+            buffered += next(chunks).decode()
+            *complete, buffered = buffered.split("\n\n")
+            for event in complete:
+                fields = dict(line.split(": ", 1) for line in event.splitlines() if not line.startswith(":"))
+                if "data" in fields:
+                    fields["data"] = json.loads(fields["data"])
+                    events.append(fields)
+        response.close()
+        return events
+
+    def test_pub_ndjson(self):
+        received = Collector()
+        pubsub_app.broker.sub("app", received)
+        lines = [{"topic": "app.web", "message": "a"}] * 3 + [{"topic": "app.db", "message": {"b": 1}}]
+        body = "\n".join(map(json.dumps, lines)) + "\n\nnot json\n"
+        response = self.client.post("/pub", data=body)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["published"], 4)
+        pubsub_app.broker.executor.shutdown()
+        self.assertEqual(sorted(map(str, received.messages)), ["a", "a", "a", "{'b': 1}"])
+
+    def test_stream_resumes(self):
+        broker = pubsub_app.broker
+        broker.pub_many("app.web", ["one", "two"])
+        broker.pub("app.db", "three")
+        events = self.events(self.client.get("/stream/app?since=0"), 3)
+        self.assertEqual([e["data"]["message"] for e in events], ["one", "two", "three"])
+        cursor = events[-1]["id"]
+        broker.pub("app.web", "four")
+        response = self.client.get("/stream/app", headers={"Last-Event-ID": cursor})
+        events = self.events(response, 1)
+        self.assertEqual(events[0]["data"], {"topic": "app.web", "offset": 2, "message": "four"})
+
+    def test_stream_without_journal(self):
+        pubsub_app.broker.shutdown()
+        broker = pubsub_app.broker = Broker()
+        response = self.client.get("/stream/app")
+        broker.pub("app.web", b"live")
+        events = self.events(response, 1)
+        self.assertEqual(events[0]["data"], {"message": "live"})
+        self.assertNotIn("app", broker.subscriptions)
+
+    def test_metrics(self):
+        broker = pubsub_app.broker
+        received = Collector()
+        broker.sub("app", received)
+        broker.sub("app", failing, triggers=["ERROR"])
+        broker.pub("app.web", "INFO ok")
+        broker.pub_many("app.web", ["ERROR bad", "INFO ok"])
+        broker.executor.shutdown()
+        snapshot = self.client.get("/metrics?format=json").get_json()
+        self.assertEqual(snapshot["topics"]["app.web"], {"published": 3, "matched": 4, "filtered": 2})
+        collector = snapshot["subscribers"]["app.Collector"]
+        self.assertEqual((collector["completed"], collector["in_flight"]), (3, 0))
+        self.assertEqual(snapshot["subscribers"]["app.failing"]["failed"], 1)
+        text = self.client.get("/metrics").get_data(as_text=True)
+        self.assertIn('slither_topic_published_total{topic="app.web"} 3', text)
+
+    def test_metrics_per_subscription(self):
+        broker = pubsub_app.broker
+        first = broker.sub("app", lambda message: None)
+        broker.sub("app", lambda message: None, triggers=["ERROR"])
+        broker.sub("app", Collector(), name="audit")
+        broker.pub("app.web", "INFO ok")
+        broker.executor.shutdown()
+        subscribers = broker.metrics.snapshot()["subscribers"]
+        self.assertEqual(
+            [subscribers[name]["completed"] for name in ("app.<lambda>", "app.<lambda>#2", "audit")],
+            [1, 0, 1],
+        )
+        broker.unsub(first)
+        self.assertEqual(sorted(broker.metrics.subscribers), ["app.<lambda>#2", "audit"])
+        again = broker.sub("app", lambda message: None)
+        self.assertEqual(again.stats.name, "app.<lambda>")
+        self.assertEqual(again.stats.completed, 0)
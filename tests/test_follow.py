@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+from slither.follow import Follower
+
+
+class TestFollower(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.pattern = os.path.join(self.tmpdir, "app.log*")
+        self.log = os.path.join(self.tmpdir, "app.log")
+        self.checkpoint = os.path.join(self.tmpdir, "checkpoint.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def append(self, data, filename=None):
+        with open(filename or self.log, "a") as fout:
+            fout.write(data)
+
+    def poll(self, follower):
+        lines = [line for batch in follower.poll() for line in batch]
+        follower.commit()
+        return lines
+
+    def test_partial_lines_wait_for_newline(self):
+        follower = Follower(self.pattern)
+        self.append("one\ntw")
+        self.assertEqual(self.poll(follower), ["one\n"])
+        self.append("o\n")
+        self.assertEqual(self.poll(follower), ["two\n"])
+        self.assertEqual(self.poll(follower), [])
+        follower.close()
+
+    def test_resume_from_checkpoint(self):
+        self.append("one\n")
+        follower = Follower(self.pattern, checkpoint=self.checkpoint)
+        self.assertEqual(self.poll(follower), ["one\n"])
+        follower.close()
+        self.append("two\n")
+        follower = Follower(self.pattern, checkpoint=self.checkpoint)
+        self.assertEqual(self.poll(follower), ["two\n"])
+        follower.close()
+
+    def test_rotation(self):
+        follower = Follower(os.path.join(self.tmpdir, "app.log"))
+        self.append("one\n")
+        self.assertEqual(self.poll(follower), ["one\n"])
+        # written after the last poll but before rotation
+        self.append("two\n")
+        os.rename(self.log, self.log + ".1")
+        self.append("three\n")
+        self.assertEqual(self.poll(follower), ["two\n", "three\n"])
+        follower.close()
+
+    def test_truncation(self):
+        follower = Follower(self.pattern)
+        self.append("one\ntwo\n")
+        self.assertEqual(self.poll(follower), ["one\n", "two\n"])
+        with open(self.log, "w") as fout:
+            fout.write("new\n")
+        with self.assertLogs("slither.follow", "WARNING"):
+            self.assertEqual(self.poll(follower), ["new\n"])
+        follower.close()
+
+    def test_rotated_files_are_closed(self):
+        follower = Follower(self.pattern)
+        for i in range(3):
+            self.append("{}\n".format(i))
+            self.assertEqual(self.poll(follower), ["{}\n".format(i)])
+            os.rename(self.log, "{}.{}".format(self.log, i))
+            # mtimes decide which file is the newest
+            os.utime("{}.{}".format(self.log, i), (1000 + i, 1000 + i))
+        self.append("new\n")
+        self.assertEqual(self.poll(follower), ["new\n"])
+        self.assertEqual(len(follower._files), 1)
+        self.append("more\n", self.log + ".2")
+        os.utime(self.log + ".2", (1000, 1000))
+        self.assertEqual(self.poll(follower), ["more\n"])
+        self.assertEqual(len(follower._files), 1)
+        follower.close()
@@ -0,0 +1,112 @@
+import os
+import re
+import gzip
+import shutil
+import tempfile
+import unittest
+from click.testing import CliRunner
+from slither import ginsu
+
+
+class TestAina(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as fout:
+            fout.write("a 1\nb 2\na 3\n")
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def run_script(self, script):
+        runner = CliRunner()
+        result = runner.invoke(ginsu.cli, ["slither", script, self.filename])
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result.output
+
+    def test_tests_and_actions(self):
+        output = self.run_script("""
+            BEGIN { total = 0 }
+            FIELDS[0] == "a" { total += int(FIELDS[1]) }
+            END { print(total) }
+        """)
+        self.assertEqual(output, "4\n")
+
+    def test_beginline_runs_once_per_line(self):
+        output = self.run_script("""
+            BEGIN { seen = 0 }
+            BEGINLINE { seen += 1 }
+            NR == 1 { pass }
+            NR == 2 { pass }
+            END { print(seen, NR) }
+        """)
+        self.assertEqual(output, "3 3\n")
+
+    def test_multiline_string_in_action(self):
+        output = self.run_script('NR == 1 { s = """a\nb"""; print(repr(s)) }')
+        self.assertEqual(output, "'a\\nb'\n")
+
+    def test_fields_are_split_lazily(self):
+        output = self.run_script("""
+            NR == 2 { print(FIELDS[1], [f for f in FIELDS]) }
+        """)
+        self.assertEqual(output, "2 ['b', '2']\n")
+
+    def test_bytes_mode(self):
+        runner = CliRunner()
+        result = runner.invoke(
+            ginsu.cli,
+            ["slither", "--bytes", "NR == 3 { print(FIELDS) }", self.filename]
+        )
+        self.assertEqual(result.output, "[b'a', b'3']\n")
+
+
+class TestSplitter(unittest.TestCase):
+    def test_literal_seperators(self):
+        self.assertEqual(ginsu._literal_seperator(","), ",")
+        self.assertEqual(ginsu._literal_seperator("\\t"), "\t")
+        self.assertEqual(ginsu._literal_seperator("\\|"), "|")
+        self.assertIsNone(ginsu._literal_seperator("\\s"))
+        self.assertIsNone(ginsu._literal_seperator("a|b"))
+
+    def test_splitters_match_regex(self):
+        for pattern, line in [(r"\s+", "a  b\tc"), (r"\s+", ""), (",", "a,,b"), ("a|b", "1a2b3")]:
+            self.assertEqual(ginsu._splitter(pattern)(line), re.split(pattern, line))
+            self.assertEqual(
+                ginsu._splitter(pattern, binary=True)(line.encode()),
+                re.split(pattern.encode(), line.encode()),
+            )
+
+
+class TestOutput(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "in.log")
+        with open(self.filename, "w") as fout:
+            fout.write("error one\nok\nerror two\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_filter_to_gzip_file(self):
+        output = os.path.join(self.tmpdir, "out.gz")
+        result = CliRunner().invoke(
+            ginsu.cli,
+            ["filter", self.filename, "-f", "lambda://'error' in x", "-o", output]
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+        with gzip.open(output, "rb") as fin:
+            self.assertEqual(fin.read(), b"error one\nerror two\n")
+
+    def test_filter_to_stdout(self):
+        result = CliRunner().invoke(
+            ginsu.cli,
+            ["filter", self.filename, "-f", "lambda://'error' in x"]
+        )
+        self.assertEqual(result.output, "error one\nerror two\n")
+
+    def test_aina_out(self):
+        result = CliRunner().invoke(
+            ginsu.cli,
+            ["slither", "'error' in LINE { OUT(FIELDS[1]) }", self.filename]
+        )
+        self.assertEqual(result.output, "one\ntwo\n")
@@ -0,0 +1,126 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from slither.journal import Journal, TopicLog, HEADER, INDEX_ENTRY
+from slither.broker import Broker
+
+
+class TestTopicLog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmpdir, "app")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_append_commit_read(self):
+        topic_log = TopicLog(self.directory, fsync=False)
+        messages = ["text", b"bytes", {"structured": [1, 2]}]
+        self.assertEqual([topic_log.append(m) for m in messages], [0, 1, 2])
+        # nothing is readable until it is committed
+        self.assertEqual(list(topic_log.read()), [])
+        topic_log.commit()
+        self.assertEqual([m for _, _, m in topic_log.read()], messages)
+        self.assertEqual([o for o, _, _ in topic_log.read(1)], [1, 2])
+        topic_log.close()
+
+    def test_segments_and_index(self):
+        topic_log = TopicLog(self.directory, segment_bytes=2000, index_interval=200, fsync=False)
+        for i in range(500):
+            topic_log.append("message {}".format(i), timestamp=1000.0 + i)
+        topic_log.close()
+        self.assertGreater(len(topic_log.segments), 5)
+        self.assertTrue(all(len(segment.index) > 1 for segment in topic_log.segments[:-1]))
+        # reopening finds every segment and the next offset
+        topic_log = TopicLog(self.directory, segment_bytes=2000, index_interval=200, fsync=False)
+        self.assertEqual(topic_log.next_offset, 500)
+        self.assertEqual([m for _, _, m in topic_log.read(123, 127)], ["message {}".format(i) for i in range(123, 127)])
+        self.assertEqual(len(list(topic_log.read())), 500)
+        self.assertEqual(topic_log.offset_at(1250.0), 250)
+        self.assertEqual(topic_log.offset_at(1250.5), 251)
+        self.assertEqual(topic_log.offset_at(0), 0)
+        self.assertEqual(topic_log.offset_at(5000.0), 500)
+        topic_log.close()
+
+    def test_recovers_from_partial_write(self):
+        topic_log = TopicLog(self.directory, fsync=False)
+        for i in range(10):
+            topic_log.append(str(i))
+        topic_log.close()
+        path = topic_log.segments[-1].log_path
+        with open(path, "ab") as fout:
+            fout.write(HEADER.pack(10, time.time(), 100, b"s") + b"only part of it")
+        topic_log = TopicLog(self.directory, fsync=False)
+        self.assertEqual(topic_log.next_offset, 10)
+        self.assertEqual(topic_log.append("10"), 10)
+        topic_log.commit()
+        self.assertEqual([m for _, _, m in topic_log.read()], [str(i) for i in range(11)])
+        topic_log.close()
+
+    def test_recovers_torn_indexed_record(self):
+        topic_log = TopicLog(self.directory, index_interval=1, fsync=False)
+        for i in range(4):
+            topic_log.append(str(i))
+        topic_log.close()
+        segment = topic_log.segments[-1]
+        with open(segment.log_path, "r+b") as fout:
+            fout.truncate(os.path.getsize(segment.log_path) - 2)
+        topic_log = TopicLog(self.directory, index_interval=1, fsync=False)
+        self.assertEqual(topic_log.next_offset, 3)
+        self.assertEqual(len(topic_log.segments[-1].index), 3)
+        self.assertEqual(os.path.getsize(segment.index_path), 3 * len(INDEX_ENTRY.pack(0, 0, 0.0)))
+        for i in range(3, 6):
+            topic_log.append(str(i))
+        topic_log.close()
+        topic_log = TopicLog(self.directory, index_interval=1, fsync=False)
+        self.assertEqual([o for o, _, _ in topic_log.read()], list(range(6)))
+        self.assertEqual([m for _, _, m in topic_log.read(3)], ["3", "4", "5"])
+        topic_log.close()
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_replay_beneath_topic(self):
+        journal = Journal(self.tmpdir, commit_interval=None, fsync=False)
+        journal.append("app.web", "a", timestamp=1.0)
+        journal.append("app.db", "b", timestamp=2.0)
+        journal.append("other", "c", timestamp=3.0)
+        journal.append("app", "d", timestamp=4.0)
+        journal.commit()
+        self.assertEqual([m for _, _, _, m in journal.replay("app")], ["a", "b", "d"])
+        self.assertEqual([m for _, _, _, m in journal.replay("app", since=1.5)], ["b", "d"])
+        journal.close()
+
+    def test_broker_replay_with_cursor(self):
+        broker = Broker(journal=os.path.join(self.tmpdir, "journal"))
+        broker.pub_many("app.web", [str(i) for i in range(10)])
+        broker.pub("app.db", {"i": 10})
+        received = []
+        self.assertEqual(broker.replay("app", received.append, cursor="audit"), 11)
+        self.assertEqual(received[:10], [str(i) for i in range(10)])
+        self.assertEqual(received[10], {"i": 10})
+
+        broker.pub("app.web", "11")
+        def failing(message):
+            if message == "12":
+                raise ValueError(message)
+            received.append(message)
+        broker.pub("app.web", "12")
+        self.assertRaises(ValueError, broker.replay, "app", failing, cursor="audit")
+        # 12 wasn't handled so it is delivered again
+        self.assertEqual(broker.replay("app", received.append, cursor="audit"), 1)
+        self.assertEqual(received[11:], ["11", "12"])
+        broker.shutdown()
+
+        # the journal and cursor outlive the broker
+        broker = Broker(journal=os.path.join(self.tmpdir, "journal"))
+        self.assertEqual(broker.replay("app", received.append, cursor="audit"), 0)
+        self.assertEqual(broker.replay("app.web", received.append, since=10), 2)
+        broker.shutdown()
@@ -0,0 +1,50 @@
+import re
+import unittest
+from slither.matchers import RegexFilter, required_literal, fuse, fusable
+
+
+class TestRequiredLiteral(unittest.TestCase):
+    def test_required_literal(self):
+        self.assertEqual(required_literal(r"timeout after \d+s"), "timeout after ")
+        self.assertEqual(required_literal(r"error (a|b) x+"), "error ")
+        self.assertIsNone(required_literal("foo|bar"))
+        self.assertIsNone(required_literal("(?i)error"))
+        self.assertIsNone(required_literal(r"\d+"))
+
+
+class TestRegexFilter(unittest.TestCase):
+    patterns = [r"error", r"timeout after \d+s", r"(?i)^GET ", r"(\w)\1", "[0-9]{3}"]
+    lines = [
+        "error: timeout after 30s\n",
+        "get 404 error\n",
+        "GET /index.html 200\n",
+        "all good\n",
+        "GET error timeout after 5s\n",
+        "",
+    ]
+
+    def expected(self, patterns, line, logical_operator):
+        return logical_operator(re.search(p, line) is not None for p in patterns)
+
+    def test_matches_separate_searches(self):
+        for logical_operator in (all, any):
+            for n in range(1, len(self.patterns) + 1):
+                patterns = self.patterns[:n]
+                f = RegexFilter(patterns, logical_operator)
+                for line in self.lines:
+                    self.assertEqual(
+                        f(line),
+                        self.expected(patterns, line, logical_operator),
+                        (patterns, line, logical_operator)
+                    )
+
+    def test_duplicate_group_names(self):
+        f = RegexFilter([r"(?P<x>a)", r"(?P<x>b)"], any)
+        self.assertTrue(f("b"))
+        self.assertFalse(f("c"))
+
+    def test_fuse_rejects_backreferences(self):
+        self.assertFalse(fusable(r"(a)\1"))
+        self.assertTrue(fusable(r"(a)b"))
+        with self.assertRaises(ValueError):
+            fuse(["(x)y", r"(a)\1"])
@@ -0,0 +1,102 @@
+import threading
+import unittest
+from unittest import mock
+from slither.metrics import Histogram, Metrics, OTHER_TOPICS
+
+
+class TestHistogram(unittest.TestCase):
+    def test_quantile(self):
+        histogram = Histogram([0.001, 0.01, 0.1])
+        for value in [0.0005] * 90 + [0.05] * 9:
+            histogram.observe(value)
+        histogram.observe(5.0)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.quantile(0.5), 0.001)
+        self.assertEqual(histogram.quantile(0.99), 0.1)
+        self.assertIsNone(histogram.quantile(1.0))
+        self.assertEqual(
+            list(histogram.cumulative()),
+            [(0.001, 90), (0.01, 90), (0.1, 99), (float("inf"), 100)],
+        )
+
+    def test_empty(self):
+        self.assertIsNone(Histogram().quantile(0.5))
+
+
+class TestMetrics(unittest.TestCase):
+    def test_render(self):
+        metrics = Metrics()
+        metrics.topic("app.web").add(10, 3, 12)
+        subscriber = metrics.register('app."quoted"')
+        subscriber.dispatch(3)
+        subscriber.complete(0.003, count=2, calls=2)
+        subscriber.fail()
+        self.assertEqual(metrics.snapshot()["topics"]["app.web"], {
+            "published": 10, "matched": 12, "filtered": 18,
+        })
+        snapshot = metrics.snapshot()["subscribers"]['app."quoted"']
+        self.assertEqual(snapshot["in_flight"], 0)
+        self.assertEqual(snapshot["duration"]["count"], 2)
+        lines = metrics.render().splitlines()
+        self.assertIn('slither_topic_filtered_total{topic="app.web"} 18', lines)
+        self.assertIn('slither_subscriber_failed_total{subscriber="app.\\"quoted\\""} 1', lines)
+        self.assertIn('slither_handler_duration_seconds_bucket{subscriber="app.\\"quoted\\"",le="0.0008"} 0', lines)
+        self.assertIn('slither_handler_duration_seconds_bucket{subscriber="app.\\"quoted\\"",le="0.0016"} 2', lines)
+
+    def test_register(self):
+        metrics = Metrics()
+        first = metrics.register("app.print")
+        second = metrics.register("app.print")
+        self.assertEqual((first.name, second.name), ("app.print", "app.print#2"))
+        metrics.unregister(first)
+        self.assertEqual(list(metrics.subscribers), ["app.print#2"])
+        self.assertEqual(metrics.register("app.print").name, "app.print")
+
+    def test_threads(self):
+        metrics = Metrics()
+        topic, subscriber = metrics.topic("app.web"), metrics.register("app.print")
+
+        def publish():
+            for _ in range(1000):
+                topic.add(1, 2, 1)
+                subscriber.dispatch()
+                subscriber.complete(0.001)
+
+        threads = [threading.Thread(target=publish) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(topic.snapshot(), {"published": 4000, "matched": 4000, "filtered": 4000})
+        snapshot = subscriber.snapshot()
+        self.assertEqual((snapshot["matched"], snapshot["in_flight"]), (4000, 0))
+        self.assertEqual(snapshot["duration"]["count"], 4000)
+
+    def test_ended_threads_are_folded(self):
+        metrics = Metrics()
+        topic, subscriber = metrics.topic("app.web"), metrics.register("app.print")
+
+        def publish():
+            topic.add(1, 1, 1)
+            subscriber.dispatch()
+            subscriber.complete(0.001)
+
+        for _ in range(100):
+            thread = threading.Thread(target=publish)
+            thread.start()
+            thread.join()
+        # nothing is left of the threads but their totals
+        self.assertEqual((len(topic._shards), len(subscriber._shards)), (0, 0))
+        self.assertEqual(topic.published, 100)
+        self.assertEqual(subscriber.snapshot()["completed"], 100)
+        self.assertEqual(subscriber.duration.count, 100)
+
+    def test_max_topics(self):
+        metrics = Metrics()
+        with mock.patch("slither.metrics.MAX_TOPICS", 3):
+            for i in range(10):
+                metrics.topic("app.user.{}".format(i)).add(1, 1, 1)
+            metrics.topic("app.user.0").add(1, 1, 1)
+        self.assertEqual(sorted(metrics.topics), ["(other)", "app.user.0", "app.user.1", "app.user.2"])
+        self.assertEqual(metrics.topic("app.user.0").published, 2)
+        self.assertEqual(metrics.topics[OTHER_TOPICS].published, 7)
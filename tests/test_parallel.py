@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from slither import parallel
+from slither.sources import iter_lines
+
+
+def _upper_unit(unit):
+    return [line.upper() for line in parallel.iter_unit(unit)]
+
+
+class TestChunking(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        self.lines = ["line {}\n".format(i) for i in range(1000)]
+        with os.fdopen(fd, "w") as fout:
+            fout.writelines(self.lines)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_chunks_cover_file_on_line_boundaries(self):
+        chunks = parallel.chunk_file(Path(self.filename), chunk_size=100)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], os.path.getsize(self.filename))
+        lines = []
+        for start, end in chunks:
+            lines.extend(iter_lines(self.filename, start, end))
+        self.assertEqual(lines, self.lines)
+
+    def test_run_parallel_ordered(self):
+        units = parallel.work_units(self.filename, chunk_size=100)
+        results = parallel.run_parallel(_upper_unit, units, jobs=2)
+        lines = [line for result in results for line in result]
+        self.assertEqual(lines, [line.upper() for line in self.lines])
+
+    def test_run_parallel_unordered(self):
+        units = parallel.work_units(self.filename, chunk_size=100)
+        results = parallel.run_parallel(_upper_unit, units, jobs=2, ordered=False)
+        lines = [line for result in results for line in result]
+        self.assertEqual(sorted(lines), sorted(line.upper() for line in self.lines))
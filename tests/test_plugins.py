@@ -0,0 +1,67 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from slither import plugins, ginsu
+
+
+class TestPluginRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.index = plugins.PluginIndex(cache_dir=self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lookup_loads_only_requested_plugin(self):
+        registry = plugins.PluginRegistry("ginsu.plugin", self.index)
+        self.assertIn("lambda", registry)
+        self.assertNotIn("no-such-plugin", registry)
+        self.assertIs(registry["lambda"], ginsu.lambda_plugin)
+        self.assertEqual(list(registry._loaded), ["lambda"])
+
+    def test_index_is_cached_until_sys_path_changes(self):
+        self.index.group("ginsu.plugin")
+        self.assertTrue(os.path.exists(self.index.filename))
+        with mock.patch.object(plugins, "_scan") as scan:
+            plugins.PluginIndex(cache_dir=self.tmpdir).group("ginsu.plugin")
+            scan.assert_not_called()
+        with open(self.index.filename, "r") as fin:
+            cached = json.load(fin)
+        cached["fingerprint"][0][1] -= 1
+        with open(self.index.filename, "w") as fout:
+            json.dump(cached, fout)
+        with mock.patch.object(plugins, "_scan", return_value={}) as scan:
+            plugins.PluginIndex(cache_dir=self.tmpdir).group("ginsu.plugin")
+            scan.assert_called_once_with()
+
+    def test_index_follows_entry_points_not_cwd(self):
+        site = os.path.join(self.tmpdir, "site")
+        os.makedirs(os.path.join(site, "plugin.egg-info"))
+        entry_points = os.path.join(site, "plugin.egg-info", "entry_points.txt")
+        with open(entry_points, "w") as fout:
+            fout.write("[ginsu.plugin]\n")
+        cwd = os.getcwd()
+        os.chdir(site)
+        try:
+            with mock.patch("sys.path", ["", site]):
+                with mock.patch.object(plugins, "_scan", return_value={}) as scan:
+                    plugins.PluginIndex(cache_dir=self.tmpdir).group("ginsu.plugin")
+                    # output written to the working directory
+                    with open(os.path.join(site, "out.txt"), "w") as fout:
+                        fout.write("output")
+                    os.utime(site, ns=(1, 1))
+                    plugins.PluginIndex(cache_dir=self.tmpdir).group("ginsu.plugin")
+                    self.assertEqual(scan.call_count, 1)
+                    # rewritten in place by setup.py develop
+                    os.utime(entry_points, ns=(2, 2))
+                    plugins.PluginIndex(cache_dir=self.tmpdir).group("ginsu.plugin")
+                    self.assertEqual(scan.call_count, 2)
+        finally:
+            os.chdir(cwd)
+
+    def test_load_entry_point_value(self):
+        self.assertIs(plugins.load("os.path:join"), os.path.join)
+        self.assertIs(plugins.load("os.path : join [extra]"), os.path.join)
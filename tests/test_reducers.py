@@ -0,0 +1,55 @@
+import unittest
+from functools import reduce
+from urllib.parse import urlparse
+from slither import reducers
+
+
+def run(url, *chunks):
+    """Accumulate each chunk seperately then merge, as ginsu does."""
+    reducer = reducers.reducer_plugin(urlparse(url))
+    partials = [reducer.accumulate(reducer.initial(), chunk) for chunk in chunks]
+    return reducer.lines(reduce(reducer.merge, partials, reducer.initial()))
+
+
+class TestReducers(unittest.TestCase):
+    def test_count(self):
+        self.assertEqual(run("reducer://count", ["a\n", "b\n"], [], ["c\n"]), [3])
+
+    def test_sum_min_max_of_field(self):
+        chunks = (["a 1\n", "b 5\n"], ["c -2\n"], [])
+        self.assertEqual(run("reducer://sum?field=1", *chunks), [4.0])
+        self.assertEqual(run("reducer://min?field=1", *chunks), [-2.0])
+        self.assertEqual(run("reducer://max?field=1", *chunks), [5.0])
+        self.assertEqual(run("reducer://max?field=1", []), [None])
+
+    def test_groupby_and_top(self):
+        chunks = (["a,1\n", "b,2\n"], ["a,3\n"])
+        self.assertEqual(
+            sorted(run("reducer://groupby?field=0&sep=,", *chunks)),
+            ["1\tb", "2\ta"]
+        )
+        self.assertEqual(run("reducer://top?field=0&sep=,&k=1", *chunks), ["2\ta"])
+
+    def test_groupby_last_field(self):
+        chunks = (["1,a\n", "2,b\r\n"], ["3,a"])
+        self.assertEqual(
+            sorted(run("reducer://groupby?field=1&sep=,", *chunks)),
+            ["1\tb", "2\ta"]
+        )
+
+    def test_distinct_is_approximately_right(self):
+        chunks = [
+            ["{}\n".format(i) for i in range(start, start + 20000)]
+            for start in (0, 10000, 20000)
+        ]
+        estimate, = run("reducer://distinct", *chunks)
+        self.assertAlmostEqual(estimate, 40000, delta=40000 * 0.03)
+        self.assertEqual(run("reducer://distinct", ["x\n"] * 10), [1])
+
+    def test_unknown_reducer(self):
+        with self.assertRaises(ValueError):
+            run("reducer://median", [])
+
+    def test_plain_functions_are_not_combinable(self):
+        self.assertFalse(reducers.is_combinable(max))
+        self.assertTrue(reducers.is_combinable(reducers.Count()))
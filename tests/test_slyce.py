@@ -0,0 +1,230 @@
+import io
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from lxml import etree
+from click.testing import CliRunner
+from slither import slyce, sinks
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+def reference_xml(line):
+    """The original, ancestor walking implementation of slyce.xml"""
+    line = etree.fromstring(line)
+    for node in line.xpath("//*"):
+        if node.text:
+            key = ".".join(reversed([n.tag for n in node.iterancestors()])) + "." + node.tag
+            yield (key, node.text)
+        for k, v in node.attrib.items():
+            key = ".".join(reversed([n.tag for n in node.iterancestors()]))
+            key = key + "." + node.tag + "@" + k if key else node.tag + "@" + k
+            yield (key, v)
+
+
+DOCUMENTS = [
+    '<event ts="1" level="INFO"><host>web-01</host><req id="7"><ms>12</ms></req></event>',
+    '<a>root text<b x="1">one</b><b>two</b><!-- comment --><c><d><e y="2">deep</e></d></c></a>',
+]
+
+
+class TestXML(unittest.TestCase):
+    def test_matches_reference(self):
+        for doc in DOCUMENTS:
+            self.assertEqual(sorted(slyce.xml(doc)), sorted(reference_xml(doc)))
+
+    def test_xml_records(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "export.xml")
+            with open(filename, "w") as fout:
+                fout.write("<export>\n")
+                for doc in DOCUMENTS[:1] * 3:
+                    fout.write("  {}\n".format(doc))
+                fout.write("</export>\n")
+            records = list(slyce.xml_records(filename, "event"))
+            self.assertEqual(len(records), 3)
+            self.assertIn(("export.event.host", "web-01"), records[0])
+            self.assertIn(("export.event@level", "INFO"), records[0])
+            result = CliRunner().invoke(
+                slyce.main,
+                [filename, "--xml-records", "event", "-f", "export.event.req.ms", "-f", "export.event@ts"]
+            )
+            self.assertEqual(result.output, "export.event.req.ms,export.event@ts\n" + "12,1\n" * 3)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestProjection(unittest.TestCase):
+    def test_xml_projection(self):
+        for doc in DOCUMENTS:
+            pairs = list(slyce.xml(doc))
+            for fieldnames in (["event.req.ms"], ["event@level", "event.host"], [".a", "a.c.d.e@y"], ["a.b"]):
+                projected = slyce.project(slyce.xml, fieldnames)
+                self.assertEqual(
+                    sorted(projected(doc)),
+                    sorted(pair for pair in pairs if pair[0] in fieldnames),
+                )
+
+    def test_xml_projection_skips_unrelated_lines(self):
+        projected = slyce.project(slyce.xml, ["event.host"])
+        # not well-formed, so this would raise if it were parsed
+        self.assertEqual(list(projected("<other><unclosed></other>")), [])
+
+    def test_regex_projection(self):
+        import re
+        step = slyce.regex(re.compile(r"(\w+)=(\w+)"))
+        projected = slyce.project(step, ["b", "c"])
+        self.assertEqual(projected("a=1 b=2 c=3 b=4"), [("b", "2"), ("c", "3"), ("b", "4")])
+        self.assertEqual(projected("a=1 d=2"), [])
+        self.assertIs(slyce.project(step, []), step)
+
+    def test_first_match(self):
+        steps = [lambda line: [("a", "1"), ("b", "2"), ("a", "3")], lambda line: 1 / 0]
+        self.assertEqual(list(slyce._pairs("", steps, ["a", "b"], first_match=True)), [("a", "1"), ("b", "2")])
+
+
+class TestOutput(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "events.log")
+        with open(self.filename, "w") as fout:
+            for i in range(500):
+                fout.write('<event ts="{}"><msg>hello, "world"</msg><n>{}</n><n>x</n></event>\n'.format(i, i))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def invoke(self, *args):
+        result = CliRunner().invoke(
+            slyce.main,
+            [self.filename, "-x", "slither.slyce:xml", "-f", "event@ts", "-f", "event.msg", "-f", "event.n", "-f", "missing"] + list(args)
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result.output
+
+    def test_csv_quoting(self):
+        lines = self.invoke().splitlines()
+        self.assertEqual(lines[0], "event@ts,event.msg,event.n,missing")
+        self.assertEqual(lines[1], '0,"hello, ""world""",0 x,')
+        self.assertEqual(len(lines), 501)
+
+    def test_csv_buffering(self):
+        stream = io.BytesIO()
+        writes = []
+        stream.write = lambda data: writes.append(len(data))
+        sink = sinks.CSVSink(stream, buffer_size=1024, close_stream=False)
+        sink.writelines(("x" * 100, i) for i in range(1000))
+        sink.flush()
+        self.assertGreater(len(writes), 50)
+        self.assertLess(max(writes), 1024 + 200)
+
+    def test_jobs(self):
+        expected = self.invoke()
+        self.assertEqual(self.invoke("-j", "2", "--chunk-size", "1000"), expected)
+        unordered = self.invoke("-j", "2", "--chunk-size", "1000", "--unordered")
+        self.assertEqual(sorted(unordered.splitlines()), sorted(expected.splitlines()))
+
+    def test_jsonl(self):
+        output = os.path.join(self.tmpdir, "out.jsonl")
+        self.invoke("--format", "jsonl", "--batch-size", "100", "-o", output)
+        with open(output) as fin:
+            rows = [json.loads(line) for line in fin]
+        self.assertEqual(len(rows), 500)
+        self.assertEqual(rows[7], {"event@ts": 7, "event.msg": 'hello, "world"', "event.n": "7 x", "missing": None})
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_columnar(self):
+        import pyarrow.parquet
+        import pyarrow.feather
+        for fmt, read in (("parquet", pyarrow.parquet.read_table), ("feather", pyarrow.feather.read_table)):
+            output = os.path.join(self.tmpdir, "out." + fmt)
+            self.invoke("--format", fmt, "--batch-size", "64", "-j", "2", "--chunk-size", "1000", "-o", output)
+            table = read(output)
+            self.assertEqual(table.num_rows, 500)
+            self.assertEqual(str(table.schema.field("event@ts").type), "int64")
+            self.assertEqual(table.column("event@ts").to_pylist(), list(range(500)))
+            self.assertEqual(table.column("missing").null_count, 500)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_column_type_changes(self):
+        import pyarrow.parquet
+        with open(self.filename, "w") as fout:
+            for i in range(100):
+                fout.write("<event><n>{}</n></event>\n".format(i))
+            fout.write("<event><n>n/a</n></event>\n")
+        output = os.path.join(self.tmpdir, "out.parquet")
+        args = [self.filename, "-x", "slither.slyce:xml", "-f", "event.n", "--format", "parquet", "--batch-size", "64", "-o", output]
+        result = CliRunner().invoke(slyce.main, args)
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("'n/a'", result.output)
+        # the batch before the bad one is still a complete file
+        self.assertEqual(pyarrow.parquet.read_table(output).num_rows, 64)
+        result = CliRunner().invoke(slyce.main, args + ["--column-type", "event.n=str"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(pyarrow.parquet.read_table(output).column("event.n").to_pylist()[-2:], ["99", "n/a"])
+
+
+class TestRegexExtractor(unittest.TestCase):
+    pattern = r'^(?P<ip>\S+) .*" (?P<status>\d{3}) (?P<size>\d+|-)(?: (?P<ms>\d+)ms)?'
+    lines = [
+        '10.0.0.1 - - [01/Jan/2018] "GET / HTTP/1.1" 200 512 13ms\n',
+        '10.0.0.2 - - [01/Jan/2018] "GET /x HTTP/1.1" 404 -\n',
+        'garbage\n',
+    ]
+
+    def test_named_groups(self):
+        extract = slyce.RegexExtractor(self.pattern)
+        self.assertEqual(extract(self.lines[0]), [("ip", "10.0.0.1"), ("status", "200"), ("size", "512"), ("ms", "13")])
+        # groups which didn't match are left out
+        self.assertEqual(extract(self.lines[1]), [("ip", "10.0.0.2"), ("status", "404"), ("size", "-")])
+        self.assertEqual(extract.batch(self.lines), [extract(line) for line in self.lines])
+        projected = slyce.project(extract, ["status"])
+        self.assertEqual(projected.batch(self.lines), [[("status", "200")], [("status", "404")], ()])
+        self.assertRaises(ValueError, slyce.RegexExtractor, r"(\d+)")
+
+    def test_regex_scheme(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "access.log")
+            with open(filename, "w") as fout:
+                fout.writelines(self.lines * 3)
+            result = CliRunner().invoke(
+                slyce.main,
+                [filename, "-x", "regex://" + self.pattern, "-f", "status", "-f", "ms", "--first-match"]
+            )
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(result.output, "status,ms\n" + "200,13\n404,\n" * 3)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestJSON(unittest.TestCase):
+    def test_same_keys_as_xml(self):
+        self.assertEqual(
+            sorted(slyce.json('{"event": {"host": "web-01", "req": {"ms": 12}}}')),
+            sorted(slyce.xml("<event><host>web-01</host><req><ms>12</ms></req></event>")),
+        )
+
+    def test_flatten(self):
+        line = '{"a": {"b": [1, {"c": true}], "d": null}, "e": "x", "f": 1.5}'
+        expected = [("a.b", "1"), ("a.b.c", "true"), ("e", "x"), ("f", "1.5")]
+        self.assertEqual(slyce.json(line), expected)
+        # the second time through uses the cached plans
+        self.assertEqual(slyce.json(line), expected)
+        self.assertEqual(slyce.json('{"e": "y", "a": 2}'), [("e", "y"), ("a", "2")])
+
+    def test_projection(self):
+        line = '{"a": {"b": [1, {"c": true}], "d": null}, "e": "x", "f": 1.5}'
+        for fieldnames in (["a.b.c"], ["e", "f"], ["a.b"], ["a"]):
+            projected = slyce.project(slyce.json, fieldnames)
+            self.assertEqual(
+                projected(line),
+                [pair for pair in slyce.json(line) if pair[0] in fieldnames],
+            )
+        # not valid JSON, so this would raise if it were parsed
+        self.assertEqual(slyce.project(slyce.json, ["zzz"])("{"), [])
@@ -0,0 +1,54 @@
+import os
+import bz2
+import gzip
+import lzma
+import shutil
+import tempfile
+import unittest
+from slither.sources import iter_lines, detect_compression
+
+
+class TestIterLines(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = b"first\nsecond\nno newline"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, opener=open):
+        filename = os.path.join(self.tmpdir, name)
+        with opener(filename, "wb") as fout:
+            fout.write(self.data)
+        return filename
+
+    def test_plain_file(self):
+        filename = self.write("plain.log")
+        self.assertIsNone(detect_compression(filename))
+        self.assertEqual(list(iter_lines(filename)), ["first\n", "second\n", "no newline"])
+        self.assertEqual(list(iter_lines(filename, binary=True)), self.data.splitlines(True))
+
+    def test_byte_range(self):
+        filename = self.write("plain.log")
+        self.assertEqual(list(iter_lines(filename, 6, 13)), ["second\n"])
+        self.assertEqual(list(iter_lines(filename, 6, 7)), ["second\n"])
+        self.assertEqual(list(iter_lines(filename, 6, 14, binary=True)), [b"second\n", b"no newline"])
+        self.assertEqual(list(iter_lines(filename, 24, 30)), [])
+
+    def test_crlf(self):
+        self.data = b"first\r\nsecond\r\nno newline"
+        filename = self.write("windows.log")
+        self.assertEqual(list(iter_lines(filename)), ["first\n", "second\n", "no newline"])
+        self.assertEqual(list(iter_lines(filename, binary=True)), [b"first\r\n", b"second\r\n", b"no newline"])
+        self.assertEqual(list(iter_lines(filename, 7, 8)), ["second\n"])
+
+    def test_empty_file(self):
+        self.data = b""
+        self.assertEqual(list(iter_lines(self.write("empty.log"))), [])
+
+    def test_compressed_files(self):
+        # extensions are deliberately misleading, detection uses magic bytes
+        for opener in (gzip.open, bz2.open, lzma.open):
+            filename = self.write("archive.log", opener)
+            self.assertIsNotNone(detect_compression(filename))
+            self.assertEqual(list(iter_lines(filename)), ["first\n", "second\n", "no newline"])